@@ -1,6 +1,10 @@
+import concurrent.futures
+import functools
+import glob
 import os
 import plistlib
 import re
+import threading
 
 from fontTools import ttLib
 
@@ -50,6 +54,30 @@ opsz_names = [
 ]
 
 
+# (index, lowercase variant) of each name list; a name list entry matches
+# if one of its variants is part of the (lowercase) font name
+_opsz_variants = [
+    (index, variant) for index, variants in enumerate(opsz_names) for
+    variant in variants]
+_width_variants = [
+    (index, variant) for index, variants in enumerate(width_names) for
+    variant in variants]
+_weight_variants = list(enumerate(weight_names))
+
+_italic_expression = re.compile(r'.*(it)(alic)?.*', re.IGNORECASE)
+_index_expression = re.compile(r'.+?(\d+?)')
+
+# memoized PostScript names: absolute path -> (mtime, name)
+_name_cache = {}
+# memoized designspace files: absolute path -> (mtime, (axes, locations))
+_designspace_cache = {}
+_name_cache_lock = threading.Lock()
+
+
+def _matching_indices(variants, name):
+    return [index for index, variant in variants if variant in name]
+
+
 def find_longest_match(name_list, match_indices):
     found_names = [
         (len(name), name) for (name_index, name) in enumerate(name_list) if
@@ -67,7 +95,18 @@ def base_file_name(file):
     return style_name
 
 
-def get_ps_font_name(font):
+def _name_source(font):
+    '''
+    The file a font’s name is read from, and its modification time.
+    '''
+    if os.path.isdir(font):  # UFO
+        source = os.path.join(font, 'fontinfo.plist')
+    else:
+        source = font
+    return source, os.stat(source).st_mtime_ns
+
+
+def _read_ps_font_name(font):
 
     if os.path.isdir(font):  # UFO
 
@@ -85,79 +124,314 @@ def get_ps_font_name(font):
             ])
 
     else:
-        ttf = ttLib.TTFont(os.path.abspath(font))
-        name_table = ttf.get('name')
-        name_records = name_table.names
-        ps_font_name = [
-            nr.toUnicode() for nr in name_records if nr.nameID == 6][0]
+        # only the name table is read and decompiled
+        with ttLib.TTFont(os.path.abspath(font), lazy=True) as ttf:
+            name_records = ttf['name'].names
+            ps_font_name = [
+                nr.toUnicode() for nr in name_records if nr.nameID == 6][0]
 
     return ps_font_name
 
 
-def sort_fonts(all_fonts, italics_interspersed=False, debug=False):
+def get_ps_font_name(font):
+    '''
+    PostScript name of a UFO or font binary path, memoized until the
+    file it is read from is modified.
+    '''
+    path = os.path.abspath(font)
+    _, mtime = _name_source(path)
+    with _name_cache_lock:
+        cached = _name_cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    ps_font_name = _read_ps_font_name(path)
+    with _name_cache_lock:
+        _name_cache[path] = (mtime, ps_font_name)
+    return ps_font_name
+
+
+def get_ps_font_names(fonts, workers=None):
+    '''
+    PostScript names of a list of fonts, read in a thread pool.
+    '''
+    fonts = list(fonts)
+    if len(fonts) < 2 or workers == 1:
+        return [get_ps_font_name(font) for font in fonts]
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        return list(executor.map(get_ps_font_name, fonts))
+
+
+@functools.lru_cache(maxsize=None)
+def get_style_scores(ps_font_name):
+    '''
+    Scores optical size, width, weight (index in the lists above) and
+    master index number of a font name.
+    '''
+    lower_name = ps_font_name.lower()
+    # Removing spaces from style name, so “Extra Condensed” and
+    # “ExtraCondensed” both work.
+    compact_name = lower_name.replace(' ', '')
+
+    # finding and scoring optical size
+    opsz_matches = _matching_indices(_opsz_variants, lower_name)
+    if opsz_matches:
+        opsz_score = find_longest_match(opsz_names, opsz_matches)
+    else:
+        normal_index = opsz_names.index(['normal'])
+        opsz_score = normal_index
+
+    # finding and scoring width
+    width_matches = _matching_indices(_width_variants, compact_name)
+    if width_matches:
+        width_score = find_longest_match(width_names, width_matches)
+    else:
+        normal_index = width_names.index(['normal'])
+        width_score = normal_index
+
+    # finding and scoring weight
+    weight_matches = _matching_indices(_weight_variants, compact_name)
+    if weight_matches:
+        weight_score = find_longest_match(weight_names, weight_matches)
+    else:
+        normal_index = weight_names.index('regular')
+        weight_score = normal_index
+
+    # there may be an index number at the end (Source Serif Masters)
+    index_match = _index_expression.match(ps_font_name)
+    if index_match:
+        index_score = int(index_match.group(1))
+    else:
+        index_score = 0
+
+    return opsz_score, width_score, weight_score, index_score
+
+
+def get_axis_scores(font):
+    '''
+    Approximate design location of a font or UFO path, from the
+    optical size, width and weight named in its PostScript name.
+    '''
+    opsz_score, width_score, weight_score, _ = get_style_scores(
+        get_ps_font_name(font))
+    return {'opsz': opsz_score, 'width': width_score, 'weight': weight_score}
+
+
+def read_designspace(designspace_path):
+    '''
+    Returns the axes ((tag, name) tuples, in document order) and a
+    {UFO path: {axis name: value}} dict of the sources in a .designspace
+    file. Axes missing from a source location are at their default.
+    The file is parsed once, and again only if it has been modified.
+    '''
+    from fontTools.designspaceLib import DesignSpaceDocument
+
+    path = os.path.abspath(designspace_path)
+    mtime = os.stat(path).st_mtime_ns
+    with _name_cache_lock:
+        cached = _designspace_cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    doc = DesignSpaceDocument.fromfile(path)
+    axes = [(axis.tag, axis.name) for axis in doc.axes]
+    defaults = {axis.name: axis.default for axis in doc.axes}
+    locations = {}
+    for source in doc.sources:
+        if source.path is None or source.layerName:
+            continue
+        location = dict(defaults)
+        location.update(source.location)
+        locations[os.path.normpath(source.path)] = location
+    with _name_cache_lock:
+        _designspace_cache[path] = (mtime, (axes, locations))
+    return axes, locations
+
+
+def get_designspace_locations(designspace_path):
+    '''
+    Returns a {UFO path: {axis name: value}} dict of the sources
+    in a .designspace file.
+    '''
+    _, locations = read_designspace(designspace_path)
+    return dict(locations)
+
+
+def find_designspace(font_paths):
+    '''
+    Returns the path of a .designspace file (next to the UFOs, or one
+    directory up) which has a source for each of the UFOs, None if there
+    is no such file.
+    '''
+    font_paths = [os.path.normpath(os.path.abspath(p)) for p in font_paths]
+    directories = []
+    for font_path in font_paths:
+        directory = os.path.dirname(font_path)
+        for candidate in (directory, os.path.dirname(directory)):
+            if candidate not in directories:
+                directories.append(candidate)
+    for directory in directories:
+        for ds_path in sorted(
+            glob.glob(os.path.join(directory, '*.designspace'))
+        ):
+            try:
+                _, locations = read_designspace(ds_path)
+            except Exception:
+                # not a readable designspace file
+                continue
+            if all(font_path in locations for font_path in font_paths):
+                return ds_path
+    return None
+
+
+class AxisGrid(object):
+    '''
+    Masters on the grid of all source coordinates of a designspace.
+    Every axis has the sorted list of coordinates used by any master,
+    and every master a cell: a tuple of indices into these lists, in
+    axis order.
+    '''
+
+    def __init__(self, axes, locations):
+        self.axes = list(axes)
+        self.locations = list(locations)
+        self.axis_names = [name for _, name in self.axes]
+        self.coordinates = {
+            name: sorted(set(loc[name] for loc in self.locations)) for
+            name in self.axis_names}
+        self.cells = [
+            tuple(
+                self.coordinates[name].index(loc[name]) for
+                name in self.axis_names)
+            for loc in self.locations]
+        self.cell_masters = {}
+        for master, cell in enumerate(self.cells):
+            self.cell_masters.setdefault(cell, []).append(master)
+
+    @classmethod
+    def from_designspace(cls, font_paths, designspace_path):
+        '''
+        Grid of some sources of a designspace, in the order of *font_paths*.
+        '''
+        axes, locations = read_designspace(designspace_path)
+        master_locations = []
+        for font_path in font_paths:
+            location = locations.get(os.path.normpath(os.path.abspath(
+                font_path)))
+            if location is None:
+                raise ValueError('{} is not a source in {}'.format(
+                    font_path, designspace_path))
+            master_locations.append(location)
+        return cls(axes, master_locations)
+
+    @property
+    def shape(self):
+        return tuple(len(self.coordinates[name]) for name in self.axis_names)
+
+    def masters_at(self, cell):
+        return list(self.cell_masters.get(tuple(cell), []))
+
+    def neighbours(self, master, axis_name):
+        '''
+        The nearest masters before and after *master* along one axis,
+        at the same coordinates on all other axes (None if there are none).
+        '''
+        axis = self.axis_names.index(axis_name)
+        cell = self.cells[master]
+        before = after = None
+        for other, other_cell in enumerate(self.cells):
+            if other == master or any(
+                a != b for i, (a, b) in enumerate(zip(cell, other_cell)) if
+                i != axis
+            ):
+                continue
+            position = other_cell[axis]
+            if position < cell[axis]:
+                if before is None or position > self.cells[before][axis]:
+                    before = other
+            elif position > cell[axis]:
+                if after is None or position < self.cells[after][axis]:
+                    after = other
+        return before, after
+
+    def axis_order(self, italics_interspersed=False):
+        '''
+        Axis names from the slowest to the fastest varying in a sort:
+        optical size, width, italic and slant, weight, then all other
+        axes (in document order). With *italics_interspersed*, italic and
+        slant vary fastest, so Italics follow their related Romans.
+        '''
+        italic_tags = ['ital', 'slnt']
+        if italics_interspersed:
+            leading_tags = ['opsz', 'wdth', 'wght']
+            trailing_tags = italic_tags
+        else:
+            leading_tags = ['opsz', 'wdth'] + italic_tags + ['wght']
+            trailing_tags = []
+        tags = dict(self.axes)
+        leading = [tags[tag] for tag in leading_tags if tag in tags]
+        trailing = [tags[tag] for tag in trailing_tags if tag in tags]
+        others = [
+            name for name in self.axis_names if
+            name not in leading and name not in trailing]
+        return leading + others + trailing
+
+    def sort_key(self, master, italics_interspersed=False):
+        location = self.locations[master]
+        return tuple(
+            location[name] for name in self.axis_order(italics_interspersed))
+
+
+def sort_fonts_by_designspace(
+    all_fonts, designspace_path, italics_interspersed=False, debug=False
+):
+    '''
+    Sort a list of UFO paths by their source locations in a .designspace
+    file. The masters themselves are not opened. Masters at the same
+    location keep their order in *all_fonts*, masters which are not a
+    source of the designspace are appended in alphabetical order.
+    '''
+    _, locations = read_designspace(designspace_path)
+    sources = [
+        f for f in all_fonts if
+        os.path.normpath(os.path.abspath(f)) in locations]
+    remaining_fonts = sorted(set(all_fonts) - set(sources))
+
+    grid = AxisGrid.from_designspace(sources, designspace_path)
+    order = sorted(
+        range(len(sources)),
+        key=lambda master: grid.sort_key(master, italics_interspersed))
+    sorted_fonts = [sources[master] for master in order]
+
+    if debug:
+        for f in remaining_fonts:
+            print(
+                'not in designspace',
+                os.path.dirname(f),
+                os.path.basename(f))
+    return sorted_fonts + remaining_fonts
+
+
+def sort_fonts(
+    all_fonts, italics_interspersed=False, debug=False, designspace_path=None
+):
     '''
     Sort a list of font- or UFO paths by a hard-coded list of
-    example style names.
+    example style names, or by their locations in a .designspace file
+    (see sort_fonts_by_designspace).
     '''
+    if designspace_path is not None:
+        return sort_fonts_by_designspace(
+            all_fonts, designspace_path, italics_interspersed, debug)
 
     matches = {}
-    for f in all_fonts:
-
-        opsz_matches = []
-        width_matches = []
-        weight_matches = []
-        ps_font_name = get_ps_font_name(f)
-
-        # finding and scoring optical size
-        for opsz_index, opsz_name_list in enumerate(opsz_names):
-            for opsz_name_variant in opsz_name_list:
-                opsz_expression = re.compile(
-                    rf'(.+?)?({opsz_name_variant})(.+?)?', re.IGNORECASE)
-                if re.match(opsz_expression, ps_font_name):
-                    opsz_matches.append(opsz_index)
-        if opsz_matches:
-            opsz_score = find_longest_match(opsz_names, opsz_matches)
-        else:
-            normal_index = opsz_names.index(['normal'])
-            opsz_score = normal_index
-
-        # finding and scoring width
-        for width_index, width_name_list in enumerate(width_names):
-            for width_name_variant in width_name_list:
-                width_expression = re.compile(
-                    rf'(.+?)?( )?({width_name_variant})( )?(.+?)?', re.IGNORECASE)
-                # Removing spaces from style name, so “Extra Condensed” and
-                # “ExtraCondensed” both work.
-                if re.match(width_expression, ps_font_name.replace(' ', '')):
-                    width_matches.append(width_index)
-        if width_matches:
-            width_score = find_longest_match(width_names, width_matches)
-        else:
-            normal_index = width_names.index(['normal'])
-            width_score = normal_index
-
-        # finding and scoring weight
-        for weight_index, weight_name in enumerate(weight_names):
-            weight_expression = re.compile(
-                rf'(.+?)?({weight_name})(.+?)?', re.IGNORECASE)
-            if re.match(weight_expression, ps_font_name.replace(' ', '')):
-                weight_matches.append(weight_index)
-
-            if weight_matches:
-                weight_score = find_longest_match(weight_names, weight_matches)
-            else:
-                normal_index = weight_names.index('regular')
-                weight_score = normal_index
+    ps_font_names = get_ps_font_names(all_fonts)
+    for f, ps_font_name in zip(all_fonts, ps_font_names):
 
-        # there may be an index number at the end (Source Serif Masters)
-        index_match = re.match(r'.+?(\d+?)', ps_font_name)
-        if index_match:
-            index_score = int(index_match.group(1))
-        else:
-            index_score = 0
+        opsz_score, width_score, weight_score, index_score = get_style_scores(
+            ps_font_name)
 
         if italics_interspersed:
-            if re.match(r'.*(it)(alic)?.*', ps_font_name, re.IGNORECASE):
+            if _italic_expression.match(ps_font_name):
                 it_score = 1
             else:
                 it_score = 0
@@ -165,7 +439,7 @@ def sort_fonts(all_fonts, italics_interspersed=False, debug=False):
                 f'{opsz_score:03d}{width_score:03d}'
                 f'{weight_score:03d}{index_score:02d}{it_score}')
         else:
-            if re.match(r'.*(it)(alic)?.*', ps_font_name, re.IGNORECASE):
+            if _italic_expression.match(ps_font_name):
                 weight_score += 100
             style_hash = (
                 f'{opsz_score:03d}{width_score:03d}'
@@ -236,21 +510,37 @@ if __name__ == '__main__':
         default=False,
         help=('Italics adjacent to their related Romans'))
 
+    parser.add_argument(
+        '-d', '--designspace',
+        action='store',
+        metavar='FILE',
+        help=(
+            'Sort by the source locations in a designspace file '
+            '(default: a designspace next to the UFOs, if there is one).'))
+
     args = parser.parse_args()
 
     if args.input_dir and os.path.exists(args.input_dir):
         font_list = get_font_paths(args.input_dir)
+        designspace_path = args.designspace
+        if font_list and designspace_path is None:
+            designspace_path = find_designspace(font_list)
         if font_list:
             print('unsorted:')
-            for font in font_list:
-                print(get_ps_font_name(font))
+            for ps_font_name in get_ps_font_names(font_list):
+                print(ps_font_name)
             print()
+            if designspace_path:
+                print('locations from', designspace_path)
+                print()
             sorted_fonts = sort_fonts(
                 font_list,
                 args.italics_interspersed,
-                debug=True
+                debug=True,
+                designspace_path=designspace_path
             )
             print('sorted:')
+            # names are memoized, they are not read again
             for font in sorted_fonts:
                 print(get_ps_font_name(font))
         else:
@@ -0,0 +1,363 @@
+'''
+Kerning of compiled fonts (OTF/TTF), read from the PairPos lookups of the
+GPOS kern feature, as UFO-style kerning and groups. Fonts are opened
+lazily: only the name table and the kern lookups are decompiled, glyph
+outlines are never read.
+
+Pair positioning is mapped to UFO kerning as follows:
+- Format 1 (glyph pairs) becomes glyph–glyph kerning.
+- Format 2 (class pairs) becomes group–group kerning. Each class is a
+  public.kern1 or public.kern2 group, named after its first glyph
+  (in glyph order). Class pairs with a value of 0 are skipped. So is
+  class 0 of the second glyph (all glyphs not in a class).
+- Within a lookup, the first subtable that applies wins, as in OpenType
+  layout. A class subtable applies to every glyph in its coverage, so
+  glyph pairs in later subtables cannot be reached.
+- If a class does not match a group that already exists (a glyph may be
+  in one kern1 and one kern2 group only), its pairs are written for
+  each of its glyphs instead.
+- Only first glyphs not covered by an earlier kern lookup are read from
+  later lookups; values of several lookups are not added up.
+
+Only the horizontal advance (XAdvance) of the first glyph is read.
+'''
+
+import concurrent.futures
+import os
+import struct
+
+import numpy as np
+from fontTools import ttLib
+from fontTools.ttLib.tables import otTables
+
+import kernResolver
+import ufoLoader
+
+FIRST_PREFIX = kernResolver.FIRST_PREFIX
+SECOND_PREFIX = kernResolver.SECOND_PREFIX
+
+# ValueFormat flag of the horizontal advance adjustment
+X_ADVANCE = 0x0004
+
+
+def _kern_lookups(gpos):
+    '''
+    PairPos lookups of the kern feature (of all scripts and languages),
+    in lookup order.
+    '''
+    if gpos is None or gpos.FeatureList is None or gpos.LookupList is None:
+        return []
+    indices = set()
+    for record in gpos.FeatureList.FeatureRecord:
+        if record.FeatureTag == 'kern':
+            indices.update(record.Feature.LookupListIndex)
+    lookups = []
+    for index in sorted(indices):
+        lookup = gpos.LookupList.Lookup[index]
+        subtables = []
+        for subtable in lookup.SubTable:
+            if lookup.LookupType == 9:
+                if subtable.ExtensionLookupType != 2:
+                    continue
+                subtable = subtable.ExtSubTable
+            elif lookup.LookupType != 2:
+                continue
+            subtables.append(subtable)
+        if subtables:
+            lookups.append(subtables)
+    return lookups
+
+
+def _x_advance(value_record):
+    if value_record is None:
+        return 0
+    return getattr(value_record, 'XAdvance', 0) or 0
+
+
+def _value_layout(value_format):
+    '''
+    Number of 16-bit fields in a ValueRecord, and the index of XAdvance
+    among them (None if the record has no XAdvance).
+    '''
+    field_count = bin(value_format).count('1')
+    if not value_format & X_ADVANCE:
+        return field_count, None
+    return field_count, bin(value_format & (X_ADVANCE - 1)).count('1')
+
+
+def _raw_reader(subtable):
+    '''
+    The reader of a lazily loaded subtable which has not been
+    decompiled yet, None otherwise.
+    '''
+    return subtable.__dict__.get('reader')
+
+
+def _raw_pair_pos(subtable):
+    '''
+    Reads a PairPos subtable from the binary data directly, instead of
+    decompiling a Python object per pair: coverage and class
+    definitions are decompiled by fontTools, values are read into
+    numpy arrays.
+    '''
+    reader = _raw_reader(subtable)
+    font = subtable.__dict__['font']
+    data = reader.data
+    base = reader.offset
+    (
+        subtable_format, coverage_offset, value_format1, value_format2
+    ) = struct.unpack_from('>4H', data, base)
+    coverage = otTables.Coverage()
+    coverage.decompile(reader.getSubReader(coverage_offset), font)
+    field_count1, x_index = _value_layout(value_format1)
+    field_count2, _ = _value_layout(value_format2)
+
+    if subtable_format == 1:
+        glyph_order = font.getGlyphOrder()
+        record_size = 1 + field_count1 + field_count2
+        pair_set_offsets = struct.unpack_from(
+            '>{}H'.format(len(coverage.glyphs)), data, base + 10)
+        pair_sets = []
+        for pair_set_offset in pair_set_offsets:
+            start = base + pair_set_offset
+            count, = struct.unpack_from('>H', data, start)
+            records = np.frombuffer(
+                data, '>i2', count * record_size, start + 2
+            ).reshape(count, record_size)
+            seconds = [
+                glyph_order[i] for i in
+                records[:, 0].view('>u2').tolist()]
+            if x_index is None:
+                values = [0] * count
+            else:
+                values = records[:, 1 + x_index].tolist()
+            pair_sets.append((seconds, values))
+        return subtable_format, coverage.glyphs, pair_sets
+
+    class_defs = []
+    for class_def_offset in struct.unpack_from('>2H', data, base + 8):
+        class_def = otTables.ClassDef()
+        class_def.decompile(reader.getSubReader(class_def_offset), font)
+        class_defs.append(class_def.classDefs)
+    class1_count, class2_count = struct.unpack_from('>2H', data, base + 12)
+    record_size = field_count1 + field_count2
+    if x_index is None:
+        values = np.zeros((class1_count, class2_count), dtype=np.int16)
+    else:
+        values = np.frombuffer(
+            data, '>i2', class1_count * class2_count * record_size,
+            base + 16
+        ).reshape(class1_count, class2_count, record_size)[:, :, x_index]
+    return subtable_format, coverage.glyphs, (class_defs, values)
+
+
+def _pair_pos(subtable):
+    '''
+    Returns the format of a PairPos subtable, its coverage glyphs and
+    - for format 1: (second glyphs, values) of each coverage glyph
+    - for format 2: the two class definitions and a class1 × class2
+      array of values.
+    '''
+    if _raw_reader(subtable) is not None:
+        return _raw_pair_pos(subtable)
+    coverage = subtable.Coverage.glyphs
+    if subtable.Format == 1:
+        pair_sets = [
+            (
+                [record.SecondGlyph for record in pair_set.PairValueRecord],
+                [
+                    _x_advance(record.Value1) for
+                    record in pair_set.PairValueRecord]
+            ) for pair_set in subtable.PairSet]
+        return 1, coverage, pair_sets
+    class_defs = [
+        subtable.ClassDef1.classDefs, subtable.ClassDef2.classDefs]
+    values = np.array([
+        [_x_advance(record.Value1) for record in class1.Class2Record]
+        for class1 in subtable.Class1Record], dtype=np.int16)
+    return 2, coverage, (class_defs, values)
+
+
+class _GroupBuilder(object):
+    '''
+    Turns the classes of one side into UFO groups. A glyph is in one
+    group per side only, so a class overlapping an existing group is
+    returned as a list of single glyphs.
+    '''
+
+    def __init__(self, prefix, glyph_ids):
+        self.prefix = prefix
+        self.glyph_ids = glyph_ids
+        self.groups = {}
+        self.glyph_groups = {}
+        self.member_groups = {}
+
+    def items(self, glyphs):
+        '''
+        Returns the kerning items (a group name or glyph names) for
+        a set of glyphs.
+        '''
+        members = frozenset(glyphs)
+        group_name = self.member_groups.get(members)
+        if group_name is not None:
+            return [group_name]
+        ordered = sorted(members, key=self.glyph_ids.get)
+        if any(glyph in self.glyph_groups for glyph in members):
+            return ordered
+        group_name = self.prefix + ordered[0]
+        self.groups[group_name] = ordered
+        self.member_groups[members] = group_name
+        for glyph in ordered:
+            self.glyph_groups[glyph] = group_name
+        return [group_name]
+
+
+def read_gpos_kerning(ttf):
+    '''
+    Returns UFO-style kerning and groups from the GPOS kern feature of
+    a TTFont (opened with lazy=True, to skip decompiling the lookups
+    not needed).
+    '''
+    glyph_ids = {name: i for i, name in enumerate(ttf.getGlyphOrder())}
+    kerning = {}
+    first_builder = _GroupBuilder(FIRST_PREFIX, glyph_ids)
+    second_builder = _GroupBuilder(SECOND_PREFIX, glyph_ids)
+
+    gpos = ttf['GPOS'].table if 'GPOS' in ttf else None
+    # first glyphs covered by an earlier lookup
+    done = set()
+    for subtables in _kern_lookups(gpos):
+        # first glyphs for which a class subtable of this lookup applied
+        applied = set()
+        covered = set()
+        for subtable in subtables:
+            subtable_format, coverage, pairs = _pair_pos(subtable)
+            covered.update(coverage)
+            reachable = [
+                glyph not in done and glyph not in applied for
+                glyph in coverage]
+            if not any(reachable):
+                continue
+
+            if subtable_format == 1:
+                for glyph, is_reachable, (seconds, values) in zip(
+                    coverage, reachable, pairs
+                ):
+                    if not is_reachable:
+                        continue
+                    for second, value in zip(seconds, values):
+                        kerning.setdefault((glyph, second), value)
+                continue
+
+            (first_classes, second_classes), values = pairs
+            class1_members = {}
+            for glyph, is_reachable in zip(coverage, reachable):
+                if is_reachable:
+                    class1_members.setdefault(
+                        first_classes.get(glyph, 0), []).append(glyph)
+            class2_members = {}
+            for glyph, class2 in second_classes.items():
+                if class2:
+                    class2_members.setdefault(class2, []).append(glyph)
+            second_items = {}
+            for class1, members in sorted(class1_members.items()):
+                first_items = None
+                row = values[class1]
+                for class2 in np.flatnonzero(row).tolist():
+                    if class2 not in class2_members:
+                        continue
+                    if first_items is None:
+                        first_items = first_builder.items(members)
+                    if class2 not in second_items:
+                        second_items[class2] = second_builder.items(
+                            class2_members[class2])
+                    value = int(row[class2])
+                    for first in first_items:
+                        for second in second_items[class2]:
+                            kerning.setdefault((first, second), value)
+                applied.update(members)
+        done.update(covered)
+
+    groups = dict(first_builder.groups)
+    groups.update(second_builder.groups)
+    return kerning, groups
+
+
+def read_name_info(ttf):
+    '''
+    Font info attributes used by Kern-A-Lytics, from the name table.
+    '''
+    name_table = ttf['name'] if 'name' in ttf else None
+    info = {}
+    if name_table is None:
+        return info
+    for attribute, name_ids in (
+        ('familyName', (16, 1)),
+        ('styleName', (17, 2)),
+        ('postscriptFontName', (6,)),
+    ):
+        for name_id in name_ids:
+            name = name_table.getDebugName(name_id)
+            if name:
+                info[attribute] = name
+                break
+    return info
+
+
+class BinaryFont(object):
+    '''
+    The kerning-relevant parts of a compiled font, shaped like
+    ufoLoader.HeadlessFont, so kerningHelper functions and the
+    KernMatrix accept it.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        with ttLib.TTFont(path, lazy=True) as ttf:
+            kerning, self.groups = read_gpos_kerning(ttf)
+            self.info = ufoLoader.HeadlessInfo(read_name_info(ttf))
+            self.glyphOrder = ttf.getGlyphOrder()
+        self.kerning = ufoLoader.HeadlessKerning(kerning, self.groups)
+        self.lib = {'public.glyphOrder': self.glyphOrder}
+
+    def __repr__(self):
+        return '<BinaryFont {}>'.format(os.path.basename(self.path))
+
+
+def _load_binary(path):
+    font = BinaryFont(path)
+    index = kernResolver.ResolutionIndex.from_font(font)
+    index.exceptions()
+    font.kerning._group_maps = index.first_groups, index.second_groups
+    return font, index
+
+
+def load_binaries(font_paths, workers=1):
+    '''
+    Loads a list of OTF/TTF paths, returns a list of fonts and a list
+    of their ResolutionIndex objects, as ufoLoader.load_masters().
+    '''
+    font_paths = list(font_paths)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(font_paths))
+    if workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            results = list(executor.map(_load_binary, font_paths))
+    else:
+        results = [_load_binary(path) for path in font_paths]
+    fonts = [font for font, _ in results]
+    indexes = [index for _, index in results]
+    return fonts, indexes
+
+
+def load_masters(font_paths, workers=1):
+    '''
+    Loads UFO masters or compiled fonts, whichever *font_paths* (e.g.
+    from fontSorter.get_font_paths) are. Returns a list of fonts and
+    a list of their ResolutionIndex objects.
+    '''
+    font_paths = list(font_paths)
+    if all(path.endswith('.ufo') for path in font_paths):
+        return ufoLoader.load_masters(font_paths, workers=workers)
+    return load_binaries(font_paths, workers=workers)
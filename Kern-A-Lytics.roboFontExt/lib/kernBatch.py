@@ -0,0 +1,222 @@
+'''
+Batch operations on many pairs across all masters. New values for all
+selected pairs are computed in one step on the KernMatrix arrays, then
+each master’s kerning is written in a single update.
+
+Every operation takes a value array and a kerned array (selected pairs ×
+masters, unkerned values are 0) and returns new ones.
+'''
+
+import numpy as np
+
+import kernMatrix
+
+
+def _master_mask(master_count, masters):
+    '''
+    Boolean column mask; all masters if *masters* is empty or None.
+    '''
+    mask = np.zeros(master_count, dtype=bool)
+    if masters:
+        mask[list(masters)] = True
+    else:
+        mask[:] = True
+    return mask
+
+
+def _rounded(values):
+    return np.rint(values).astype(np.int64)
+
+
+def average(values, kerned):
+    '''
+    All masters are set to the rounded average value of the pair.
+    '''
+    master_count = values.shape[1]
+    mean = values.sum(axis=1) / max(master_count, 1)
+    new_values = np.repeat(_rounded(mean)[:, None], master_count, axis=1)
+    return new_values, np.ones_like(kerned)
+
+
+def equalize(values, kerned, source):
+    '''
+    All masters are set to the value of the *source* master
+    (and unkerned, if the source master is unkerned).
+    '''
+    master_count = values.shape[1]
+    new_values = np.repeat(values[:, [source]], master_count, axis=1)
+    new_kerned = np.repeat(kerned[:, [source]], master_count, axis=1)
+    return new_values, new_kerned
+
+
+def offset(values, kerned, amount, masters=None):
+    '''
+    Values of *masters* (or all) are changed by *amount*.
+    '''
+    mask = _master_mask(values.shape[1], masters)
+    new_values = np.where(mask, values + amount, values)
+    return new_values, kerned | mask
+
+
+def interpolate(values, kerned, targets, factor=.5, weights=None):
+    '''
+    Values of the *targets* masters are interpolated between their
+    neighbours, or extrapolated from the two nearest masters for the
+    first and last master.
+    With *weights* (kernInterpolation.InterpolationModel.weights), a
+    target is predicted from all other masters at their design locations
+    instead, and *factor* is ignored.
+    '''
+    master_count = values.shape[1]
+    if master_count < 3:
+        raise ValueError('Need at least 3 masters to interpolate')
+    if not targets:
+        raise ValueError('No interpolation target')
+    new_values = values.copy()
+    new_kerned = kerned.copy()
+    for target in targets:
+        if weights is not None:
+            result = values @ weights[target]
+        elif target == 0:
+            pole = values[:, 1]
+            result = pole + (pole - values[:, 2]) * factor
+        elif target == master_count - 1:
+            pole = values[:, -2]
+            result = pole + (pole - values[:, -3]) * factor
+        else:
+            start = values[:, target - 1]
+            result = start + (values[:, target + 1] - start) * factor
+        new_values[:, target] = _rounded(result)
+        new_kerned[:, target] = True
+    return new_values, new_kerned
+
+
+def delete(values, kerned):
+    '''
+    The pairs are removed from all masters.
+    '''
+    return np.zeros_like(values), np.zeros_like(kerned)
+
+
+operations = {
+    'average': average,
+    'equalize': equalize,
+    'offset': offset,
+    'interpolate': interpolate,
+    'delete': delete,
+}
+
+
+def compute(matrix, rows, operation, **parameters):
+    '''
+    Returns new (values, kerned) arrays for some rows of a KernMatrix.
+    '''
+    rows = np.asarray(rows, dtype=np.intp)
+    values = kernMatrix._wide(matrix)[rows]
+    kerned = matrix.kerned[rows]
+    new_values, new_kerned = operations[operation](
+        values, kerned, **parameters)
+    return np.where(new_kerned, new_values, 0), new_kerned
+
+
+def write_cells(fonts, matrix, cells, resolve_removed=False):
+    '''
+    Writes (pair, master index, value) cells to the fonts, with a single
+    kerning update per master, and to the matrix (unless it is None).
+    A value of None removes the pair from that font’s kerning. With
+    *resolve_removed*, the matrix shows what the font kerns a removed
+    pair with (e.g. through group kerning), as KernMatrix.from_fonts()
+    would; otherwise the cell becomes unkerned.
+    Returns (pair, master index, old value, new value) records of the
+    kerning in the fonts, None for pairs not in a font’s kerning.
+    '''
+    cells = list(cells)
+    updates = [{} for _ in fonts]
+    removals = [[] for _ in fonts]
+    records = []
+    for pair, master, value in cells:
+        old_value = fonts[master].kerning.get(pair)
+        if old_value == value and (old_value is None) == (value is None):
+            continue
+        records.append((pair, master, old_value, value))
+        if value is None:
+            removals[master].append(pair)
+        else:
+            updates[master][pair] = value
+    for font, font_updates, font_removals in zip(fonts, updates, removals):
+        if font_updates:
+            font.kerning.update(font_updates)
+        kerning = font.kerning
+        for pair in font_removals:
+            if pair in kerning:
+                del kerning[pair]
+
+    if matrix is None or not cells:
+        return records
+
+    pair_cells = {}
+    for pair, master, value in cells:
+        if value is None and resolve_removed:
+            value = fonts[master].kerning.find(pair, None)
+        pair_cells.setdefault(pair, {})[master] = value
+    for pair in pair_cells:
+        if pair not in matrix.pair_index:
+            matrix.add_pair(pair, [None] * matrix.master_count)
+    rows = [matrix.pair_index[pair] for pair in pair_cells]
+    values = kernMatrix._wide(matrix)[rows].astype(np.float64)
+    kerned = matrix.kerned[rows]
+    for row, master_values in enumerate(pair_cells.values()):
+        for master, value in master_values.items():
+            values[row, master] = 0 if value is None else value
+            kerned[row, master] = value is not None
+    matrix.set_rows(rows, values, kerned)
+    return records
+
+
+def batch_edit(
+    fonts, matrix, pairs, operation, dry_run=False, journal=None,
+    **parameters
+):
+    '''
+    Applies an operation (see *operations*) to a selection of pairs,
+    for example a filter result, in all masters.
+    Returns the delta as a list of (pair, master index, old value,
+    new value) tuples, values are None for unkerned cells.
+    With *dry_run*, neither fonts nor matrix are changed. The kerning
+    written to the fonts is recorded as one operation in *journal*
+    (a kernJournal.EditJournal), if given.
+    '''
+    pairs = list(pairs)
+    rows = [matrix.pair_index[pair] for pair in pairs]
+    if not rows:
+        return []
+    old_values = kernMatrix._wide(matrix)[rows]
+    old_kerned = matrix.kerned[rows]
+    new_values, new_kerned = compute(matrix, rows, operation, **parameters)
+
+    changed = (old_kerned != new_kerned) | (
+        new_kerned & (old_values != new_values))
+    changed_rows, changed_masters = changed.nonzero()
+    cells = (changed_rows, changed_masters)
+    delta = [
+        (
+            pairs[row], master,
+            old_value if was_kerned else None,
+            new_value if is_kerned else None)
+        for row, master, old_value, was_kerned, new_value, is_kerned in zip(
+            changed_rows.tolist(), changed_masters.tolist(),
+            old_values[cells].tolist(), old_kerned[cells].tolist(),
+            new_values[cells].tolist(), new_kerned[cells].tolist())]
+    if dry_run or not delta:
+        return delta
+
+    records = write_cells(
+        fonts, None,
+        [(pair, master, new_value) for pair, master, _, new_value in delta])
+    if journal is not None:
+        journal.record_delta(operation, records)
+
+    edited = changed.any(axis=1)
+    matrix.set_rows(
+        np.asarray(rows)[edited], new_values[edited], new_kerned[edited])
+    return delta
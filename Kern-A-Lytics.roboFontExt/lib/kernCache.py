@@ -0,0 +1,264 @@
+import hashlib
+import json
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+import kernMatrix
+import kernResolver
+import kerningHelper
+
+CACHE_FORMAT = 1
+
+
+def master_key(ufo_path):
+    '''
+    Content hash of the kerning.plist and groups.plist of a UFO.
+    '''
+    digests = []
+    for file_name in ('kerning.plist', 'groups.plist'):
+        digest = hashlib.sha1()
+        plist_path = os.path.join(ufo_path, file_name)
+        if os.path.exists(plist_path):
+            with open(plist_path, 'rb') as blob:
+                for chunk in iter(lambda: blob.read(1 << 20), b''):
+                    digest.update(chunk)
+        digests.append(digest.hexdigest())
+    return ':'.join(digests)
+
+
+def default_cache_dir(ufo_paths):
+    '''
+    A cache directory for a specific set of masters, in the user’s
+    cache folder.
+    '''
+    if sys.platform == 'darwin':
+        base_dir = os.path.expanduser('~/Library/Caches/Kern-A-Lytics')
+    else:
+        base_dir = os.path.join(
+            os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+            'kern-a-lytics')
+    paths = sorted(os.path.abspath(path) for path in ufo_paths)
+    name = hashlib.sha1('\n'.join(paths).encode('utf-8')).hexdigest()
+    return os.path.join(base_dir, name[:16])
+
+
+class KernCache(object):
+    '''
+    On-disk cache of the combined kerning matrix (pairs, values, kerned
+    cells), its statistics and the exceptions of each master.
+    Arrays are stored as .npy files, and memory-mapped when loaded.
+    Masters are identified by the content hash of their kerning and
+    groups, so only columns of masters which changed are rebuilt.
+    Masters with unsaved changes (*dirty*) are never taken from the
+    cache, and not stored under their file hash either.
+    '''
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.keys = []
+        self.exceptions = {}
+
+    def _path(self, name):
+        return os.path.join(self.cache_dir, name)
+
+    def _read(self):
+        '''
+        Returns the cached data as a dict, None if there is no usable cache.
+        '''
+        try:
+            with open(self._path('manifest.json'), 'r') as blob:
+                manifest = json.load(blob)
+            if manifest.get('format') != CACHE_FORMAT:
+                return None
+            cached = {'masters': manifest['masters']}
+            for name in ('pairs', 'values', 'kerned', 'direct'):
+                cached[name] = np.load(
+                    self._path(name + '.npy'), mmap_mode='c')
+            cached['stats'] = {
+                name: np.load(
+                    self._path('stats_{}.npy'.format(name)), mmap_mode='c')
+                for name in kernMatrix.KernStats.array_names}
+        except (OSError, ValueError, KeyError):
+            return None
+
+        shape = (len(cached['pairs']), len(cached['masters']))
+        if (
+            cached['values'].shape != shape or
+            cached['kerned'].shape != shape or
+            cached['direct'].shape != shape
+        ):
+            return None
+        return cached
+
+    def _read_exceptions(self):
+        try:
+            with open(self._path('exceptions.json'), 'r') as blob:
+                stored = json.load(blob)
+        except (OSError, ValueError):
+            return {}
+        return {
+            key: {
+                (first, second): tuple(tuple(base) for base in bases) for
+                first, second, bases in exception_list}
+            for key, exception_list in stored.items()}
+
+    def _save(self, name, array):
+        '''
+        Writes an array to a new file, which then replaces the old one.
+        Matrices which still map the old file keep reading it.
+        '''
+        with tempfile.NamedTemporaryFile(
+            dir=self.cache_dir, suffix='.tmp', delete=False
+        ) as blob:
+            np.save(blob, array)
+        os.replace(blob.name, self._path(name + '.npy'))
+
+    def _write(self, matrix, direct):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # the manifest is written last, and removed first, so an
+        # interrupted write leaves no manifest pointing at stale arrays
+        manifest_path = self._path('manifest.json')
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        pairs = np.array(matrix.pairs, dtype=str).reshape(len(matrix), 2)
+        self._save('pairs', pairs)
+        self._save('values', matrix.values)
+        self._save('kerned', matrix.kerned)
+        self._save('direct', direct)
+        stats = matrix.stats()
+        for name in kernMatrix.KernStats.array_names:
+            self._save('stats_{}'.format(name), getattr(stats, name))
+        with open(manifest_path, 'w') as blob:
+            json.dump({'format': CACHE_FORMAT, 'masters': self.keys}, blob)
+
+    def _write_exceptions(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        stored = {
+            key: [
+                [first, second, [list(base) for base in bases]] for
+                (first, second), bases in exceptions.items()]
+            for key, exceptions in self.exceptions.items()}
+        with open(self._path('exceptions.json'), 'w') as blob:
+            json.dump(stored, blob)
+
+    def matrix(self, fonts, dirty=None):
+        '''
+        Returns a KernMatrix for *fonts*, identical to
+        KernMatrix.from_fonts(fonts). *dirty* is an optional list of
+        booleans, flagging masters whose file contents are outdated.
+        '''
+        if dirty is None:
+            dirty = [False] * len(fonts)
+        self.keys = [
+            None if is_dirty else master_key(font.path) for
+            font, is_dirty in zip(fonts, dirty)]
+        cached = self._read()
+
+        if (
+            cached is not None and
+            None not in self.keys and
+            cached['masters'] == self.keys
+        ):
+            # warm start, nothing to compute
+            pairs = list(map(tuple, cached['pairs'].tolist()))
+            matrix = kernMatrix.KernMatrix(
+                pairs, cached['values'], cached['kerned'])
+            matrix._stats = (
+                matrix.version,
+                kernMatrix.KernStats.from_arrays(cached['stats']))
+            return matrix
+
+        matrix, direct = self._build(fonts, cached)
+        self._write(matrix, direct)
+        return matrix
+
+    def _build(self, fonts, cached):
+        '''
+        Builds the matrix, reusing the cached columns of unchanged masters.
+        Returns the matrix and a pairs × masters array flagging the pairs
+        which are part of each master’s kerning.
+        '''
+        cached_columns = {}
+        if cached is not None:
+            cached_columns = {
+                key: column for column, key in enumerate(cached['masters'])
+                if key is not None}
+        reused = [cached_columns.get(key) for key in self.keys]
+
+        pair_set = set()
+        reused_columns = [column for column in reused if column is not None]
+        if reused_columns:
+            cached_pairs = list(map(tuple, cached['pairs'].tolist()))
+            in_reused = cached['direct'][:, reused_columns].any(axis=1)
+            pair_set.update(
+                pair for pair, used in zip(cached_pairs, in_reused.tolist())
+                if used)
+            old_index = {pair: i for i, pair in enumerate(cached_pairs)}
+        for font, column in zip(fonts, reused):
+            if column is None:
+                pair_set.update(font.kerning.keys())
+        pairs = sorted(pair_set)
+
+        if reused_columns:
+            old_rows = np.array(
+                [old_index.get(pair, -1) for pair in pairs], dtype=np.intp)
+            known = old_rows >= 0
+            new_pairs = [
+                pair for pair, row in zip(pairs, old_rows.tolist()) if row < 0]
+
+        values = np.zeros((len(pairs), len(fonts)), dtype=np.float64)
+        kerned = np.zeros((len(pairs), len(fonts)), dtype=bool)
+        direct = np.zeros((len(pairs), len(fonts)), dtype=bool)
+        for master, (font, column) in enumerate(zip(fonts, reused)):
+            if column is None:
+                index = kernResolver.ResolutionIndex.from_font(font)
+                col_values, col_kerned = kernMatrix._value_arrays(
+                    index.resolve_many(pairs), len(pairs))
+                values[:, master] = col_values
+                kerned[:, master] = col_kerned
+                direct[:, master] = [pair in index.direct for pair in pairs]
+                continue
+
+            old = old_rows[known]
+            values[known, master] = cached['values'][old, column]
+            kerned[known, master] = cached['kerned'][old, column]
+            direct[known, master] = cached['direct'][old, column]
+            if new_pairs:
+                # pairs new to this master, through group kerning
+                index = kernResolver.ResolutionIndex.from_font(font)
+                col_values, col_kerned = kernMatrix._value_arrays(
+                    index.resolve_many(new_pairs), len(new_pairs))
+                values[~known, master] = col_values
+                kerned[~known, master] = col_kerned
+
+        values = values.astype(kernMatrix._array_dtype(values))
+        return kernMatrix.KernMatrix(pairs, values, kerned), direct
+
+    def exception_maps(self, fonts):
+        '''
+        Returns the exception map (see kerningHelper.exception_map) of
+        each font, taken from the cache for masters which did not change
+        since matrix() was called.
+        '''
+        if not self.exceptions:
+            self.exceptions = self._read_exceptions()
+        font_exceptions = []
+        changed = False
+        for font, key in zip(fonts, self.keys):
+            exceptions = self.exceptions.get(key)
+            if exceptions is None:
+                exceptions = kerningHelper.exception_map(font)
+                if key is not None:
+                    self.exceptions[key] = exceptions
+                    changed = True
+            font_exceptions.append(exceptions)
+        if changed:
+            # forget masters which are not part of the family anymore
+            self.exceptions = {
+                key: self.exceptions[key] for key in self.keys if
+                key in self.exceptions}
+            self._write_exceptions()
+        return font_exceptions
@@ -0,0 +1,229 @@
+'''
+Clusters of pairs which are kerned alike in all masters: pairs whose
+value vectors (their value in each master, unkerned values count as 0)
+are identical, or differ by no more than a tolerance in any master.
+Such pairs are candidates for a shared kerning group, or for cleanup.
+Pairs which are unkerned or kerned by 0 in all masters are left out.
+
+Identical vectors are found by a 64-bit hash of each row. With a
+tolerance, the most common vector leads a cluster, and the vectors
+within the tolerance of it join that cluster. Few distinct vectors are
+compared with each leader directly. Otherwise they are bucketed by the
+hash of their values quantized to cells of 2 × tolerance + 1 units, on
+a few grids shifted against each other, and only compared within their
+buckets. Run time is near-linear in the number of pairs. Every member
+is within the tolerance of its cluster’s leading vector, but similar
+vectors which never share a bucket end up in different clusters.
+'''
+
+import collections
+
+import numpy as np
+
+import kernMatrix
+
+FNV_OFFSET = np.uint64(0xcbf29ce484222325)
+FNV_PRIME = np.uint64(0x100000001b3)
+
+# shifted grids the distinct vectors are bucketed on, one after another
+GRID_COUNT = 3
+# largest vector count² × vector length compared without buckets
+DIRECT_LIMIT = 1 << 26
+
+Cluster = collections.namedtuple('Cluster', ['rows', 'values', 'spread'])
+
+
+def value_vectors(matrix):
+    '''
+    Rows × masters array of values, unkerned values as 0.
+    '''
+    values = np.where(matrix.kerned, kernMatrix._wide(matrix), 0)
+    if values.dtype.kind == 'f':
+        # adding 0. turns -0. into 0.
+        return values.astype(np.float64) + 0.
+    return values.astype(np.int64)
+
+
+def hash_rows(values):
+    '''
+    A 64-bit hash of each row of an int64 or float64 array.
+    '''
+    if values.shape[1] > len(values):
+        # few long rows (e.g. glyph profiles), hashed one row at a time
+        return np.array(
+            [hash(row.tobytes()) for row in values],
+            dtype=np.int64).view(np.uint64)
+    hashes = np.full(len(values), FNV_OFFSET, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for column in range(values.shape[1]):
+            bits = np.ascontiguousarray(values[:, column]).view(np.uint64)
+            hashes = (hashes ^ bits) * FNV_PRIME
+            hashes ^= hashes >> np.uint64(29)
+    return hashes
+
+
+def distinct_rows(values):
+    '''
+    Returns the distinct rows of an array (in order of first
+    occurrence), the index of each row’s distinct row, and how often
+    each distinct row occurs.
+    '''
+    _, first, inverse, counts = np.unique(
+        hash_rows(values), return_index=True, return_inverse=True,
+        return_counts=True)
+    inverse = inverse.reshape(-1)
+    if not (values == values[first[inverse]]).all():
+        # a hash collision
+        _, first, inverse, counts = np.unique(
+            values, axis=0, return_index=True, return_inverse=True,
+            return_counts=True)
+        inverse = inverse.reshape(-1)
+    order = np.argsort(first)
+    positions = np.empty_like(order)
+    positions[order] = np.arange(len(order))
+    return values[first[order]], positions[inverse], counts[order]
+
+
+def _best_per_bucket(candidates, bucket, rank, bucket_count):
+    '''
+    The best ranked of the *candidates* in each bucket, -1 for buckets
+    without candidates.
+    '''
+    best = np.full(bucket_count, -1, dtype=np.intp)
+    if not len(candidates):
+        return best
+    candidates = candidates[np.lexsort(
+        (rank[candidates], bucket[candidates]))]
+    candidate_buckets = bucket[candidates]
+    first = np.flatnonzero(np.concatenate(
+        ([True], candidate_buckets[1:] != candidate_buckets[:-1])))
+    best[candidate_buckets[first]] = candidates[first]
+    return best
+
+
+def leading_vectors(vectors, counts, tolerance):
+    '''
+    Index of the vector leading the cluster of each distinct vector,
+    see the module docstring.
+    '''
+    vector_count = len(vectors)
+    if tolerance <= 0 or not vector_count:
+        return np.arange(vector_count)
+    # the most common vectors lead first
+    rank = np.empty(vector_count, dtype=np.intp)
+    rank[np.argsort(-counts, kind='stable')] = np.arange(vector_count)
+    leaders = np.full(vector_count, -1, dtype=np.intp)
+
+    if vector_count ** 2 * vectors.shape[1] <= DIRECT_LIMIT:
+        for vector in np.argsort(rank).tolist():
+            if leaders[vector] >= 0:
+                continue
+            free = np.flatnonzero(leaders < 0)
+            close = np.abs(
+                vectors[free] - vectors[vector]).max(axis=1) <= tolerance
+            leaders[free[close]] = vector
+        return leaders
+
+    width = 2 * tolerance + 1
+    for grid in range(GRID_COUNT):
+        if (leaders >= 0).all():
+            break
+        offset = width * grid / GRID_COUNT
+        cells = np.floor((vectors + offset) / width).astype(np.int64)
+        buckets, bucket = np.unique(hash_rows(cells), return_inverse=True)
+        bucket = bucket.reshape(-1)
+        # existing leaders take up vectors first, then new leaders are
+        # picked from the vectors left over
+        for candidates in (
+            np.flatnonzero(leaders == np.arange(vector_count)),
+            np.flatnonzero(leaders < 0),
+        ):
+            best = _best_per_bucket(candidates, bucket, rank, len(buckets))
+            free = np.flatnonzero(leaders < 0)
+            leader = best[bucket[free]]
+            free, leader = free[leader >= 0], leader[leader >= 0]
+            close = np.abs(
+                vectors[free] - vectors[leader]).max(axis=1) <= tolerance
+            free, leader = free[close], leader[close]
+            # a new leader which takes up no other vector stays free,
+            # it may still join a cluster on another grid
+            taken = np.bincount(leader, minlength=vector_count)
+            joined = taken[leader] > 1
+            leaders[free[joined]] = leader[joined]
+
+    # vectors which joined no cluster lead their own
+    unassigned = np.flatnonzero(leaders < 0)
+    leaders[unassigned] = unassigned
+    return leaders
+
+
+class ValueClusters(object):
+    '''
+    Ranked clusters of pairs with alike value vectors in a KernMatrix,
+    see the module docstring. Clusters of at least *min_size* pairs are
+    kept, the largest first (then the tightest, then by first row).
+    A cluster is a Cluster of its row indices, the values of its leading
+    vector and its spread: the largest deviation of a member from them.
+    '''
+
+    def __init__(self, matrix, tolerance=0, min_size=2):
+        self.tolerance = tolerance
+        self.min_size = min_size
+        values = value_vectors(matrix)
+        kerned_rows = np.flatnonzero((values != 0).any(axis=1))
+        vectors, inverse, counts = distinct_rows(values[kerned_rows])
+        leaders = leading_vectors(vectors, counts, tolerance)
+        if len(vectors):
+            deviations = np.abs(vectors - vectors[leaders]).max(axis=1)
+        else:
+            deviations = np.zeros(0)
+
+        # clusters as runs of rows, ordered by their leading vector
+        row_leaders = leaders[inverse]
+        order = np.argsort(row_leaders, kind='stable')
+        cluster_leaders, starts, sizes = np.unique(
+            row_leaders[order], return_index=True, return_counts=True)
+        spreads = np.zeros(len(vectors), dtype=deviations.dtype)
+        np.maximum.at(spreads, leaders, deviations)
+        spreads = spreads[cluster_leaders]
+        first_rows = kerned_rows[order[starts]] if len(starts) else starts
+
+        kept = np.flatnonzero(sizes >= min_size)
+        kept = kept[np.lexsort(
+            (first_rows[kept], spreads[kept], -sizes[kept]))]
+        self._order = kerned_rows[order]
+        self._starts = starts[kept]
+        self.sizes = sizes[kept]
+        self.spreads = spreads[kept]
+        self._leader_values = vectors[cluster_leaders[kept]]
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def __getitem__(self, index):
+        start = self._starts[index]
+        return Cluster(
+            self._order[start:start + self.sizes[index]],
+            self._leader_values[index].tolist(),
+            self.spreads[index].item())
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def rows(self):
+        '''
+        Row indices of all clustered pairs, cluster by cluster.
+        '''
+        if not len(self):
+            return np.array([], dtype=np.intp)
+        return np.concatenate([cluster.rows for cluster in self])
+
+    def labels(self, row_count):
+        '''
+        The rank of each row’s cluster, -1 for rows in no cluster.
+        '''
+        labels = np.full(row_count, -1, dtype=np.intp)
+        for index, cluster in enumerate(self):
+            labels[cluster.rows] = index
+        return labels
@@ -0,0 +1,469 @@
+'''
+Differences between two snapshots of a family’s combined kerning, for
+example before and after a kerning pull request.
+Snapshots are KernMatrix objects (or the KernDict views returned by
+kerningHelper.get_combined_kern_dict). Pairs are aligned by name and
+masters by master name. A 64-bit hash of every row finds the rows which
+changed at all, only those are compared cell by cell.
+'''
+
+import collections
+import itertools
+
+import numpy as np
+
+import kernMatrix
+
+FNV_OFFSET = np.uint64(0xcbf29ce484222325)
+FNV_PRIME = np.uint64(0x100000001b3)
+KERNED_BIT = np.uint64(0x9e3779b97f4a7c15)
+
+filter_names = [
+    'same_value',
+    'zero_value',
+    'largest_value',
+    'high_gamut',
+    'outlier',
+    'small_average',
+]
+
+Cell = collections.namedtuple(
+    'Cell', ['pair', 'master', 'old_value', 'new_value'])
+
+
+def _matrix(snapshot):
+    return getattr(snapshot, 'matrix', snapshot)
+
+
+def row_hashes(matrix, columns=None):
+    '''
+    A 64-bit hash of the values and kerned flags of each row (of some
+    *columns* only, if given). Unkerned cells hash the same whatever
+    their stored value. Hashes of all columns are memoized for the
+    current matrix version.
+    '''
+    cached = getattr(matrix, '_row_hashes', None)
+    if columns is None and cached is not None and cached[0] == matrix.version:
+        return cached[1]
+
+    values = kernMatrix._wide(matrix).astype(np.float64)
+    kerned = matrix.kerned
+    if columns is None:
+        column_list = range(matrix.master_count)
+    else:
+        column_list = columns
+    hashes = np.full(len(matrix), FNV_OFFSET, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for column in column_list:
+            # adding 0. turns -0. into 0.
+            bits = (
+                np.where(kerned[:, column], values[:, column], 0.) + 0.
+            ).view(np.uint64)
+            bits = bits ^ np.where(
+                kerned[:, column], KERNED_BIT, np.uint64(0))
+            hashes = (hashes ^ bits) * FNV_PRIME
+            hashes ^= hashes >> np.uint64(29)
+
+    if columns is None:
+        matrix._row_hashes = (matrix.version, hashes)
+    return hashes
+
+
+class _Rows(object):
+    '''
+    Some rows of a KernMatrix, or precomputed statistics, shaped like a
+    matrix for the kernMatrix filter functions.
+    '''
+
+    def __init__(self, matrix=None, rows=None, stats=None):
+        if matrix is not None:
+            self.values = matrix.values[rows]
+            self.kerned = matrix.kerned[rows]
+            self.master_count = matrix.master_count
+        self._stats = stats
+
+    def stats(self):
+        if self._stats is None:
+            self._stats = kernMatrix.KernStats(self)
+        return self._stats
+
+    def __len__(self):
+        return len(self.stats())
+
+
+def _aligned_stats(old, new, old_rows, new_rows, stale_rows):
+    '''
+    Statistics of *new*, taken from the (memoized) statistics of *old*
+    for rows which are the same in both (*old_rows*, *new_rows*), and
+    computed for the *stale_rows* only.
+    '''
+    old_stats = old.stats()
+    stale_stats = _Rows(new, stale_rows).stats()
+    arrays = {}
+    for name in kernMatrix.KernStats.array_names:
+        old_array = getattr(old_stats, name)
+        stale_array = getattr(stale_stats, name)
+        array = np.zeros(
+            len(new), dtype=np.result_type(old_array, stale_array))
+        array[new_rows] = old_array[old_rows]
+        array[stale_rows] = stale_array
+        arrays[name] = array
+    return kernMatrix.KernStats.from_arrays(arrays)
+
+
+def filter_masks(
+    matrix, outlier_factor=5, small_average_value=5, gamut_amount=100,
+    largest_amount=200
+):
+    '''
+    Returns {filter name: boolean row mask} for the value-based filters
+    (see kernFilters.FilterIndex, with the same defaults as the window).
+    '''
+    row_count = len(matrix)
+    masks = {
+        'same_value': kernMatrix.same_value_mask(matrix),
+        'zero_value': kernMatrix.zero_value_mask(matrix),
+        'outlier': kernMatrix.outlier_mask(matrix, outlier_factor),
+        'small_average': kernMatrix.small_average_mask(
+            matrix, small_average_value),
+    }
+    for name, rows in (
+        ('largest_value',
+            kernMatrix.largest_value_rows(matrix, largest_amount)),
+        ('high_gamut', kernMatrix.high_gamut_rows(matrix, gamut_amount)),
+    ):
+        mask = np.zeros(row_count, dtype=bool)
+        mask[rows] = True
+        masks[name] = mask
+    return masks
+
+
+class KernDiff(object):
+    '''
+    Differences between an old and a new snapshot:
+
+    added_pairs, removed_pairs: pairs in only one of the snapshots
+    added_masters, removed_masters: master names in only one snapshot
+    added_cells, removed_cells, changed_cells: lists of Cell tuples
+    (pair, master name, old value, new value) of the masters in both
+    snapshots. A cell is added when it becomes kerned, removed when it
+    becomes unkerned, unkerned values are None.
+    filter_changes: {filter name: (entered pairs, left pairs)} of the
+    pairs in both snapshots.
+    '''
+
+    def __init__(
+        self, old, new, old_masters, new_masters, outlier_factor=5,
+        small_average_value=5, gamut_amount=100, largest_amount=200
+    ):
+        old = _matrix(old)
+        new = _matrix(new)
+        old_masters = list(old_masters)
+        new_masters = list(new_masters)
+        new_master_set = set(new_masters)
+        old_master_set = set(old_masters)
+        self.masters = [name for name in new_masters if name in old_master_set]
+        self.added_masters = [
+            name for name in new_masters if name not in old_master_set]
+        self.removed_masters = [
+            name for name in old_masters if name not in new_master_set]
+        old_columns = [old_masters.index(name) for name in self.masters]
+        new_columns = [new_masters.index(name) for name in self.masters]
+
+        # row alignment: old row of every new row, -1 for new pairs
+        if old.pairs == new.pairs:
+            old_rows = np.arange(len(new))
+        else:
+            old_rows = np.fromiter(
+                map(old.pair_index.get, new.pairs, itertools.repeat(-1)),
+                dtype=np.intp, count=len(new))
+        common = old_rows >= 0
+        in_new = np.zeros(len(old), dtype=bool)
+        in_new[old_rows[common]] = True
+        self.added_pairs = [
+            new.pairs[row] for row in np.flatnonzero(~common).tolist()]
+        self.removed_pairs = [
+            old.pairs[row] for row in np.flatnonzero(~in_new).tolist()]
+
+        new_common = np.flatnonzero(common)
+        old_common = old_rows[common]
+        all_columns = (
+            old_columns == list(range(old.master_count)) and
+            new_columns == list(range(new.master_count)))
+        if all_columns:
+            old_hashes = row_hashes(old)
+            new_hashes = row_hashes(new)
+        else:
+            old_hashes = row_hashes(old, old_columns)
+            new_hashes = row_hashes(new, new_columns)
+        differs = old_hashes[old_common] != new_hashes[new_common]
+        changed_new = new_common[differs]
+        changed_old = old_common[differs]
+
+        # cells are kept as arrays, Cell tuples are only built when needed
+        self._cell_arrays = {'added': [], 'removed': [], 'changed': []}
+        self._cell_lists = {}
+        self._compare_cells(
+            old, new, changed_old, changed_new, old_columns, new_columns)
+        # new pairs are added cells, removed pairs removed cells
+        self._compare_cells(
+            None, new, None, np.flatnonzero(~common), None, new_columns)
+        self._compare_cells(
+            old, None, np.flatnonzero(~in_new), None, old_columns, None)
+
+        new_stats = new._stats
+        if all_columns and (new_stats is None or new_stats[0] != new.version):
+            # only rows which differ from the old snapshot are computed
+            same = ~differs
+            new_view = _Rows(stats=_aligned_stats(
+                old, new, old_common[same], new_common[same],
+                np.concatenate([changed_new, np.flatnonzero(~common)])))
+        else:
+            new_view = new
+        old_masks = filter_masks(
+            old, outlier_factor, small_average_value, gamut_amount,
+            largest_amount)
+        new_masks = filter_masks(
+            new_view, outlier_factor, small_average_value, gamut_amount,
+            largest_amount)
+        self.filter_changes = {}
+        for name in filter_names:
+            was_in = old_masks[name][old_common]
+            is_in = new_masks[name][new_common]
+            entered = new_common[is_in & ~was_in]
+            left = new_common[was_in & ~is_in]
+            self.filter_changes[name] = (
+                [new.pairs[row] for row in entered.tolist()],
+                [new.pairs[row] for row in left.tolist()])
+
+    def _compare_cells(
+        self, old, new, old_rows, new_rows, old_columns, new_columns
+    ):
+        '''
+        Adds the differing cells of aligned rows to the cell lists.
+        A missing side (None) counts as unkerned.
+        '''
+        master_count = len(self.masters)
+        if old is None:
+            row_count = len(new_rows)
+        else:
+            row_count = len(old_rows)
+        if not row_count or not master_count:
+            return
+
+        def side(matrix, rows, columns):
+            if matrix is None:
+                return (
+                    np.zeros((row_count, master_count)),
+                    np.zeros((row_count, master_count), dtype=bool))
+            values = kernMatrix._wide(matrix)[np.ix_(rows, columns)]
+            return values, matrix.kerned[np.ix_(rows, columns)]
+
+        old_values, old_kerned = side(old, old_rows, old_columns)
+        new_values, new_kerned = side(new, new_rows, new_columns)
+        added = new_kerned & ~old_kerned
+        removed = old_kerned & ~new_kerned
+        changed = old_kerned & new_kerned & (old_values != new_values)
+        if new is None:
+            pairs, rows = old.pairs, old_rows
+        else:
+            pairs, rows = new.pairs, new_rows
+        for kind, mask in (
+            ('added', added), ('removed', removed), ('changed', changed)
+        ):
+            cell_rows, cell_masters = mask.nonzero()
+            if len(cell_rows):
+                self._cell_arrays[kind].append((
+                    pairs, rows[cell_rows], cell_masters,
+                    old_values[cell_rows, cell_masters],
+                    new_values[cell_rows, cell_masters]))
+
+    def _cells(self, kind):
+        '''
+        Cell tuples of one kind, built from the cell arrays on first use.
+        '''
+        cells = self._cell_lists.get(kind)
+        if cells is not None:
+            return cells
+        has_old = kind != 'added'
+        has_new = kind != 'removed'
+        masters = self.masters
+        cells = []
+        for pairs, rows, cell_masters, old_values, new_values in (
+            self._cell_arrays[kind]
+        ):
+            for row, master, old_value, new_value in zip(
+                rows.tolist(), cell_masters.tolist(),
+                old_values.tolist(), new_values.tolist()
+            ):
+                cells.append(Cell(
+                    pairs[row], masters[master],
+                    _number(old_value) if has_old else None,
+                    _number(new_value) if has_new else None))
+        self._cell_lists[kind] = cells
+        return cells
+
+    @property
+    def added_cells(self):
+        return self._cells('added')
+
+    @property
+    def removed_cells(self):
+        return self._cells('removed')
+
+    @property
+    def changed_cells(self):
+        return self._cells('changed')
+
+    def cell_count(self, kind):
+        return sum(
+            len(rows) for _, rows, _, _, _ in self._cell_arrays[kind])
+
+    def changed_pairs(self):
+        '''
+        Pairs with at least one added, removed or changed cell,
+        sorted by name.
+        '''
+        return sorted(set(
+            cell.pair for cell in (
+                self.added_cells + self.removed_cells + self.changed_cells)))
+
+    def counts(self):
+        counts = {
+            'added_pairs': len(self.added_pairs),
+            'removed_pairs': len(self.removed_pairs),
+            'added_cells': self.cell_count('added'),
+            'removed_cells': self.cell_count('removed'),
+            'changed_cells': self.cell_count('changed'),
+        }
+        for name, (entered, left) in self.filter_changes.items():
+            counts[name + '_entered'] = len(entered)
+            counts[name + '_left'] = len(left)
+        return counts
+
+    def as_dict(self):
+        def cell_list(cells):
+            return [
+                [cell.pair[0], cell.pair[1], cell.master,
+                 cell.old_value, cell.new_value] for cell in cells]
+
+        return {
+            'masters': self.masters,
+            'added_masters': self.added_masters,
+            'removed_masters': self.removed_masters,
+            'added_pairs': [list(pair) for pair in self.added_pairs],
+            'removed_pairs': [list(pair) for pair in self.removed_pairs],
+            'added_cells': cell_list(self.added_cells),
+            'removed_cells': cell_list(self.removed_cells),
+            'changed_cells': cell_list(self.changed_cells),
+            'filter_changes': {
+                name: {
+                    'entered': [list(pair) for pair in entered],
+                    'left': [list(pair) for pair in left]}
+                for name, (entered, left) in self.filter_changes.items()},
+        }
+
+    def describe(self):
+        '''
+        Yields one line of text per change.
+        '''
+        for name in self.added_masters:
+            yield 'master {} added'.format(name)
+        for name in self.removed_masters:
+            yield 'master {} removed'.format(name)
+        for first, second in self.added_pairs:
+            yield '{} {} added'.format(first, second)
+        for first, second in self.removed_pairs:
+            yield '{} {} removed'.format(first, second)
+        # cells of added and removed pairs are not listed one by one
+        listed_pairs = set(self.added_pairs) | set(self.removed_pairs)
+        for label, cells in (
+            ('kerned', self.added_cells),
+            ('unkerned', self.removed_cells),
+            ('changed', self.changed_cells),
+        ):
+            for cell in cells:
+                if cell.pair in listed_pairs:
+                    continue
+                yield '{} {} {} in {}: {} -> {}'.format(
+                    cell.pair[0], cell.pair[1], label, cell.master,
+                    cell.old_value, cell.new_value)
+        for name in filter_names:
+            entered, left = self.filter_changes[name]
+            for first, second in entered:
+                yield '{} {} became {}'.format(first, second, name)
+            for first, second in left:
+                yield '{} {} is no longer {}'.format(first, second, name)
+
+
+def _number(value):
+    '''
+    Integer kerning values as int, others as float.
+    '''
+    if value == int(value):
+        return int(value)
+    return value
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    import sys
+
+    import fontSorter
+    import gposLoader
+
+    parser = argparse.ArgumentParser(
+        description=(
+            'Differences between the kerning of two folders of UFO masters '
+            'or compiled fonts (e.g. two checkouts of a family, or the '
+            'sources and a build)'))
+
+    parser.add_argument(
+        'old_dir', metavar='OLD', help='Directory with the old masters.')
+    parser.add_argument(
+        'new_dir', metavar='NEW', help='Directory with the new masters.')
+
+    parser.add_argument(
+        '-f', '--format',
+        action='store',
+        choices=['text', 'json'],
+        default='text',
+        help='Output format (default: text).')
+
+    parser.add_argument(
+        '-w', '--workers',
+        action='store',
+        type=int,
+        default=1,
+        metavar='N',
+        help='Number of processes reading masters, 0 for one per CPU.')
+
+    args = parser.parse_args()
+
+    snapshots = []
+    for input_dir in (args.old_dir, args.new_dir):
+        ufo_paths = fontSorter.get_font_paths(input_dir)
+        if not ufo_paths:
+            sys.exit('no UFOs or compiled fonts found in {}.'.format(
+                input_dir))
+        ufo_paths = fontSorter.sort_fonts(
+            ufo_paths,
+            designspace_path=fontSorter.find_designspace(ufo_paths))
+        fonts, indexes = gposLoader.load_masters(
+            ufo_paths, workers=args.workers or None)
+        snapshots.append((
+            kernMatrix.KernMatrix.from_fonts(fonts, indexes),
+            fontSorter.get_ps_font_names(ufo_paths)))
+
+    (old, old_masters), (new, new_masters) = snapshots
+    diff = KernDiff(old, new, old_masters, new_masters)
+    if args.format == 'json':
+        json.dump(diff.as_dict(), sys.stdout, indent=1)
+        print()
+    else:
+        for line in diff.describe():
+            print(line)
+    for name, count in diff.counts().items():
+        if count:
+            print('{:>22}: {}'.format(name, count), file=sys.stderr)
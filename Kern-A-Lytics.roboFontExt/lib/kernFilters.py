@@ -0,0 +1,491 @@
+import bisect
+import fnmatch
+import heapq
+import re
+import threading
+
+import kernMatrix
+import kernResolver
+
+
+class _RowView(object):
+    '''
+    A single row of a KernMatrix, shaped like a matrix, so the
+    vectorized filter masks can be evaluated for one pair.
+    '''
+
+    def __init__(self, matrix, index):
+        self.values = matrix.values[index:index + 1]
+        self.kerned = matrix.kerned[index:index + 1]
+        self.master_count = matrix.master_count
+        self._stats = None
+
+    def stats(self):
+        if self._stats is None:
+            self._stats = kernMatrix.KernStats(self)
+        return self._stats
+
+
+class _TopK(object):
+    '''
+    The exact *k* highest-scoring rows, maintained under single-row
+    updates in O(log n). Ties are broken by row order, earlier rows
+    rank higher.
+    '''
+
+    def __init__(self, scores, k):
+        self.k = max(k, 0)
+        self.scores = list(scores)
+        self.versions = [0] * len(self.scores)
+        self.members = set(kernMatrix.top_k_rows(self.scores, self.k).tolist())
+        # members: min-heap, the lowest-ranked member on top
+        self.member_heap = [
+            (self.scores[row], -row, 0) for row in self.members]
+        # other rows: min-heap of negative scores, the best candidate on top
+        self.other_heap = [
+            (-score, row, 0) for row, score in enumerate(self.scores) if
+            row not in self.members]
+        heapq.heapify(self.member_heap)
+        heapq.heapify(self.other_heap)
+
+    def _push(self, row):
+        self.versions[row] += 1
+        version = self.versions[row]
+        score = self.scores[row]
+        if row in self.members:
+            heapq.heappush(self.member_heap, (score, -row, version))
+        else:
+            heapq.heappush(self.other_heap, (-score, row, version))
+
+    def _top(self, heap, sign):
+        while heap:
+            _, second, version = heap[0]
+            row = second * sign
+            if version == self.versions[row]:
+                return row
+            heapq.heappop(heap)
+        return None
+
+    def update(self, row, score):
+        '''
+        Sets the score of a row, returns (entered, left) sets of rows
+        whose membership changed.
+        '''
+        entered = set()
+        left = set()
+        self.scores[row] = score
+        self._push(row)
+        while True:
+            worst = self._top(self.member_heap, -1)
+            best = self._top(self.other_heap, 1)
+            if worst is None or best is None:
+                break
+            if (self.scores[best], -best) <= (self.scores[worst], -worst):
+                break
+            self.members.remove(worst)
+            self.members.add(best)
+            self._push(worst)
+            self._push(best)
+            left.add(worst)
+            entered.add(best)
+        return entered - left, left - entered
+
+    def ranked(self, *keys):
+        '''
+        Members sorted by score (highest first), then by *keys*
+        (lists indexed by row), then by row.
+        '''
+        return sorted(self.members, key=lambda row: (
+            (-self.scores[row],) + tuple(key[row] for key in keys) + (row,)))
+
+
+class FilterIndex(object):
+    '''
+    Filter lists over a KernMatrix as lazily evaluated, memoized queries.
+    A filter is computed the first time it is asked for (or when warmed
+    in the background), and memoized with the matrix version it was
+    computed for.
+    Value-based filters are maintained incrementally after that: once a
+    pair has been edited, update() re-evaluates only that pair.
+    Other filters can be registered as functions, which are recomputed
+    when the matrix version they depend on has changed.
+    Filters are warmed in a background thread while the matrix may be
+    edited, so registered functions are expected to be matrix-only: to
+    read nothing but the matrix (and data nobody changes meanwhile).
+    Functions reading font objects are registered as not matrix-only,
+    and only computed on the thread asking for them.
+    '''
+
+    row_filters = ('same_value', 'zero_value', 'outlier', 'small_average')
+
+    def __init__(
+        self, matrix, outlier_factor=4, small_average_value=5,
+        gamut_amount=100, largest_amount=200
+    ):
+        self.matrix = matrix
+        self.outlier_factor = outlier_factor
+        self.small_average_value = small_average_value
+        self.gamut_amount = gamut_amount
+        self.largest_amount = largest_amount
+
+        # incremental filters: name -> matrix version they are current for
+        self.built = {}
+        self.members = {}
+        # registered filters: name -> (function, version, matrix_only,
+        # update)
+        self.queries = {}
+        self.results = {}
+
+        self.lock = threading.RLock()
+        # warm requests made while the thread runs, it handles them too
+        self._warm_lock = threading.Lock()
+        self._warm_requests = []
+        self._warm_thread = None
+
+    def register(
+        self, name, function, version='version', matrix_only=True,
+        update=None
+    ):
+        '''
+        Adds a filter computed by *function* (returning row indices),
+        which is memoized until the matrix attribute *version* changes.
+        *version* may also be a function returning the version, e.g. one
+        which only changes once an edit is over, for filters too slow to
+        follow every change. Unless *matrix_only*, the filter is never
+        warmed in the background (see warm_main_thread).
+        A filter with a version which does not follow value changes can
+        be kept current by *update*, which update() and update_rows()
+        call with the edited rows, and which returns the new row indices.
+        '''
+        self.queries[name] = (function, version, matrix_only, update)
+        self.results.pop(name, None)
+
+    def _version(self, version):
+        if callable(version):
+            return version()
+        return getattr(self.matrix, version)
+
+    def _row_masks(self, matrix, names):
+        masks = {}
+        if 'same_value' in names:
+            masks['same_value'] = kernMatrix.same_value_mask(matrix)
+        if 'zero_value' in names:
+            masks['zero_value'] = kernMatrix.zero_value_mask(matrix)
+        if 'outlier' in names:
+            masks['outlier'] = kernMatrix.outlier_mask(
+                matrix, self.outlier_factor)
+        if 'small_average' in names:
+            masks['small_average'] = kernMatrix.small_average_mask(
+                matrix, self.small_average_value)
+        return masks
+
+    def _build(self, name):
+        matrix = self.matrix
+        version = matrix.version
+        if name in self.row_filters:
+            mask = self._row_masks(matrix, [name])[name]
+            self.members[name] = set(mask.nonzero()[0].tolist())
+
+        elif name == 'largest_value':
+            stats = matrix.stats()
+            self.row_max = stats.max.tolist()
+            self.row_min = stats.min.tolist()
+            self.row_sum = stats.sum.tolist()
+            half = self.largest_amount // 2
+            self.max_top = _TopK(self.row_max, half)
+            self.min_top = _TopK([-v for v in self.row_min], half)
+
+        elif name == 'high_gamut':
+            self.gamut_top = _TopK(
+                kernMatrix.gamut_array(matrix).tolist(), self.gamut_amount)
+
+        elif name == 'single':
+            self.members[name] = set(
+                i for i, pair in enumerate(matrix.pairs) if
+                not any([side.startswith('public') for side in pair]))
+
+        self.built[name] = version
+
+    def _current(self, name):
+        '''
+        Makes sure a filter is computed for the current matrix version.
+        Returns the rows of a registered filter, which is computed
+        without holding the lock, so edits are not blocked meanwhile.
+        '''
+        if name in self.queries:
+            return self._current_query(name)
+        with self.lock:
+            if name != 'all':
+                if self.built.get(name) != self.matrix.version:
+                    self._build(name)
+
+    def _current_query(self, name):
+        function, version_key, _, update = self.queries[name]
+        with self.lock:
+            version = self._version(version_key)
+            matrix_version = self.matrix.version
+            result = self.results.get(name)
+            if result is not None and result[0] == version:
+                return result[1]
+        rows = list(function())
+        with self.lock:
+            # the result is dropped if the filter changed meanwhile, or
+            # an edit happened which its update function did not see
+            if self._version(version_key) == version and (
+                update is None or self.matrix.version == matrix_version
+            ):
+                self.results[name] = (version, rows)
+        return rows
+
+    def is_current(self, name):
+        if name == 'all':
+            return True
+        if name in self.queries:
+            _, version, _, _ = self.queries[name]
+            result = self.results.get(name)
+            return (
+                result is not None and
+                result[0] == self._version(version))
+        return self.built.get(name) == self.matrix.version
+
+    def update(self, index):
+        '''
+        Re-evaluates the membership of a single, edited row in all
+        incremental filters computed so far.
+        '''
+        with self.lock:
+            self._update_row(index)
+            self._update_queries([index])
+
+    def _update_row(self, index):
+        with self.lock:
+            row_view = _RowView(self.matrix, index)
+            row_names = [
+                name for name in self.row_filters if name in self.built]
+            for name, mask in self._row_masks(row_view, row_names).items():
+                if mask[0]:
+                    self.members[name].add(index)
+                else:
+                    self.members[name].discard(index)
+
+            if 'largest_value' in self.built:
+                row_stats = row_view.stats()
+                self.row_max[index] = row_stats.max[0].item()
+                self.row_min[index] = row_stats.min[0].item()
+                self.row_sum[index] = row_stats.sum[0].item()
+                self.max_top.update(index, self.row_max[index])
+                self.min_top.update(index, -self.row_min[index])
+
+            if 'high_gamut' in self.built:
+                gamut = kernMatrix.gamut_array(row_view)[0].item()
+                self.gamut_top.update(index, gamut)
+
+            for name in self.built:
+                self.built[name] = self.matrix.version
+
+    def update_rows(self, indices):
+        '''
+        Re-evaluates a number of edited rows. If many rows changed,
+        filters are recomputed as a whole the next time they are needed.
+        '''
+        indices = list(indices)
+        with self.lock:
+            if len(indices) * 20 > len(self.matrix):
+                self.built.clear()
+            else:
+                for index in indices:
+                    self._update_row(index)
+            self._update_queries(indices)
+
+    def _update_queries(self, indices):
+        '''
+        Updates the registered filters which have an update function,
+        and are current for their version.
+        '''
+        for name, (_, version, _, update) in self.queries.items():
+            result = self.results.get(name)
+            if (
+                update is not None and result is not None and
+                result[0] == self._version(version)
+            ):
+                self.results[name] = (result[0], list(update(indices)))
+
+    def _matrix_only(self, name):
+        return name not in self.queries or self.queries[name][2]
+
+    def warm(self, names=None, callback=None):
+        '''
+        Computes filters in a background thread. *callback* is called
+        with the name of each filter once it has been computed.
+        Requests made while the thread is running are queued, the
+        thread handles them before it ends. Only matrix-only filters
+        are warmed.
+        '''
+        with self._warm_lock:
+            self._warm_requests.append((names, callback))
+            if self._warm_thread is not None:
+                return
+            self._warm_thread = threading.Thread(
+                target=self._warm_filters, daemon=True)
+            self._warm_thread.start()
+
+    def _warm_filters(self):
+        try:
+            while True:
+                with self._warm_lock:
+                    if not self._warm_requests:
+                        self._warm_thread = None
+                        return
+                    requests = self._warm_requests
+                    self._warm_requests = []
+                for names, callback in requests:
+                    if names is None:
+                        names = list(self.row_filters) + [
+                            'single', 'largest_value', 'high_gamut'] + list(
+                            self.queries)
+                    for name in names:
+                        if self._matrix_only(name) and not self.is_current(
+                            name
+                        ):
+                            self._current(name)
+                            if callback is not None:
+                                callback(name)
+        except Exception:
+            with self._warm_lock:
+                self._warm_thread = None
+                self._warm_requests = []
+            raise
+
+    def warm_main_thread(self, callback=None):
+        '''
+        Computes the registered filters which are not matrix-only, on
+        the calling thread, which has to be the one editing the fonts
+        they read. *callback* is called like in warm().
+        '''
+        for name, (_, _, matrix_only, _) in list(self.queries.items()):
+            if not matrix_only and not self.is_current(name):
+                self._current(name)
+                if callback is not None:
+                    callback(name)
+
+    def _largest_rows(self):
+        max_rows = self.max_top.ranked(self.row_sum)
+        min_rows = sorted(
+            self.min_top.members - self.max_top.members,
+            key=lambda r: (-self.row_min[r], self.row_sum[r], r))
+        return max_rows + min_rows
+
+    def rows(self, name):
+        '''
+        Row indices of a filter, in display order.
+        '''
+        rows = self._current(name)
+        with self.lock:
+            if name in self.queries:
+                return list(rows)
+            if name == 'all':
+                return list(range(len(self.matrix)))
+            if name == 'largest_value':
+                return self._largest_rows()
+            if name == 'high_gamut':
+                return self.gamut_top.ranked()
+            return sorted(self.members[name])
+
+    def pair_list(self, name):
+        pairs = self.matrix.pairs
+        return [pairs[i] for i in self.rows(name)]
+
+    def count(self, name):
+        '''
+        Number of pairs in a filter, None if it has not been computed
+        for the current matrix version yet.
+        '''
+        if name == 'all':
+            return len(self.matrix)
+        with self.lock:
+            if not self.is_current(name):
+                return None
+            if name in self.queries:
+                return len(self.results[name][1])
+            if name == 'largest_value':
+                return len(self.max_top.members | self.min_top.members)
+            if name == 'high_gamut':
+                return len(self.gamut_top.members)
+            return len(self.members[name])
+
+
+class _ItemSide(object):
+    '''
+    Inverted index for one side of a pair list: item -> pair rows.
+    *item_groups* maps each glyph to its kerning group on this side.
+    '''
+
+    def __init__(self, items, item_groups):
+        self.rows_by_item = {}
+        for row, item in enumerate(items):
+            self.rows_by_item.setdefault(item, []).append(row)
+        self.item_groups = item_groups
+        # glyphs only kerned through their group are searchable, too
+        self.names = sorted(set(self.rows_by_item) | set(item_groups))
+
+    def _matching_names(self, query):
+        wildcard = re.search(r'[*?\[]', query)
+        if wildcard is None:
+            return [query]
+        literal = query[:wildcard.start()]
+        start = bisect.bisect_left(self.names, literal)
+        end = bisect.bisect_left(self.names, literal + '\U0010ffff', start)
+        candidates = self.names[start:end]
+        if query == literal + '*':
+            return candidates
+        pattern = re.compile(fnmatch.translate(query))
+        return [name for name in candidates if pattern.match(name)]
+
+    def rows(self, query):
+        '''
+        Rows of all pairs with a matching item on this side, or with
+        the kerning group of a matching glyph.
+        '''
+        items = set()
+        for name in self._matching_names(query):
+            items.add(name)
+            group = self.item_groups.get(name)
+            if group is not None:
+                items.add(group)
+        rows = set()
+        for item in items:
+            rows.update(self.rows_by_item.get(item, ()))
+        return rows
+
+
+class PairItemIndex(object):
+    '''
+    Inverted index from the left and right items (glyphs or groups) of a
+    pair list to the pair rows, for filtering pairs by item.
+    A query is a glyph or group name, which also matches pairs kerned
+    through the glyph’s group, a prefix (A*), or a glob pattern
+    (public.kern1.O*, ?acute). Prefixes are looked up by bisection,
+    glob patterns only test names sharing their literal prefix.
+    '''
+
+    def __init__(self, pairs, groups):
+        first_groups, second_groups = kernResolver.group_maps(groups)
+        pairs = list(pairs)
+        self.left = _ItemSide([first for first, _ in pairs], first_groups)
+        self.right = _ItemSide([second for _, second in pairs], second_groups)
+
+    def rows(self, left_query=None, right_query=None):
+        '''
+        Set of rows matching both queries, None if both are empty.
+        '''
+        left_query = (left_query or '').strip()
+        right_query = (right_query or '').strip()
+        if not left_query and not right_query:
+            return None
+        rows = None
+        if left_query:
+            rows = self.left.rows(left_query)
+        if right_query:
+            right_rows = self.right.rows(right_query)
+            rows = right_rows if rows is None else rows & right_rows
+        return rows
@@ -0,0 +1,384 @@
+'''
+Flattened kerning: the effective kerning of every glyph–glyph pair, with
+group kerning expanded to the cross product of the group members.
+Flattened kerning can be much larger than the kerning itself, so it is
+computed one left glyph at a time, and yielded in chunks of rows. Memory
+use depends on the number of glyphs and masters, not on the number of
+flattened pairs.
+
+For each left glyph, every master’s kerning is laid out over all glyphs
+as right glyphs, in increasing order of precedence (group–group,
+group–glyph, glyph–group, glyph–glyph pairs). Later layers overwrite
+earlier ones, so values are identical to font.kerning.find().
+'''
+
+import csv
+import json
+import struct
+
+import numpy as np
+
+import kernMatrix
+import kernResolver
+
+FLAT_FORMAT = 1
+MAGIC = b'KALFLAT\n'
+DEFAULT_CHUNK_SIZE = 1 << 16
+
+
+def _arrays(entries):
+    '''
+    (glyph ids, values) arrays from a list of (glyph id, value) tuples.
+    '''
+    ids, values = zip(*entries)
+    return (
+        np.array(ids, dtype=np.intp), np.array(values, dtype=np.float64))
+
+
+class _MasterLayers(object):
+    '''
+    Kerning of one master, keyed by left glyph or kern1 group, with
+    right glyphs and kern2 groups replaced by glyph ids.
+    '''
+
+    def __init__(self, index, glyph_ids):
+        self.first_groups = index.first_groups
+        members = {}
+        for glyph_name, group_name in index.second_groups.items():
+            members.setdefault(group_name, []).append(glyph_ids[glyph_name])
+        self.second_members = {
+            group_name: np.array(sorted(ids), dtype=np.intp) for
+            group_name, ids in members.items()}
+
+        self.glyph_glyph = self._by_first(
+            (first, glyph_ids[second], value) for
+            (first, second), value in index.glyph_glyph.items())
+        self.group_glyph = self._by_first(
+            (first, glyph_ids[second], value) for
+            (first, second), value in index.group_glyph.items())
+        # kern2 groups stay by name, they are expanded when used
+        self.glyph_group = {}
+        self.group_group = {}
+        for table, output in (
+            (index.glyph_group, self.glyph_group),
+            (index.group_group, self.group_group),
+        ):
+            for (first, second), value in table.items():
+                if second in self.second_members:
+                    output.setdefault(first, []).append((second, value))
+
+    @staticmethod
+    def _by_first(entries):
+        by_first = {}
+        for first, glyph_id, value in entries:
+            by_first.setdefault(first, []).append((glyph_id, value))
+        return {first: _arrays(items) for first, items in by_first.items()}
+
+    def _expanded(self, group_entries):
+        '''
+        Group entries (kern2 group, value) expanded to member glyphs.
+        A glyph is in one kern2 group only, so there are no overlaps.
+        '''
+        members = [self.second_members[name] for name, _ in group_entries]
+        values = [value for _, value in group_entries]
+        return (
+            np.concatenate(members),
+            np.repeat(np.array(values, dtype=np.float64),
+                      [len(ids) for ids in members]))
+
+    def left_glyphs(self, first_members):
+        '''
+        All glyphs with kerning on their left side.
+        '''
+        left = set(self.glyph_glyph) | set(self.glyph_group)
+        for group_name in set(self.group_glyph) | set(self.group_group):
+            left.update(first_members.get(group_name, ()))
+        return left
+
+    def layers(self, left):
+        '''
+        (glyph ids, values) of all kerning of a left glyph,
+        in increasing order of precedence.
+        '''
+        first_group = self.first_groups.get(left)
+        if first_group is not None:
+            entries = self.group_group.get(first_group)
+            if entries:
+                yield self._expanded(entries)
+            if first_group in self.group_glyph:
+                yield self.group_glyph[first_group]
+        entries = self.glyph_group.get(left)
+        if entries:
+            yield self._expanded(entries)
+        if left in self.glyph_glyph:
+            yield self.glyph_glyph[left]
+
+
+class Flattener(object):
+    '''
+    Flattened kerning of a number of masters.
+    '''
+
+    def __init__(self, fonts=None, indexes=None):
+        if indexes is None:
+            indexes = kernResolver.font_indexes(fonts)
+        glyph_names = set()
+        for index in indexes:
+            glyph_names.update(index.first_groups)
+            glyph_names.update(index.second_groups)
+            glyph_names.update(
+                first for first, _ in index.glyph_glyph)
+            glyph_names.update(
+                first for first, _ in index.glyph_group)
+            glyph_names.update(
+                second for _, second in index.glyph_glyph)
+            glyph_names.update(
+                second for _, second in index.group_glyph)
+        self.glyph_names = sorted(glyph_names)
+        glyph_ids = {name: i for i, name in enumerate(self.glyph_names)}
+
+        self.masters = [
+            _MasterLayers(index, glyph_ids) for index in indexes]
+        left_glyphs = set()
+        for index, master in zip(indexes, self.masters):
+            first_members = {}
+            for glyph_name, group_name in index.first_groups.items():
+                first_members.setdefault(group_name, []).append(glyph_name)
+            left_glyphs.update(master.left_glyphs(first_members))
+        self.left_glyphs = sorted(left_glyphs)
+        self.glyph_ids = glyph_ids
+
+    @property
+    def master_count(self):
+        return len(self.masters)
+
+    def left_rows(self, left):
+        '''
+        Returns (right glyph ids, values, kerned) of one left glyph;
+        values and kerned are rows × masters arrays.
+        '''
+        glyph_count = len(self.glyph_names)
+        values = np.zeros((self.master_count, glyph_count))
+        kerned = np.zeros((self.master_count, glyph_count), dtype=bool)
+        for master_index, master in enumerate(self.masters):
+            for ids, layer_values in master.layers(left):
+                values[master_index, ids] = layer_values
+                kerned[master_index, ids] = True
+        right_ids = np.flatnonzero(kerned.any(axis=0))
+        return right_ids, values[:, right_ids].T, kerned[:, right_ids].T
+
+    def chunks(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        '''
+        Yields (left glyph ids, right glyph ids, values, kerned) arrays
+        of up to *chunk_size* rows, sorted by left and right glyph name.
+        Values of unkerned cells are 0.
+        '''
+        buffered = []
+        buffered_rows = 0
+        for left in self.left_glyphs:
+            right_ids, values, kerned = self.left_rows(left)
+            if not len(right_ids):
+                continue
+            left_ids = np.full(len(right_ids), self.glyph_ids[left], np.intp)
+            buffered.append((left_ids, right_ids, values, kerned))
+            buffered_rows += len(right_ids)
+            while buffered_rows >= chunk_size:
+                chunk, buffered = _split(buffered, chunk_size)
+                buffered_rows -= chunk_size
+                yield chunk
+        if buffered_rows:
+            yield _split(buffered, buffered_rows)[0]
+
+    def rows(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        '''
+        Yields (left glyph, right glyph, values) for every flattened
+        pair, with None for masters in which the pair is not kerned.
+        '''
+        names = self.glyph_names
+        for left_ids, right_ids, values, kerned in self.chunks(chunk_size):
+            values = values.astype(kernMatrix._array_dtype(values))
+            for left_id, right_id, row_values, row_kerned in zip(
+                left_ids.tolist(), right_ids.tolist(),
+                values.tolist(), kerned.tolist()
+            ):
+                yield names[left_id], names[right_id], [
+                    value if is_kerned else None for
+                    value, is_kerned in zip(row_values, row_kerned)]
+
+    def count(self):
+        '''
+        Number of flattened pairs, computed without storing them.
+        '''
+        return sum(len(left_ids) for left_ids, _, _, _ in self.chunks())
+
+
+def _split(buffered, row_count):
+    '''
+    Concatenates the first *row_count* rows of a list of array tuples,
+    returns them and the remaining list.
+    '''
+    arrays = [np.concatenate(parts) for parts in zip(*buffered)]
+    chunk = tuple(array[:row_count] for array in arrays)
+    rest = tuple(array[row_count:] for array in arrays)
+    if len(rest[0]):
+        return chunk, [rest]
+    return chunk, []
+
+
+def write_csv(flattener, output, master_names):
+    '''
+    Writes flattened kerning as CSV, one row per pair, with an empty
+    cell for each master in which a pair is not kerned.
+    '''
+    writer = csv.writer(output)
+    writer.writerow(['left', 'right'] + list(master_names))
+    for left, right, values in flattener.rows():
+        writer.writerow(
+            [left, right] + ['' if value is None else value for value in values])
+
+
+def write_binary(flattener, output, master_names):
+    '''
+    Writes flattened kerning to a binary file object: a magic line and
+    a JSON header line (format, masters, glyph names), then chunks of
+
+        row count (uint32), value dtype (8 bytes, numpy notation),
+        left glyph ids (uint32), right glyph ids (uint32),
+        values (rows × masters), kerned flags (rows × masters, uint8)
+
+    in little-endian byte order, and a chunk of 0 rows at the end.
+    '''
+    header = {
+        'format': FLAT_FORMAT,
+        'masters': list(master_names),
+        'glyphs': flattener.glyph_names,
+    }
+    output.write(MAGIC)
+    output.write(json.dumps(header).encode('utf-8') + b'\n')
+    for left_ids, right_ids, values, kerned in flattener.chunks():
+        values = values.astype(kernMatrix._array_dtype(values))
+        dtype = values.dtype.newbyteorder('<')
+        output.write(struct.pack('<I', len(left_ids)))
+        output.write(dtype.str.encode('ascii').ljust(8))
+        output.write(left_ids.astype('<u4').tobytes())
+        output.write(right_ids.astype('<u4').tobytes())
+        output.write(values.astype(dtype).tobytes())
+        output.write(kerned.astype(np.uint8).tobytes())
+    output.write(struct.pack('<I', 0))
+
+
+def read_binary(blob):
+    '''
+    Reads a file written by write_binary() from a binary file object.
+    Returns the header, and a generator of (left glyph ids, right glyph
+    ids, values, kerned) chunks.
+    '''
+    if blob.readline() != MAGIC:
+        raise ValueError('Not a flattened kerning file')
+    header = json.loads(blob.readline().decode('utf-8'))
+    if header.get('format') != FLAT_FORMAT:
+        raise ValueError('Unknown flattened kerning format')
+    master_count = len(header['masters'])
+
+    def read(count, dtype):
+        dtype = np.dtype(dtype)
+        data = blob.read(count * dtype.itemsize)
+        if len(data) != count * dtype.itemsize:
+            raise ValueError('Truncated flattened kerning file')
+        return np.frombuffer(data, dtype=dtype)
+
+    def chunks():
+        while True:
+            row_count = struct.unpack('<I', blob.read(4))[0]
+            if not row_count:
+                return
+            dtype = blob.read(8).decode('ascii').strip()
+            cells = row_count * master_count
+            left_ids = read(row_count, '<u4')
+            right_ids = read(row_count, '<u4')
+            values = read(cells, dtype).reshape(row_count, master_count)
+            kerned = read(cells, np.uint8).reshape(
+                row_count, master_count).astype(bool)
+            yield left_ids, right_ids, values, kerned
+
+    return header, chunks()
+
+
+if __name__ == '__main__':
+    import argparse
+    import os
+    import sys
+
+    import fontSorter
+    import gposLoader
+
+    parser = argparse.ArgumentParser(
+        description=(
+            'Flattened glyph–glyph kerning of a folder of UFO masters or '
+            'compiled fonts, '
+            'with group kerning expanded'))
+
+    parser.add_argument(
+        'input_dir',
+        metavar='FOLDER',
+        help=(
+            'Directory containing UFO masters, or compiled fonts '
+            '(OTF/TTF) if there are no UFOs.'))
+
+    parser.add_argument(
+        '-o', '--output',
+        action='store',
+        metavar='FILE',
+        help='Output file (default: CSV on standard output).')
+
+    parser.add_argument(
+        '-f', '--format',
+        action='store',
+        choices=['csv', 'binary'],
+        help='Output format (default: from output file suffix, or csv).')
+
+    parser.add_argument(
+        '-c', '--count',
+        action='store_true',
+        default=False,
+        help='Only print the number of flattened pairs.')
+
+    parser.add_argument(
+        '-w', '--workers',
+        action='store',
+        type=int,
+        default=1,
+        metavar='N',
+        help='Number of processes reading masters, 0 for one per CPU.')
+
+    args = parser.parse_args()
+
+    ufo_paths = fontSorter.get_font_paths(args.input_dir)
+    if not ufo_paths:
+        sys.exit('no UFOs or compiled fonts found.')
+    ufo_paths = fontSorter.sort_fonts(
+        ufo_paths, designspace_path=fontSorter.find_designspace(ufo_paths))
+    fonts, indexes = gposLoader.load_masters(
+        ufo_paths, workers=args.workers or None)
+    flattener = Flattener(indexes=indexes)
+
+    if args.count:
+        print(flattener.count())
+        sys.exit()
+
+    master_names = [fontSorter.get_ps_font_name(path) for path in ufo_paths]
+    output_format = args.format
+    if output_format is None:
+        output_format = 'csv'
+        if args.output and os.path.splitext(args.output)[-1] != '.csv':
+            output_format = 'binary'
+    if output_format == 'binary':
+        if not args.output:
+            parser.error('binary output needs an output file')
+        with open(args.output, 'wb') as output:
+            write_binary(flattener, output, master_names)
+    elif args.output:
+        with open(args.output, 'w', newline='') as output:
+            write_csv(flattener, output, master_names)
+    else:
+        write_csv(flattener, sys.stdout, master_names)
@@ -1,6 +1,7 @@
 from __future__ import print_function
 import AppKit
 import math
+from PyObjCTools.AppHelper import callAfter
 import vanilla
 import mojo.UI
 import mojo.drawingTools as drawBot
@@ -8,8 +9,25 @@ from mojo.canvas import Canvas
 import importlib
 
 import fontSorter
+importlib.reload(fontSorter)
+import kernMatrix
+importlib.reload(kernMatrix)
+import kernCache
+importlib.reload(kernCache)
+import kernBatch
+importlib.reload(kernBatch)
+import kernJournal
+importlib.reload(kernJournal)
 import kerningHelper
 importlib.reload(kerningHelper)
+import kernFilters
+importlib.reload(kernFilters)
+import kernInterpolation
+importlib.reload(kernInterpolation)
+import kernClusters
+importlib.reload(kernClusters)
+import kernPrune
+importlib.reload(kernPrune)
 import pairView
 importlib.reload(pairView)
 from pairView import DrawPair
@@ -134,6 +152,8 @@ class CanvasDelegate(object):
             distances.append((i, d))
         distances.sort(key=lambda x: x[1])
         self.drag_index, _ = distances[0]
+        # everything until the next mouse down is undone in one step
+        self.parent.journal.begin('drag')
         pair_obj = getattr(
             self.parent.w.pairPreview, 'pair_{}'.format(self.drag_index))
 
@@ -147,6 +167,9 @@ class CanvasDelegate(object):
             self.update_textBox(self.drag_index)
             self.parent.w.c.update()
 
+    def mouseUp(self, event):
+        self.parent.edit_ended()
+
 
 class FlexibleWindow(object):
 
@@ -168,9 +191,20 @@ class FlexibleWindow(object):
             self.p_point_size = 100
 
         self.min_w_width = len(self.fonts) * self.min_unit_width
-        # cmb_kern_dict is an ordered dict
-        self.cmb_kern_dict = kerningHelper.get_combined_kern_dict(fonts)
+        self.repr_cache = kerningHelper.ReprPairCache()
+        self.journal = kernJournal.EditJournal()
+        # cmb_kern_dict is an ordered view of a KernMatrix, loaded from
+        # the on-disk cache for all masters saved since the last launch
+        self.kern_cache = kernCache.KernCache(kernCache.default_cache_dir(
+            [f.path for f in fonts if f.path]))
+        self.cached_exceptions = True
+        self.cmb_kern_dict = self.kern_cache.matrix(
+            fonts, [not f.path or f.naked().dirty for f in fonts]).as_dict()
         self.pair_list = list(self.cmb_kern_dict.keys())
+        self.interpolation_model = self.make_interpolation_model()
+        # inverted index for the pair item fields, built on first use
+        self.item_index = None
+        self.item_index_version = None
         self.filtered_pairlists = self.make_filtered_pairlists(
             self.cmb_kern_dict)
 
@@ -282,7 +316,7 @@ class FlexibleWindow(object):
             if kern_value is None:
                 kern_value = 0
 
-            repr_pair = kerningHelper.get_repr_pair(f, initial_pair)
+            repr_pair = self.repr_cache.get_repr_pair(f, initial_pair)
             # XXXX the following line is problematic
             # if UFOs with different group structures are opened
             repr_glyphs = [f[g_name] for g_name in repr_pair]
@@ -301,6 +335,29 @@ class FlexibleWindow(object):
             callback=self.filter_callback
         )
 
+        # buttons act on the current pair, or all pairs in the list
+        self.w.apply_to_list = vanilla.CheckBox(
+            (-(self.padding + self.button_width), -270,
+             self.button_width, 20),
+            'Apply to List',
+            sizeStyle='small')
+
+        # undo history
+        undo_buttons = [
+            # button label, name
+            ('Undo', 'undo'),
+            ('Redo', 'redo'),
+            ('Export…', 'export'),
+        ]
+        undo_button_width = self.button_width / len(undo_buttons)
+        for i, (b_label, b_name) in enumerate(undo_buttons):
+            button = vanilla.Button((
+                -(self.padding + self.button_width) + i * undo_button_width,
+                -240, undo_button_width, 20), b_label,
+                callback=getattr(self, '{}_button_callback'.format(b_name)),
+                sizeStyle='small')
+            setattr(self.w, 'button_{}'.format(b_name), button)
+
         # pair item filter fields
         # x origin and width are just placeholder they will be re-calculated before the window open
         self.w.pair_item_filter_left = vanilla.EditText(
@@ -330,76 +387,205 @@ class FlexibleWindow(object):
         # update pair item filter filed posSize before showing the window
         self._update_pair_item_field_size()
         self.w.bind('resize', self.resize_callback)
+        self.w.bind('close', self.close_callback)
+        self.add_font_observers()
         self.w.open()
+        callAfter(self.warm_filters)
 
     def make_filtered_pairlists(self, cmb_kern_dict):
         '''
-        Creates the filtered lists for selection in popup button
+        Creates the filter index behind the lists for selection in
+        popup button, returns the filter names in popup order
         '''
-        filter_lists = []
-        self.filter_options = []
-        small_average_value = 5
-        outlier_factor = 5
-
-        all_pairs = list(cmb_kern_dict.keys())
-        filter_lists.append(all_pairs)
-        self.filter_options.append(
-            'All Pairs ({})'.format(len(all_pairs)))
+        self.small_average_value = 5
+        self.outlier_factor = 5
+        # number of pairs in the high gamut and long-distance lists
+        self.gamut_amount = 100
+        self.largest_amount = 200
+        # largest difference (in any master) between similar pairs
+        self.cluster_tolerance = 2
+        # matrix version after the last finished edit, for the filters
+        # which are too slow to follow a drag (clusters, interpolation)
+        self.edited_version = cmb_kern_dict.matrix.version
+
+        self.filter_index = kernFilters.FilterIndex(
+            cmb_kern_dict.matrix,
+            outlier_factor=self.outlier_factor,
+            small_average_value=self.small_average_value,
+            gamut_amount=self.gamut_amount,
+            largest_amount=self.largest_amount)
+
+        # exceptions depend on the pairs present in each font and on
+        # the groups, not on kerning values; they are read from the
+        # fonts, so they are never computed in the background
+        self.groups_version = 0
+        self.exception_maps = []
+        self.exception_bases = {}
+        self.filter_index.register(
+            'exception', self.exception_rows,
+            version=self.exception_version, matrix_only=False)
+
+        filter_names = [
+            'all',
+            'single',
+            'same_value',
+            'zero_value',
+            'largest_value',
+            'high_gamut',
+            'outlier',
+            'exception',
+            'redundant',
+            'small_average',
+            'similar',
+        ]
+        # redundant exceptions are built along with the exceptions, and
+        # updated from the matrix when values change
+        self.redundancy_index = None
+        self.filter_index.register(
+            'redundant', self.redundant_rows, version=self.exception_version,
+            matrix_only=False, update=self.update_redundant_rows)
+        self.filter_index.register(
+            'similar', lambda: kernClusters.ValueClusters(
+                self.cmb_kern_dict.matrix,
+                self.cluster_tolerance).rows().tolist(),
+            version=lambda: self.edited_version)
+        if self.interpolation_model is not None:
+            self.filter_index.register(
+                'interpolation', lambda: self.interpolation_model.outlier_rows(
+                    self.cmb_kern_dict.matrix, self.largest_amount).tolist(),
+                version=lambda: self.edited_version)
+            filter_names.append('interpolation')
+        self.filter_options = self.make_filter_options(filter_names)
+        return filter_names
+
+    def make_filter_options(self, filter_names):
+        '''
+        Creates the popup button titles, including current pair counts
+        '''
+        labels = {
+            'all': 'All Pairs ({})',
+            'single': 'Single Pairs ({})',
+            'same_value': 'Same Value Across all Masters ({})',
+            'zero_value': 'Zero-Value Pairs ({})',
+            'largest_value': 'Long-Distance Kerning Pairs ({})',
+            'high_gamut': 'High Gamut Across Pairs ({})',
+            'outlier': 'Outliers by a Factor of {} ({{}})'.format(
+                self.outlier_factor),
+            'exception': 'Exceptions ({})',
+            'redundant': 'Redundant Exceptions ({})',
+            'small_average': 'Average Kern Distance < {} ({{}})'.format(
+                self.small_average_value),
+            'similar': 'Similar Across Masters (±{}) ({{}})'.format(
+                self.cluster_tolerance),
+            'interpolation': 'Interpolation Outliers ({})',
+        }
+        filter_options = []
+        for name in filter_names:
+            count = self.filter_index.count(name)
+            if count is None:
+                # not computed yet
+                count = '…'
+            filter_options.append(labels[name].format(count))
+        return filter_options
+
+    def make_interpolation_model(self):
+        '''
+        Interpolation model of the master locations, read from a
+        designspace file next to the UFOs or estimated from the style
+        names. None if the masters can not be interpolated.
+        '''
+        if len(self.fonts) < 3 or not all(f.path for f in self.fonts):
+            return None
+        try:
+            model = kernInterpolation.InterpolationModel.from_paths(
+                [f.path for f in self.fonts])
+        except ValueError as error:
+            print(error)
+            return None
+        if model.source:
+            print('Master locations from {}'.format(model.source))
+        return model
+
+    def exception_version(self):
+        '''
+        Changes when pairs are added or removed, or the groups change.
+        '''
+        return (
+            self.cmb_kern_dict.matrix.structure_version, self.groups_version)
 
-        single_pair_dict = kerningHelper.single_pair_dict(
-            self.cmb_kern_dict)
-        filter_lists.append(list(single_pair_dict.keys()))
-        self.filter_options.append(
-            'Single Pairs ({})'.format(len(single_pair_dict)))
+    def exception_rows(self):
+        matrix = self.cmb_kern_dict.matrix
+        if self.cached_exceptions and matrix.structure_version == 0:
+            self.exception_maps = self.kern_cache.exception_maps(self.fonts)
+        else:
+            self.exception_maps = [
+                kerningHelper.exception_map(font) for font in self.fonts]
+        self.exception_bases = kerningHelper.combine_exception_maps(
+            self.exception_maps)
+        pair_index = matrix.pair_index
+        return [pair_index[pair] for pair in self.exception_bases.keys()]
+
+    def redundant_rows(self):
+        # exception maps of the current structure
+        self.filter_index.rows('exception')
+        matrix = self.cmb_kern_dict.matrix
+        pair_index = matrix.pair_index
+        self.redundancy_index = kernPrune.RedundancyIndex(
+            self.exception_maps, [font.kerning for font in self.fonts],
+            lambda pair, master: matrix.values[
+                pair_index[pair], master].item())
+        return self._redundant_rows()
+
+    def update_redundant_rows(self, rows):
+        pairs = self.cmb_kern_dict.matrix.pairs
+        self.redundancy_index.update(pairs[row] for row in rows)
+        return self._redundant_rows()
+
+    def _redundant_rows(self):
+        pair_index = self.cmb_kern_dict.matrix.pair_index
+        return sorted(
+            pair_index[redundancy.pair] for redundancy in
+            self.redundancy_index.redundancies() if
+            redundancy.pair in pair_index)
+
+    def update_filter_options(self):
+        '''
+        Updates the counts in the popup button
+        '''
+        self.filter_options = self.make_filter_options(
+            self.filtered_pairlists)
+        sel_index = self.w.list_filter.get()
+        self.w.list_filter.setItems(self.filter_options)
+        self.w.list_filter.set(sel_index)
 
-        same_value_dict = kerningHelper.same_value_dict(
-            cmb_kern_dict)
-        filter_lists.append(list(same_value_dict.keys()))
-        self.filter_options.append(
-            'Same Value Across all Masters ({})'.format(len(same_value_dict)))
+    def warm_filters(self):
+        '''
+        Brings all filters up to date: those reading the fonts right
+        away, all others in the background.
+        '''
+        self.filter_index.warm_main_thread()
+        self.update_filter_options()
+        self.filter_index.warm(callback=self.filter_warmed)
 
-        zero_value_dict = kerningHelper.zero_value_dict(
-            self.cmb_kern_dict)
-        filter_lists.append(list(zero_value_dict.keys()))
-        self.filter_options.append(
-            'Zero-Value Pairs ({})'.format(len(zero_value_dict)))
+    def edit_ended(self):
+        '''
+        Called when a drag is over. Filters reading the fonts, and those
+        following self.edited_version, are only updated then, not while
+        the fonts are being edited.
+        '''
+        self.edited_version = self.cmb_kern_dict.matrix.version
+        self.warm_filters()
 
-        largest_value_dict = kerningHelper.largest_value_dict(
-            self.cmb_kern_dict)
-        filter_lists.append(list(largest_value_dict.keys()))
-        self.filter_options.append(
-            'Long-Distance Kerning Pairs ({})'.format(len(largest_value_dict)))
+    def filter_warmed(self, name):
+        # called from the background thread
+        callAfter(self.update_filter_options)
 
-        high_gamut_dict = kerningHelper.high_gamut_dict(
-            self.cmb_kern_dict)
-        filter_lists.append(list(high_gamut_dict.keys()))
-        self.filter_options.append(
-            'High Gamut Across Pairs ({})'.format(len(high_gamut_dict)))
-
-        outlier_dict = kerningHelper.outlier_dict(
-            self.cmb_kern_dict, outlier_factor)
-        filter_lists.append(list(outlier_dict.keys()))
-        self.filter_options.append(
-            'Outliers by a Factor of {} ({})'.format(
-                outlier_factor, len(outlier_dict)))
-
-        exception_dict = kerningHelper.exception_dict(
-            self.fonts, self.cmb_kern_dict)
-        filter_lists.append(list(exception_dict.keys()))
-        self.filter_options.append(
-            'Exceptions ({})'.format(len(exception_dict)))
-
-        small_average_dict = kerningHelper.small_average_dict(
-            self.cmb_kern_dict, small_average_value)
-        filter_lists.append(list(small_average_dict.keys()))
-        self.filter_options.append(
-            'Average Kern Distance < {} ({})'.format(
-                small_average_value, len(small_average_dict)))
-
-        # self.filter_options.append(
-        #     'Zero Test ({})'.format(len([])))
-
-        return filter_lists
+    def update_filters(self, pair):
+        '''
+        Re-evaluates the filter membership of an edited pair. The counts
+        in the popup button are updated by edit_ended, once the drag is over.
+        '''
+        self.filter_index.update(self.cmb_kern_dict.matrix.pair_index[pair])
 
     def make_columns(self, pair_list):
         column_pairs = []
@@ -426,11 +612,14 @@ class FlexibleWindow(object):
 
     def update_kerning(self, font_index, pair, value):
         font = self.fonts[font_index]
+        self.journal.record(pair, font_index, font.kerning.get(pair), value)
         if value is None:
             if pair in font.kerning.keys():
                 del font.kerning[pair]
         else:
             font.kerning[pair] = value
+        self.cmb_kern_dict.set_value(pair, font_index, value)
+        self.update_filters(pair)
 
     def resize_callback(self, sender):
         # resize graph
@@ -474,26 +663,75 @@ class FlexibleWindow(object):
         x_right, y_right, w_right, h_right = self.w.pair_item_filter_right.getPosSize()
         self.w.pair_item_filter_right.setPosSize((available_width / 2 + margin_x, y_right, available_width / 2, h_right))
 
+    def add_font_observers(self):
+        # representative glyphs depend on groups and glyph order
+        for f in self.fonts:
+            font = f.naked()
+            font.groups.addObserver(
+                self, 'font_structure_changed', 'Groups.Changed')
+            font.addObserver(
+                self, 'font_structure_changed', 'Font.GlyphOrderChanged')
+
+    def remove_font_observers(self):
+        for f in self.fonts:
+            font = f.naked()
+            font.groups.removeObserver(self, 'Groups.Changed')
+            font.removeObserver(self, 'Font.GlyphOrderChanged')
+
+    def font_structure_changed(self, notification):
+        self.repr_cache.invalidate()
+        # groups may have changed, cached exceptions are outdated
+        self.cached_exceptions = False
+        self.item_index = None
+        self.groups_version += 1
+        self.update_filter_options()
+
+    def close_callback(self, sender):
+        self.remove_font_observers()
+
     def filter_callback(self, sender):
         self.update_display_list()
+        # the chosen filter may have been computed just now
+        self.update_filter_options()
 
     def pair_item_callback(self, sender):
         self.update_display_list()
 
     def _get_filtered_pair_list(self):
         sel_index = self.w.list_filter.get()
-        self.pair_list = self.filtered_pairlists[sel_index]
+        filter_name = self.filtered_pairlists[sel_index]
+        item_rows = self._get_item_rows()
+        if item_rows is None:
+            rows = self.filter_index.rows(filter_name)
+        elif filter_name == 'all':
+            rows = sorted(item_rows)
+        else:
+            rows = [
+                row for row in self.filter_index.rows(filter_name) if
+                row in item_rows]
+        pairs = self.cmb_kern_dict.matrix.pairs
+        self.pair_list = [pairs[row] for row in rows]
 
-    def _get_filtered_per_item_pair_list(self):
-        # XXXX self.fonts[0] assume all fonts have the same groups structure
-        # this might be problematic sometimes (?)
-        self.pair_list = kerningHelper.filter_pair_list_by_items(self.fonts[0], self.pair_list,
-                                                                 filter_item_left=self.w.pair_item_filter_left.get(),
-                                                                 filter_item_right=self.w.pair_item_filter_right.get())
+    def _get_item_rows(self):
+        '''
+        Rows matching the pair item fields, None if both are empty.
+        '''
+        matrix = self.cmb_kern_dict.matrix
+        if (
+            self.item_index is None or
+            self.item_index_version != matrix.structure_version
+        ):
+            # XXXX self.fonts[0] assume all fonts have the same groups structure
+            # this might be problematic sometimes (?)
+            self.item_index = kernFilters.PairItemIndex(
+                matrix.pairs, self.fonts[0].groups)
+            self.item_index_version = matrix.structure_version
+        return self.item_index.rows(
+            self.w.pair_item_filter_left.get(),
+            self.w.pair_item_filter_right.get())
 
     def update_display_list(self):
         self._get_filtered_pair_list()
-        self._get_filtered_per_item_pair_list()
         self.w.display_list.set(self.make_columns(self.pair_list))
 
     def list_callback(self, sender):
@@ -521,7 +759,7 @@ class FlexibleWindow(object):
 
             print(self.pair, new_values)
             for f_index, f in enumerate(self.fonts):
-                repr_pair = kerningHelper.get_repr_pair(f, self.pair)
+                repr_pair = self.repr_cache.get_repr_pair(f, self.pair)
                 repr_glyphs = [f[g_name] for g_name in repr_pair]
                 kern_value = f.kerning.get(self.pair, 0)
                 pair_obj = getattr(
@@ -536,10 +774,8 @@ class FlexibleWindow(object):
             checked.append(pair_obj.checked)
         return checked
 
-    def update_stack(self, pair, value_list):
+    def update_pair_display(self, value_list):
         self.values = value_list
-        self.cmb_kern_dict[pair] = value_list
-
         self.update_display(value_list)
         self.update_textBoxes()
         for i, value in enumerate(value_list):
@@ -548,100 +784,96 @@ class FlexibleWindow(object):
             pair_obj.setKerning(value)
         self.w.c.update()
 
+    def apply_batch(self, operation, **parameters):
+        '''
+        Applies a kernBatch operation to the current pair, or to all
+        listed pairs if "Apply to List" is checked, in all fonts.
+        '''
+        if self.w.apply_to_list.get():
+            pairs = list(self.pair_list)
+        else:
+            pairs = [self.pair]
+        try:
+            delta = kernBatch.batch_edit(
+                self.fonts, self.cmb_kern_dict.matrix, pairs, operation,
+                journal=self.journal, **parameters)
+        except ValueError as error:
+            print(error)
+            return
+        self.update_edited_pairs(set(pair for pair, _, _, _ in delta))
+        print('{}: {} values changed in {} pair(s)'.format(
+            operation, len(delta), len(set(d[0] for d in delta))))
+
+    def update_edited_pairs(self, pairs):
+        '''
+        Updates filters and display after many pairs have been edited.
+        '''
+        pair_index = self.cmb_kern_dict.matrix.pair_index
+        self.filter_index.update_rows(pair_index[pair] for pair in pairs)
+        self.edited_version = self.cmb_kern_dict.matrix.version
+        self.warm_filters()
+        self.update_pair_display(self.cmb_kern_dict[self.pair])
+
+    def undo_button_callback(self, sender):
+        operation = self.journal.undo(
+            self.fonts, self.cmb_kern_dict.matrix)
+        if operation is None:
+            print('Nothing to undo.')
+            return
+        self.update_edited_pairs(self.journal.operation_pairs(operation))
+        print('Undo {}'.format(operation.label))
+
+    def redo_button_callback(self, sender):
+        operation = self.journal.redo(
+            self.fonts, self.cmb_kern_dict.matrix)
+        if operation is None:
+            print('Nothing to redo.')
+            return
+        self.update_edited_pairs(self.journal.operation_pairs(operation))
+        print('Redo {}'.format(operation.label))
+
+    def export_button_callback(self, sender):
+        path = mojo.UI.PutFile(
+            'Export kerning edits', fileName='kerning-edits.json')
+        if path:
+            self.journal.export(
+                path, [kernJournal.master_name(f) for f in self.fonts])
+            print('Edits exported to {}'.format(path))
+
+    def _checked_masters(self):
+        return [i for i, b_value in enumerate(self.checked) if b_value == 1]
+
     def delete_button_callback(self, sender):
-        for i, f in enumerate(self.fonts):
-            self.update_kerning(i, self.pair, None)
-        new_values = [None for i in range(len(self.fonts))]
-        self.update_stack(self.pair, new_values)
-        print('deleting {} {}'.format(*self.pair))
-
-    def _interpolate(self, poles, factor, extrapolate=False):
-        p_min, p_max = poles
-        difference = p_max - p_min
-        result = p_min + difference * factor
-        if extrapolate:
-            result = p_max + difference * factor
-        return result
+        self.apply_batch('delete')
 
     def interpolate_button_callback(self, sender):
-        # This is not really thought through.
-        # For instance: what happens if all boxes are checked?
-        c_index = [i for i, b_value in enumerate(self.checked) if b_value == 1]
-        number_values = [0 if v is None else v for v in self.values]
-        new_values = [v for v in self.values]
-        factor = 0.5
-
-        if len(number_values) > 3:
-            print('Need at least 3 masters to interpolate')
-            pass
-
-        if not c_index:
-            print('Please select interpolation target(s)')
-            pass
-
-        for c_i in c_index:
-            if c_i == 0:
-                # extrapolation on the left
-                poles = (number_values[2], number_values[1])
-                value = self._interpolate(poles, factor, extrapolate=True)
-            elif c_i == (len(number_values) - 1):
-                # extrapolation on the right
-                poles = (number_values[-3], number_values[-2])
-                value = self._interpolate(poles, factor, extrapolate=True)
-            else:
-                # normal interpolation
-                poles = (number_values[c_i - 1], number_values[c_i + 1])
-                value = self._interpolate(poles, factor)
-            kern_value = int(round(value))
-            new_values[c_i] = kern_value
-        self.update_stack(self.pair, new_values)
+        # predicted from the master locations if they are known
+        weights = None
+        if self.interpolation_model is not None:
+            weights = self.interpolation_model.weights
+        self.apply_batch(
+            'interpolate', targets=self._checked_masters(), factor=0.5,
+            weights=weights)
 
     def transfer_button_callback(self, sender):
-        c_index = [i for i, b_value in enumerate(self.checked) if b_value == 1]
+        c_index = self._checked_masters()
         if len(c_index) == 0:
             print('Select a source checkbox.')
         elif len(c_index) > 1:
             print('Select only one source checkbox.')
         else:
-            c_index_number = c_index[0]
-            t_value = self.values[c_index_number]
-            new_values = [t_value for i in range(len(self.fonts))]
-            self.update_stack(self.pair, new_values)
-            print('Transfering value {} across pairs'.format(t_value))
+            self.apply_batch('equalize', source=c_index[0])
 
     def average_button_callback(self, sender):
-        number_values = [0 if v is None else v for v in self.values]
-        average_value = int(round(sum(number_values) / len(number_values)))
-        new_values = [average_value for i in range(len(self.fonts))]
-        self.update_stack(self.pair, new_values)
-        print('Setting pairs to average value {}'.format(average_value))
-
-    def increase_values(self, value_list, amount):
-        '''
-        Change all or selected values by amount.
-        Used by plus_ and minus_button_callback functions.
-        '''
-        c_index = [i for i, b_value in enumerate(self.checked) if b_value == 1]
-        number_values = [0 if v is None else v for v in value_list]
-        if len(c_index) in [0, len(self.fonts)]:
-            # all or nothing are checked
-            new_values = [value + amount for value in number_values]
-        else:
-            # only some are checked
-            new_values = [
-                value + amount if
-                i in c_index else
-                value for i, value in enumerate(number_values)
-            ]
-        return new_values
+        self.apply_batch('average')
 
     def plus_button_callback(self, sender):
-        new_values = self.increase_values(self.values, 10)
-        self.update_stack(self.pair, new_values)
+        # all masters if all or nothing are checked
+        self.apply_batch('offset', amount=10, masters=self._checked_masters())
 
     def minus_button_callback(self, sender):
-        new_values = self.increase_values(self.values, -10)
-        self.update_stack(self.pair, new_values)
+        self.apply_batch(
+            'offset', amount=-10, masters=self._checked_masters())
 
     def dummy_button_callback(self, sender):
         pass
@@ -656,8 +888,13 @@ if __name__ == '__main__':
     if fonts_without_kerning:
         for ukf in fonts_without_kerning:
             print(ukf.info.styleName, 'has no kerning')
+    ufo_paths = [f.path for f in fonts_with_kerning]
+    # masters are ordered by their locations if there is a designspace
+    designspace_path = None
+    if ufo_paths:
+        designspace_path = fontSorter.find_designspace(ufo_paths)
     sorted_ufo_filenames = fontSorter.sort_fonts(
-        [f.path for f in fonts_with_kerning])
+        ufo_paths, designspace_path=designspace_path)
     fonts = sorted(
         [f for f in fonts_with_kerning],
         key=lambda f: sorted_ufo_filenames.index(f.path))
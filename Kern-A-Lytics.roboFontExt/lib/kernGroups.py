@@ -0,0 +1,204 @@
+'''
+Kerning group suggestions. Glyphs which are kerned on their own, but
+against the same partners by the same values in every master as other
+glyphs (or as an existing group), could share a group: the pairs of all
+but one of them would be redundant.
+
+For each side, every item kerned on that side (a glyph, or a group of
+that side) has a profile: its partners on the other side, and its
+values with each of them in every master. Items are bucketed by their
+set of partners, the profiles within a bucket are clustered like the
+pair values in kernClusters: identical profiles, or profiles within
+a tolerance in every value. Glyphs kerned as members of a group
+(exceptions) are not suggested.
+'''
+
+import collections
+
+import numpy as np
+
+import kernClusters
+import kernResolver
+
+Suggestion = collections.namedtuple(
+    'Suggestion',
+    ['side', 'group', 'new_group', 'items', 'pair_reduction', 'deviation'])
+
+sides = ('left', 'right')
+
+
+def _ids(names):
+    '''
+    An id for each name, in order of first appearance.
+    '''
+    index = {}
+    ids = np.fromiter(
+        (index.setdefault(name, len(index)) for name in names),
+        dtype=np.intp, count=len(names))
+    return list(index), ids
+
+
+class _NewGroupNames(object):
+    '''
+    Names for new groups, named after their first glyph in glyph order,
+    which are not used by existing groups.
+    '''
+
+    def __init__(self, groups, glyph_order=None):
+        self.used = set(groups)
+        self.glyph_ids = {
+            name: i for i, name in enumerate(glyph_order or [])}
+
+    def name(self, prefix, glyphs):
+        last = len(self.glyph_ids)
+        first = min(glyphs, key=lambda g: (self.glyph_ids.get(g, last), g))
+        name = prefix + first
+        suffix = 1
+        while name in self.used:
+            suffix += 1
+            name = '{}{}_{}'.format(prefix, first, suffix)
+        self.used.add(name)
+        return name
+
+
+def _side_suggestions(matrix, values, side, groups, new_names, tolerance):
+    prefix = (kernResolver.FIRST_PREFIX, kernResolver.SECOND_PREFIX)[side]
+    glyph_groups = kernResolver.group_maps(groups)[side]
+    pairs = matrix.pairs
+    item_names, item_ids = _ids([pair[side] for pair in pairs])
+    _, partner_ids = _ids([pair[1 - side] for pair in pairs])
+
+    # rows of each item, sorted by partner
+    order = np.lexsort((partner_ids, item_ids))
+    sorted_items = item_ids[order]
+    starts = np.flatnonzero(np.concatenate(
+        ([True], sorted_items[1:] != sorted_items[:-1])))
+    ends = np.append(starts[1:], len(order))
+
+    buckets = collections.defaultdict(list)
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        item = item_names[sorted_items[start]]
+        if item.startswith(prefix) or item not in glyph_groups:
+            rows = order[start:end]
+            buckets[partner_ids[rows].tobytes()].append((item, rows))
+
+    suggestions = []
+    master_count = values.shape[1]
+    for bucket in buckets.values():
+        if len(bucket) < 2:
+            continue
+        items = [item for item, _ in bucket]
+        partner_count = len(bucket[0][1])
+        profiles = values[np.stack([rows for _, rows in bucket])].reshape(
+            len(bucket), partner_count * master_count)
+        vectors, inverse, counts = kernClusters.distinct_rows(profiles)
+        leaders = kernClusters.leading_vectors(vectors, counts, tolerance)
+        clusters = collections.defaultdict(list)
+        for position, leader in enumerate(leaders[inverse].tolist()):
+            clusters[leader].append(position)
+
+        for leader, positions in clusters.items():
+            if len(positions) < 2:
+                continue
+            members = [items[p] for p in positions]
+            existing = [
+                (-len(groups.get(item, ())), item, p) for item, p in
+                zip(members, positions) if item.startswith(prefix)]
+            if existing:
+                _, group, target_position = min(existing)
+                target = profiles[target_position]
+            else:
+                group = new_names.name(prefix, members)
+                target = vectors[leader]
+            deviation = np.abs(profiles[positions] - target).max().item()
+            suggestions.append(Suggestion(
+                sides[side], group, not existing,
+                [item for item in members if item != group],
+                (len(members) - 1) * partner_count, deviation))
+    return suggestions
+
+
+def suggest_groups(matrix, groups, tolerance=0, glyph_order=None):
+    '''
+    Returns a list of Suggestion tuples for a KernMatrix and the kerning
+    groups of its fonts: on which side (left or right) *items* could be
+    merged into *group* (a new group if *new_group*), how many pairs
+    fewer there would be, and by how much a value would change at most
+    (up to 2 × *tolerance* against existing groups, up to *tolerance*
+    otherwise). New groups are named after their first glyph in
+    *glyph_order*. Suggestions saving the most pairs come first.
+    '''
+    values = kernClusters.value_vectors(matrix)
+    new_names = _NewGroupNames(groups, glyph_order)
+    suggestions = []
+    for side in range(2):
+        suggestions.extend(_side_suggestions(
+            matrix, values, side, groups, new_names, tolerance))
+    return sorted(suggestions, key=lambda s: (
+        -s.pair_reduction, s.deviation, s.side, s.group))
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    import fontSorter
+    import gposLoader
+    import kernMatrix
+
+    parser = argparse.ArgumentParser(
+        description=(
+            'Suggest kerning groups for glyphs kerned alike in a folder '
+            'of UFO masters'))
+
+    parser.add_argument(
+        'input_dir',
+        metavar='FOLDER',
+        help=(
+            'Directory containing UFO masters, or compiled fonts '
+            '(OTF/TTF) if there are no UFOs.'))
+
+    parser.add_argument(
+        '-t', '--tolerance',
+        action='store',
+        type=int,
+        default=0,
+        help='Largest difference of a merged value (default: 0)')
+
+    parser.add_argument(
+        '-n', '--amount',
+        action='store',
+        type=int,
+        default=50,
+        help='Number of suggestions shown (default: 50), 0 for all.')
+
+    parser.add_argument(
+        '-w', '--workers',
+        action='store',
+        type=int,
+        default=1,
+        metavar='N',
+        help='Number of processes reading masters, 0 for one per CPU.')
+
+    args = parser.parse_args()
+
+    font_paths = fontSorter.get_font_paths(args.input_dir)
+    if not font_paths:
+        sys.exit('no UFOs or compiled fonts found.')
+    fonts, indexes = gposLoader.load_masters(
+        font_paths, workers=args.workers or None)
+    matrix = kernMatrix.KernMatrix.from_fonts(fonts, indexes)
+
+    # groups of the first master, as in the window
+    suggestions = suggest_groups(
+        matrix, fonts[0].groups, args.tolerance, fonts[0].glyphOrder)
+    for suggestion in suggestions[:args.amount or None]:
+        print('{} {}{}: {} ({} pairs fewer{})'.format(
+            suggestion.side, suggestion.group,
+            ' (new)' if suggestion.new_group else '',
+            ' '.join(suggestion.items), suggestion.pair_reduction,
+            ', values change by up to {}'.format(suggestion.deviation) if
+            suggestion.deviation else ''))
+    print('{} suggestions, {} pairs fewer'.format(
+        len(suggestions), sum(s.pair_reduction for s in suggestions)),
+        file=sys.stderr)
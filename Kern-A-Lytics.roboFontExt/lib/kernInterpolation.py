@@ -0,0 +1,148 @@
+'''
+Interpolation model of the masters’ design locations. Every master’s
+kerning value is predicted from the other masters by an affine fit over
+the design space (a leave-one-out least squares model), which reduces to
+one masters × masters weight matrix. Predictions and deviations for all
+pairs are then a single matrix product over the KernMatrix values.
+'''
+
+import numpy as np
+
+import fontSorter
+import kernMatrix
+
+# rows per matrix product, to bound the memory of temporary arrays
+CHUNK_SIZE = 1 << 16
+
+
+def master_locations(ufo_paths, designspace_path=None):
+    '''
+    Design locations ({axis name: value} dicts) of UFO masters, read
+    from a .designspace file if one is given or found, otherwise
+    approximated by fontSorter from the style names.
+    Returns the locations and the designspace path (or None).
+    '''
+    if designspace_path is None:
+        designspace_path = fontSorter.find_designspace(ufo_paths)
+    if designspace_path is None:
+        return [fontSorter.get_axis_scores(p) for p in ufo_paths], None
+
+    grid = fontSorter.AxisGrid.from_designspace(ufo_paths, designspace_path)
+    return grid.locations, designspace_path
+
+
+def normalized_locations(locations):
+    '''
+    Masters × axes array of locations, each axis scaled to 0–1.
+    Axes on which all masters are at the same location are left out.
+    A master missing an axis (in estimated locations) is placed at the
+    axis minimum.
+    '''
+    axis_names = sorted(set(name for loc in locations for name in loc))
+    columns = []
+    for name in axis_names:
+        column = np.array(
+            [loc.get(name, np.nan) for loc in locations], dtype=np.float64)
+        lowest = np.nanmin(column)
+        extent = np.nanmax(column) - lowest
+        if not extent:
+            continue
+        columns.append(np.nan_to_num((column - lowest) / extent, nan=0.))
+    if not columns:
+        return np.zeros((len(locations), 0))
+    return np.column_stack(columns)
+
+
+def leave_one_out_weights(points):
+    '''
+    Masters × masters matrix W, so that W[m] @ values predicts master m
+    from the other masters’ values, by an affine least squares fit over
+    their locations. The diagonal is zero.
+    '''
+    master_count = len(points)
+    design = np.column_stack([np.ones(master_count), points])
+    weights = np.zeros((master_count, master_count))
+    for master in range(master_count):
+        others = np.arange(master_count) != master
+        weights[master, others] = design[master] @ np.linalg.pinv(
+            design[others])
+    return weights
+
+
+class InterpolationModel(object):
+    '''
+    Predicts each master’s kerning from the other masters, see the
+    module docstring. Unkerned values count as 0.
+    '''
+
+    def __init__(self, locations, source=None):
+        if len(locations) < 3:
+            raise ValueError('Need at least 3 masters to interpolate')
+        self.locations = locations
+        # designspace path the locations come from, None if estimated
+        self.source = source
+        self.points = normalized_locations(locations)
+        self.weights = leave_one_out_weights(self.points)
+
+    @classmethod
+    def from_paths(cls, ufo_paths, designspace_path=None):
+        locations, source = master_locations(ufo_paths, designspace_path)
+        return cls(locations, source)
+
+    def _chunks(self, matrix, rows):
+        if rows is None:
+            rows = np.arange(len(matrix))
+        rows = np.asarray(rows, dtype=np.intp)
+        values = kernMatrix._wide(matrix)
+        for start in range(0, len(rows), CHUNK_SIZE):
+            chunk = values[rows[start:start + CHUNK_SIZE]].astype(np.float64)
+            yield chunk, chunk @ self.weights.T
+
+    def predictions(self, matrix, rows=None):
+        '''
+        Rows × masters array of predicted values (all rows by default).
+        '''
+        master_count = self.weights.shape[0]
+        parts = [predicted for _, predicted in self._chunks(matrix, rows)]
+        if not parts:
+            return np.zeros((0, master_count))
+        return np.concatenate(parts)
+
+    def deviations(self, matrix, rows=None):
+        '''
+        Rows × masters array of how far each value is from the value
+        predicted by the other masters.
+        '''
+        master_count = self.weights.shape[0]
+        parts = [
+            values - predicted for
+            values, predicted in self._chunks(matrix, rows)]
+        if not parts:
+            return np.zeros((0, master_count))
+        return np.concatenate(parts)
+
+    def scores(self, matrix):
+        '''
+        The largest absolute deviation of each row, and the master it
+        occurs in.
+        '''
+        scores = np.zeros(len(matrix))
+        masters = np.zeros(len(matrix), dtype=np.intp)
+        start = 0
+        for values, predicted in self._chunks(matrix, None):
+            deviation = np.abs(values - predicted)
+            end = start + len(deviation)
+            masters[start:end] = deviation.argmax(axis=1)
+            scores[start:end] = deviation.max(axis=1)
+            start = end
+        return scores, masters
+
+    def outlier_rows(self, matrix, amount=200, min_deviation=1):
+        '''
+        Row indices of the *amount* pairs deviating most from the
+        interpolation, largest deviation first. Deviations smaller than
+        *min_deviation* units are not reported.
+        '''
+        scores, _ = self.scores(matrix)
+        rows = kernMatrix.top_k_rows(scores, amount)
+        return rows[scores[rows] >= min_deviation]
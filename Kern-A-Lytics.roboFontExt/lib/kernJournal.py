@@ -0,0 +1,253 @@
+import array
+import collections
+import json
+
+import kernBatch
+
+JOURNAL_FORMAT = 1
+
+Operation = collections.namedtuple(
+    'Operation', ['label', 'pair_ids', 'masters', 'old_values', 'new_values'])
+
+
+def master_name(font):
+    '''
+    Name identifying a master across checkouts, as in
+    fontSorter.get_ps_font_name.
+    '''
+    info = font.info
+    if info.postscriptFontName:
+        return info.postscriptFontName
+    return '-'.join([
+        (info.familyName or 'Family Name').replace(' ', ''),
+        (info.styleName or 'Style Name').replace(' ', '')])
+
+
+class EditJournal(object):
+    '''
+    Undo/redo history of kerning edits. An operation (a drag, a batch
+    edit) is stored as compact (pair id, master, old value, new value)
+    records of the kerning in the fonts; None stands for a pair which
+    is not in a font’s kerning. Repeated edits of the same cell within
+    an operation are coalesced into one record.
+    Undoing and redoing writes each master’s kerning in a single update.
+    '''
+
+    def __init__(self):
+        self.pairs = []
+        self.pair_ids = {}
+        self.done = []
+        self.undone = []
+        # operation being recorded: (label, {(pair id, master): [old, new]})
+        self.current = None
+
+    def _pair_id(self, pair):
+        pair_id = self.pair_ids.get(pair)
+        if pair_id is None:
+            pair_id = self.pair_ids[pair] = len(self.pairs)
+            self.pairs.append(pair)
+        return pair_id
+
+    def begin(self, label):
+        '''
+        Starts a new operation, following edits are recorded into it.
+        '''
+        self.end()
+        self.current = (label, {})
+
+    def end(self):
+        '''
+        Closes the current operation, unless nothing has changed.
+        '''
+        if self.current is None:
+            return
+        label, cells = self.current
+        self.current = None
+        records = [
+            (pair_id, master, old_value, new_value) for
+            (pair_id, master), (old_value, new_value) in cells.items() if
+            old_value != new_value or (old_value is None) != (new_value is None)]
+        if not records:
+            return
+        pair_ids, masters, old_values, new_values = zip(*records)
+        self.done.append(Operation(
+            label, array.array('l', pair_ids), array.array('h', masters),
+            list(old_values), list(new_values)))
+        self.undone = []
+
+    def record(self, pair, master, old_value, new_value):
+        if self.current is None:
+            self.begin('edit')
+        cells = self.current[1]
+        key = (self._pair_id(pair), master)
+        if key in cells:
+            cells[key][1] = new_value
+        else:
+            cells[key] = [old_value, new_value]
+
+    def record_delta(self, label, records):
+        '''
+        Records (pair, master, old value, new value) records, e.g. from
+        kernBatch.write_cells, as one operation.
+        '''
+        self.begin(label)
+        for pair, master, old_value, new_value in records:
+            self.record(pair, master, old_value, new_value)
+        self.end()
+
+    def can_undo(self):
+        return bool(self.done) or (
+            self.current is not None and bool(self.current[1]))
+
+    def can_redo(self):
+        return self.current is None and bool(self.undone)
+
+    def _cells(self, operation, values):
+        pairs = self.pairs
+        return [
+            (pairs[pair_id], master, value) for pair_id, master, value in
+            zip(operation.pair_ids, operation.masters, values)]
+
+    def undo(self, fonts, matrix=None):
+        '''
+        Reverts the last operation in the fonts (and the matrix).
+        Returns the operation, None if there is nothing to undo.
+        '''
+        self.end()
+        if not self.done:
+            return None
+        operation = self.done.pop()
+        kernBatch.write_cells(
+            fonts, matrix, self._cells(operation, operation.old_values),
+            resolve_removed=True)
+        self.undone.append(operation)
+        return operation
+
+    def redo(self, fonts, matrix=None):
+        '''
+        Applies the last undone operation again.
+        Returns the operation, None if there is nothing to redo.
+        '''
+        self.end()
+        if not self.undone:
+            return None
+        operation = self.undone.pop()
+        kernBatch.write_cells(
+            fonts, matrix, self._cells(operation, operation.new_values))
+        self.done.append(operation)
+        return operation
+
+    def operation_pairs(self, operation):
+        return [self.pairs[pair_id] for pair_id in set(operation.pair_ids)]
+
+    def export(self, path, master_names):
+        '''
+        Writes all applied operations to a JSON file, which can be
+        replayed on other copies of the masters with replay().
+        '''
+        self.end()
+        operations = []
+        for operation in self.done:
+            edits = [
+                list(self.pairs[pair_id]) + [master, old_value, new_value]
+                for pair_id, master, old_value, new_value in zip(
+                    operation.pair_ids, operation.masters,
+                    operation.old_values, operation.new_values)]
+            operations.append({'label': operation.label, 'edits': edits})
+        with open(path, 'w') as blob:
+            json.dump({
+                'format': JOURNAL_FORMAT,
+                'masters': list(master_names),
+                'operations': operations,
+            }, blob, indent=1)
+
+
+def replay(path, fonts, master_names, matrix=None, journal=None):
+    '''
+    Applies the operations of an exported journal to *fonts*, matching
+    masters by name. Cells whose current kerning differs from the
+    recorded old value are skipped.
+    Returns the number of cells written, and a list of skipped
+    (label, pair, master name, expected value, current value) conflicts.
+    '''
+    with open(path, 'r') as blob:
+        data = json.load(blob)
+    if data.get('format') != JOURNAL_FORMAT:
+        raise ValueError('Unknown journal format in {}'.format(path))
+    font_indices = {name: i for i, name in enumerate(master_names)}
+    master_map = [font_indices.get(name) for name in data['masters']]
+
+    written = 0
+    conflicts = []
+    for operation in data['operations']:
+        cells = []
+        for first, second, master, old_value, new_value in operation['edits']:
+            pair = (first, second)
+            font_index = master_map[master]
+            if font_index is None:
+                conflicts.append((
+                    operation['label'], pair, data['masters'][master],
+                    old_value, None))
+                continue
+            current = fonts[font_index].kerning.get(pair)
+            if current != old_value:
+                conflicts.append((
+                    operation['label'], pair, data['masters'][master],
+                    old_value, current))
+                continue
+            cells.append((pair, font_index, new_value))
+        records = kernBatch.write_cells(fonts, matrix, cells)
+        written += len(records)
+        if journal is not None:
+            journal.record_delta(operation['label'], records)
+    return written, conflicts
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    import fontSorter
+    import ufoLoader
+
+    parser = argparse.ArgumentParser(
+        description='Replay exported Kern-A-Lytics edits on UFO masters')
+
+    parser.add_argument(
+        'journal',
+        metavar='JOURNAL',
+        help='Exported edits (JSON).')
+
+    parser.add_argument(
+        'input_dir',
+        metavar='FOLDER',
+        help='Directory containing UFO masters.')
+
+    parser.add_argument(
+        '-n', '--dry_run',
+        action='store_true',
+        default=False,
+        help='Report what would change, without writing any files.')
+
+    args = parser.parse_args()
+
+    ufo_paths = [
+        path for path in fontSorter.get_font_paths(args.input_dir) if
+        path.endswith('.ufo')]
+    if not ufo_paths:
+        sys.exit('no UFOs found.')
+    fonts = ufoLoader.load_fonts(ufo_paths)
+    original = [dict(font.kerning) for font in fonts]
+
+    written, conflicts = replay(
+        args.journal, fonts, [master_name(font) for font in fonts])
+    for label, pair, name, expected, current in conflicts:
+        print('skipped {}: {} {} in {} is {}, expected {}'.format(
+            label, pair[0], pair[1], name, current, expected))
+    print('{} kerning values changed, {} skipped'.format(
+        written, len(conflicts)))
+
+    if not args.dry_run:
+        for font, kerning in zip(fonts, original):
+            if dict(font.kerning) != kerning:
+                ufoLoader.write_kerning(font.path, font.kerning)
@@ -0,0 +1,444 @@
+import collections.abc
+import itertools
+
+import numpy as np
+
+import kernResolver
+
+
+def _array_dtype(array):
+    '''
+    Returns the smallest array type able to hold all kerning values.
+    Integer kerning fits into int16 (or int32), UFOs may also contain
+    float values, which are kept as float64.
+    '''
+    if array.dtype.kind == 'f' and not np.all(array == np.floor(array)):
+        return np.float64
+    if not array.size:
+        return np.int16
+    info = np.iinfo(np.int16)
+    if info.min <= array.min() and array.max() <= info.max:
+        return np.int16
+    return np.int32
+
+
+def _value_dtype(values):
+    return _array_dtype(np.array(list(values)))
+
+
+def _value_arrays(value_list, shape):
+    '''
+    Returns a value array and a kerned array for a flat list of
+    values, which may contain Nones.
+    '''
+    kerned = np.fromiter(
+        (v is not None for v in value_list), dtype=bool,
+        count=len(value_list))
+    values = np.array([0 if v is None else v for v in value_list])
+    values = values.astype(_array_dtype(values))
+    return values.reshape(shape), kerned.reshape(shape)
+
+
+class KernMatrix(object):
+    '''
+    Columnar storage of combined kerning for a number of masters.
+    Kerning values live in a pairs × masters array, a boolean array of
+    the same shape records whether a value is defined at all. Values
+    of unkerned cells are stored as 0.
+    *version* is incremented by every write, *structure_version* only
+    when pairs are added or removed, or cells become (un)kerned.
+    '''
+
+    def __init__(self, pairs, values, kerned):
+        self.pairs = list(pairs)
+        self.pair_index = {pair: i for i, pair in enumerate(self.pairs)}
+        self.values = values
+        self.kerned = kerned
+        self.version = 0
+        self.structure_version = 0
+        self._stats = None
+
+    def _changed(self, structure=False):
+        self.version += 1
+        if structure:
+            self.structure_version += 1
+
+    @classmethod
+    def from_value_lists(cls, pairs, value_lists, master_count=None):
+        '''
+        Creates a matrix from a list of pairs and a matching list of
+        value lists, which may contain Nones.
+        '''
+        value_lists = list(value_lists)
+        if master_count is None:
+            master_count = len(value_lists[0]) if value_lists else 0
+        flat = list(itertools.chain.from_iterable(value_lists))
+        values, kerned = _value_arrays(
+            flat, (len(value_lists), master_count))
+        return cls(pairs, values, kerned)
+
+    @classmethod
+    def from_dict(cls, cmb_kerning):
+        '''
+        Creates a matrix from a combined kerning dictionary,
+        keeping the order of the dictionary.
+        '''
+        return cls.from_value_lists(
+            list(cmb_kerning.keys()), list(cmb_kerning.values()))
+
+    @classmethod
+    def from_fonts(cls, fonts, indexes=None):
+        '''
+        Creates a matrix for a number of fonts. Rows are sorted by pair,
+        if a specific pair is not kerned in a font, the cell is unkerned.
+        '''
+        pairs = sorted(set(itertools.chain.from_iterable(
+            font.kerning.keys() for font in fonts)))
+        columns = kernResolver.resolve_columns(fonts, pairs, indexes=indexes)
+        # column-major, so the columns can be used as they are
+        values, kerned = _value_arrays(
+            list(itertools.chain.from_iterable(columns)),
+            (len(fonts), len(pairs)))
+        return cls(pairs, values.T.copy(), kerned.T.copy())
+
+    @property
+    def master_count(self):
+        return self.values.shape[1]
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def row(self, index):
+        '''
+        Returns the values of a row as a list, unkerned values are None.
+        '''
+        return [
+            value if kerned else None for value, kerned in
+            zip(self.values[index].tolist(), self.kerned[index].tolist())]
+
+    def rows(self, indices=None):
+        '''
+        Yields (pair, value list) for all or some rows.
+        '''
+        if indices is None:
+            indices = range(len(self.pairs))
+        indices = list(indices)
+        values = self.values[indices].tolist()
+        kerned = self.kerned[indices].tolist()
+        for index, v_row, k_row in zip(indices, values, kerned):
+            yield self.pairs[index], [
+                value if k else None for value, k in zip(v_row, k_row)]
+
+    def _fit(self, values):
+        '''
+        Widens the value array if new values do not fit into it.
+        '''
+        dtype = np.promote_types(self.values.dtype, _value_dtype(values))
+        if dtype != self.values.dtype:
+            self.values = self.values.astype(dtype)
+
+    def set_value(self, index, master, value):
+        was_kerned = self.kerned[index, master]
+        if value is None:
+            self.values[index, master] = 0
+            self.kerned[index, master] = False
+        else:
+            self._fit([value])
+            self.values[index, master] = value
+            self.kerned[index, master] = True
+        self._changed(structure=was_kerned != (value is not None))
+
+    def set_row(self, index, value_list):
+        if len(value_list) != self.master_count:
+            raise ValueError(
+                'Expected {} values, got {}'.format(
+                    self.master_count, len(value_list)))
+        kerned = [v is not None for v in value_list]
+        was_kerned = self.kerned[index].tolist()
+        self._fit(v for v in value_list if v is not None)
+        self.values[index] = [0 if v is None else v for v in value_list]
+        self.kerned[index] = kerned
+        self._changed(structure=was_kerned != kerned)
+
+    def set_rows(self, indices, values, kerned):
+        '''
+        Sets a number of rows at once, from a value array and a kerned
+        array of shape (len(indices), master_count).
+        '''
+        indices = np.asarray(indices, dtype=np.intp)
+        values = np.where(kerned, values, 0)
+        dtype = np.promote_types(self.values.dtype, _array_dtype(values))
+        if dtype != self.values.dtype:
+            self.values = self.values.astype(dtype)
+        was_kerned = self.kerned[indices]
+        self.values[indices] = values
+        self.kerned[indices] = kerned
+        self._changed(structure=bool((was_kerned != kerned).any()))
+
+    def add_pair(self, pair, value_list):
+        '''
+        Appends a new row, returns its index.
+        '''
+        index = len(self.pairs)
+        self.pairs.append(pair)
+        self.pair_index[pair] = index
+        self.values = np.vstack([
+            self.values,
+            np.zeros((1, self.master_count), dtype=self.values.dtype)])
+        self.kerned = np.vstack([
+            self.kerned, np.zeros((1, self.master_count), dtype=bool)])
+        self.set_row(index, value_list)
+        self._changed(structure=True)
+        return index
+
+    def remove_pair(self, pair):
+        index = self.pair_index.pop(pair)
+        del self.pairs[index]
+        self.values = np.delete(self.values, index, axis=0)
+        self.kerned = np.delete(self.kerned, index, axis=0)
+        for i, pair in enumerate(self.pairs[index:], index):
+            self.pair_index[pair] = i
+        self._changed(structure=True)
+
+    def as_dict(self):
+        return KernDict(self)
+
+    def stats(self):
+        '''
+        Per-pair statistics, memoized for the current version
+        '''
+        cached = self._stats
+        if cached is None or cached[0] != self.version:
+            cached = (self.version, KernStats(self))
+            self._stats = cached
+        return cached[1]
+
+
+class KernDict(collections.abc.MutableMapping):
+    '''
+    Dictionary view of a KernMatrix, mapping each pair to a list of
+    values (or Nones). Writing to the view writes to the matrix.
+    '''
+
+    def __init__(self, matrix):
+        self.matrix = matrix
+
+    def __getitem__(self, pair):
+        return self.matrix.row(self.matrix.pair_index[pair])
+
+    def __setitem__(self, pair, value_list):
+        index = self.matrix.pair_index.get(pair)
+        if index is None:
+            self.matrix.add_pair(pair, value_list)
+        else:
+            self.matrix.set_row(index, value_list)
+
+    def __delitem__(self, pair):
+        self.matrix.remove_pair(pair)
+
+    def __iter__(self):
+        return iter(self.matrix.pairs)
+
+    def __len__(self):
+        return len(self.matrix.pairs)
+
+    def __contains__(self, pair):
+        return pair in self.matrix.pair_index
+
+    def set_value(self, pair, master, value):
+        '''
+        Sets the value of a single pair in a single master.
+        '''
+        self.matrix.set_value(self.matrix.pair_index[pair], master, value)
+
+
+def _wide(matrix):
+    '''
+    Values as an array which can be summed without overflowing.
+    '''
+    if matrix.values.dtype.kind == 'f':
+        return matrix.values
+    return matrix.values.astype(np.int64)
+
+
+class KernStats(object):
+    '''
+    Per-pair statistics, computed in a single pass over a KernMatrix
+    (unkerned values count as 0):
+    min, max, sum, mean absolute value (of non-zero values), gamut (of
+    non-zero values), number of kerned masters, whether all masters
+    are kerned by the same value (or none is kerned), whether all
+    values are zero, and an outlier score (largest absolute value
+    divided by the average absolute value, 0 if all absolute values
+    are equal).
+    '''
+
+    array_names = (
+        'min', 'max', 'sum', 'abs_mean', 'gamut', 'kerned_count',
+        'all_same', 'all_zero', 'outlier_score')
+
+    def __init__(self, matrix):
+        values = _wide(matrix)
+        kerned = matrix.kerned
+        row_count, master_count = values.shape
+
+        abs_values = np.abs(values)
+        nonzero = values != 0
+        nonzero_count = np.count_nonzero(nonzero, axis=1)
+        abs_sum = abs_values.sum(axis=1)
+
+        if master_count:
+            self.min = values.min(axis=1)
+            self.max = values.max(axis=1)
+            abs_max = abs_values.max(axis=1)
+            # every value is >= the row minimum, and <= the row maximum
+            nonzero_max = np.where(nonzero, values, self.min[:, None]).max(
+                axis=1)
+            nonzero_min = np.where(nonzero, values, self.max[:, None]).min(
+                axis=1)
+        else:
+            self.min = self.max = abs_max = np.zeros(row_count, values.dtype)
+            nonzero_max = nonzero_min = self.min
+        self.sum = values.sum(axis=1)
+        self.kerned_count = np.count_nonzero(kerned, axis=1)
+
+        self.abs_mean = np.divide(
+            abs_sum, nonzero_count,
+            out=np.zeros(row_count), where=nonzero_count > 0)
+
+        self.gamut = np.where(
+            nonzero_count > 0, nonzero_max - nonzero_min, 0)
+
+        same = (values == values[:, :1]).all(axis=1)
+        self.all_same = (
+            (same & (self.kerned_count == master_count)) |
+            (self.kerned_count == 0))
+        self.all_zero = nonzero_count == 0
+
+        uniform = (abs_values == abs_values[:, :1]).all(axis=1)
+        self.outlier_score = np.divide(
+            abs_max * master_count, abs_sum,
+            out=np.zeros(row_count), where=~uniform & (abs_sum > 0))
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        '''
+        Restores statistics from a {name: array} dict, e.g. from a cache.
+        '''
+        stats = cls.__new__(cls)
+        for name in cls.array_names:
+            setattr(stats, name, arrays[name])
+        return stats
+
+    def __len__(self):
+        return len(self.sum)
+
+
+def _stats(matrix):
+    '''
+    Memoized statistics of a KernMatrix.
+    '''
+    return matrix.stats()
+
+
+def same_value_mask(matrix):
+    '''
+    Rows in which all items are kerned by the same value,
+    or in which no item is kerned at all
+    '''
+    return _stats(matrix).all_same
+
+
+def zero_value_mask(matrix):
+    '''
+    Rows in which all items are unkerned, or kerned by 0
+    '''
+    return _stats(matrix).all_zero
+
+
+def outlier_mask(matrix, factor=4):
+    '''
+    Rows in which one or more absolute values are much larger
+    (defined by *factor*) than the average absolute value
+    '''
+    score = _stats(matrix).outlier_score
+    return (score >= factor) & (score > 0)
+
+
+def gamut_array(matrix):
+    '''
+    Maximum value distance per row, ignoring unkerned and zero values
+    '''
+    return _stats(matrix).gamut
+
+
+def average_array(matrix):
+    '''
+    Average absolute value per row, ignoring unkerned and zero values
+    '''
+    return _stats(matrix).abs_mean
+
+
+def small_average_mask(matrix, small_av_value=5):
+    '''
+    Rows in which the average absolute value is a whole number
+    in range(-small_av_value, small_av_value)
+    '''
+    average = _stats(matrix).abs_mean
+    return (
+        (average == np.floor(average)) &
+        (average >= -small_av_value) & (average < small_av_value))
+
+
+def top_k_rows(scores, k):
+    '''
+    Row indices of the *k* highest scores, highest first. Ties are broken
+    by row order (earlier rows first), so the result equals the first k
+    rows of a stable sort, at the cost of a partition instead of a sort.
+    '''
+    scores = np.asarray(scores)
+    row_count = len(scores)
+    k = min(max(k, 0), row_count)
+    if not k:
+        return np.array([], dtype=np.intp)
+    if k < row_count:
+        # the k-th highest score
+        threshold = np.partition(scores, row_count - k)[row_count - k]
+        above = np.flatnonzero(scores > threshold)
+        tied = np.flatnonzero(scores == threshold)[:k - len(above)]
+        rows = np.concatenate([above, tied])
+    else:
+        rows = np.arange(row_count)
+    return rows[np.lexsort((rows, -scores[rows]))]
+
+
+def high_gamut_rows(matrix, amount=100):
+    '''
+    Row indices of the *amount* rows with the largest gamut,
+    sorted by gamut (largest first).
+    '''
+    return top_k_rows(gamut_array(matrix), amount)
+
+
+def largest_value_rows(matrix, amount=200):
+    '''
+    Row indices of the pairs kerned by the largest distance: half of
+    *amount* with the largest positive value, sorted by that value,
+    followed by half with the largest negative value.
+    '''
+    half = amount // 2
+    stats = _stats(matrix)
+    if half <= 0 or not len(stats):
+        return np.array([], dtype=np.intp)
+    row_max = stats.max
+    row_min = stats.min
+    row_sum = stats.sum
+
+    max_rows = top_k_rows(row_max, half)
+    max_rows = max_rows[np.lexsort(
+        (max_rows, row_sum[max_rows], -row_max[max_rows]))]
+    min_rows = top_k_rows(-row_min, half)
+    min_rows = min_rows[np.lexsort(
+        (min_rows, row_sum[min_rows], -row_min[min_rows]))]
+    min_rows = min_rows[~np.isin(min_rows, max_rows)]
+    return np.concatenate([max_rows, min_rows])
@@ -0,0 +1,309 @@
+'''
+Redundant exceptions: exceptions which kern a pair by the same value, in
+every master, as the more general pair they override. Removing them
+changes no effective kerning, but makes kerning.plist and the compiled
+GPOS smaller.
+
+An exception is redundant if, in each master kerning it, it is an
+exception and its value equals (or is within a tolerance of) the value
+the pair falls back to once it is removed. Exceptions of groups
+(glyph–group and group–glyph pairs) fall back to group–group pairs, but
+the glyph pairs of a glyph–group exception may fall back to group–glyph
+pairs, which then need to be kerned alike too.
+Glyph–glyph exceptions fall back to the first of their base pairs which
+is not redundant itself, so pruning all redundant exceptions at once
+never shifts a value by more than the tolerance.
+'''
+
+import collections
+
+import kernBatch
+import kernResolver
+
+Redundancy = collections.namedtuple(
+    'Redundancy', ['pair', 'bases', 'deviation'])
+
+
+def _is_group_pair(pair):
+    first, second = pair
+    return (
+        first.startswith(kernResolver.FIRST_PREFIX) or
+        second.startswith(kernResolver.SECOND_PREFIX))
+
+
+class RedundancyIndex(object):
+    '''
+    The redundant exceptions of a number of masters, kept up to date
+    while kerning values change. Which pairs are exceptions of which base
+    pairs comes from the exception map of each master (see
+    kerningHelper.exception_map), values are looked up with
+    *value*(pair, master), for pairs kerned in that master.
+    *kernings* (the pairs kerned in each master, e.g. font.kerning) are
+    only read when the index is built, for masters in which an exception
+    is no exception.
+    After values have changed, update() re-evaluates only the exceptions
+    depending on the changed pairs.
+    '''
+
+    def __init__(self, exception_maps, kernings, value, tolerance=0):
+        self.exception_maps = exception_maps
+        self.value = value
+        self.tolerance = tolerance
+        all_exceptions = set()
+        for exceptions in exception_maps:
+            all_exceptions.update(exceptions)
+        self.candidates = set(all_exceptions)
+        for exceptions, kerning in zip(exception_maps, kernings):
+            # kerned in this master without being an exception here
+            self.candidates.difference_update([
+                pair for pair in all_exceptions if
+                pair not in exceptions and pair in kerning])
+
+        # glyph–group exceptions (a, R) in each master, with the
+        # group–glyph pairs (L, b) their glyph pairs (a, b) fall back to
+        # once they are removed, unless (a, b) is kerned itself
+        first_prefix = kernResolver.FIRST_PREFIX
+        second_prefix = kernResolver.SECOND_PREFIX
+        glyph_group = [
+            (first, second) for first, second in self.candidates if
+            second.startswith(second_prefix) and
+            not first.startswith(first_prefix)]
+        self.shadowed = {}
+        for master, exceptions in enumerate(exception_maps):
+            group_glyph = collections.defaultdict(list)
+            for (first, second), bases in exceptions.items():
+                if (
+                    first.startswith(first_prefix) and
+                    not second.startswith(second_prefix)
+                ):
+                    group_glyph[bases[0]].append((first, second))
+            for pair in glyph_group:
+                bases = exceptions.get(pair)
+                if bases is not None:
+                    first, _ = pair
+                    self.shadowed[pair, master] = [
+                        shadow for shadow in group_glyph.get(bases[0], ()) if
+                        (first, shadow[1]) not in exceptions]
+
+        # built on the first update
+        self.dependents = None
+        self.redundant = {}
+        self._evaluate(self.candidates)
+
+    def _dependents(self):
+        '''
+        Maps each pair to the exceptions whose redundancy depends on its
+        value, or (for group exceptions) on whether it is redundant.
+        '''
+        dependents = collections.defaultdict(set)
+        for pair in self.candidates:
+            for master, exceptions in enumerate(self.exception_maps):
+                bases = exceptions.get(pair)
+                if bases is None:
+                    continue
+                for dependency in (
+                    (pair,) + bases +
+                    tuple(self.shadowed.get((pair, master), ()))
+                ):
+                    dependents[dependency].add(pair)
+        return dependents
+
+    def _redundancy(self, pair):
+        '''
+        A Redundancy if the exception *pair* can be removed from all
+        masters, otherwise None.
+        '''
+        bases = []
+        deviation = 0
+        for master, exceptions in enumerate(self.exception_maps):
+            base_pairs = exceptions.get(pair)
+            if base_pairs is None:
+                bases.append(None)
+                continue
+            base = next(
+                base for base in base_pairs if base not in self.redundant)
+            value = self.value(pair, master)
+            difference = max(
+                abs(value - self.value(fallback, master)) for fallback in
+                [base] + self.shadowed.get((pair, master), []))
+            if difference > self.tolerance:
+                return None
+            deviation = max(deviation, difference)
+            bases.append(base)
+        return Redundancy(pair, bases, deviation)
+
+    def _evaluate(self, pairs):
+        # group exceptions first, glyph–glyph exceptions may fall back to them
+        pairs = set(pairs) & self.candidates
+        for pair in sorted(pair for pair in pairs if _is_group_pair(pair)):
+            was_redundant = pair in self.redundant
+            redundancy = self._redundancy(pair)
+            if redundancy is None:
+                self.redundant.pop(pair, None)
+            else:
+                self.redundant[pair] = redundancy
+            if (
+                self.dependents is not None and
+                was_redundant != (redundancy is not None)
+            ):
+                pairs.update(self.dependents[pair] & self.candidates)
+        for pair in sorted(
+            pair for pair in pairs if not _is_group_pair(pair)
+        ):
+            redundancy = self._redundancy(pair)
+            if redundancy is None:
+                self.redundant.pop(pair, None)
+            else:
+                self.redundant[pair] = redundancy
+
+    def update(self, pairs):
+        '''
+        Re-evaluates the exceptions depending on the values of *pairs*.
+        '''
+        if self.dependents is None:
+            self.dependents = self._dependents()
+        affected = set()
+        for pair in pairs:
+            affected.update(self.dependents.get(pair, ()))
+        self._evaluate(affected)
+
+    def redundancies(self):
+        return sorted(self.redundant.values())
+
+
+def redundant_exceptions(fonts, indexes=None, tolerance=0):
+    '''
+    Returns a sorted list of Redundancy tuples for the exceptions which
+    are redundant in all *fonts* (see the module docstring): the pair,
+    the base pair it falls back to in each master (None where it is not
+    kerned), and by how much a value changes at most when it is removed.
+    Prebuilt *indexes* (kernResolver.ResolutionIndex, one per font) can
+    be passed to save rebuilding them.
+    '''
+    if indexes is None:
+        indexes = kernResolver.font_indexes(fonts)
+    kernings = [index.direct for index in indexes]
+    return RedundancyIndex(
+        [index.exceptions() for index in indexes], kernings,
+        lambda pair, master: kernings[master][pair],
+        tolerance).redundancies()
+
+
+def _refresh_fallbacks(fonts, matrix):
+    '''
+    Updates the matrix cells of pairs a font kerns through another pair,
+    which may be a pruned exception kerned a little differently.
+    '''
+    for master, index in enumerate(kernResolver.font_indexes(fonts)):
+        kerning = index.direct
+        rows = [
+            row for row, pair in enumerate(matrix.pairs) if
+            pair not in kerning and matrix.kerned[row, master]]
+        values = index.resolve_many([matrix.pairs[row] for row in rows])
+        for row, value in zip(rows, values):
+            if value != matrix.values[row, master]:
+                matrix.set_value(row, master, value)
+
+
+def prune_exceptions(
+    fonts, matrix=None, tolerance=0, indexes=None, dry_run=False,
+    journal=None
+):
+    '''
+    Removes all redundant exceptions (see redundant_exceptions) from all
+    *fonts* in one pass, with a single kerning update per master. Rows of
+    pruned pairs in *matrix* (a KernMatrix, if given) show the values
+    the fonts now kern them with, as do pairs kerned through them. The
+    removal is recorded as one operation in *journal* (a
+    kernJournal.EditJournal), if given.
+    Returns the Redundancy tuples, and the number of pairs removed (or,
+    with *dry_run*, to be removed) from each master.
+    '''
+    redundant = redundant_exceptions(fonts, indexes, tolerance)
+    cells = [
+        (redundancy.pair, master, None)
+        for redundancy in redundant
+        for master, base in enumerate(redundancy.bases) if
+        base is not None]
+    removed = [0] * len(fonts)
+    for _, master, _ in cells:
+        removed[master] += 1
+    if dry_run or not cells:
+        return redundant, removed
+
+    records = kernBatch.write_cells(
+        fonts, matrix, cells, resolve_removed=True)
+    if matrix is not None and any(r.deviation for r in redundant):
+        _refresh_fallbacks(fonts, matrix)
+    if journal is not None:
+        journal.record_delta('prune', records)
+    return redundant, removed
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    import fontSorter
+    import kernJournal
+    import ufoLoader
+
+    parser = argparse.ArgumentParser(
+        description=(
+            'Remove exceptions which are kerned like the pair they '
+            'override in all UFO masters of a folder'))
+
+    parser.add_argument(
+        'input_dir',
+        metavar='FOLDER',
+        help='Directory containing UFO masters.')
+
+    parser.add_argument(
+        '-t', '--tolerance',
+        action='store',
+        type=int,
+        default=0,
+        help=(
+            'Largest difference between an exception and its base pair '
+            '(default: 0)'))
+
+    parser.add_argument(
+        '-n', '--dry_run',
+        action='store_true',
+        default=False,
+        help='Report what would be removed, without writing any files.')
+
+    parser.add_argument(
+        '-v', '--verbose',
+        action='store_true',
+        default=False,
+        help='List each redundant exception.')
+
+    args = parser.parse_args()
+
+    ufo_paths = [
+        path for path in fontSorter.get_font_paths(args.input_dir) if
+        path.endswith('.ufo')]
+    if not ufo_paths:
+        sys.exit('no UFOs found.')
+    ufo_paths = fontSorter.sort_fonts(ufo_paths)
+    fonts = ufoLoader.load_fonts(ufo_paths)
+
+    redundant, removed = prune_exceptions(
+        fonts, tolerance=args.tolerance, dry_run=args.dry_run)
+    if args.verbose:
+        for redundancy in redundant:
+            print('{} {}{}'.format(
+                *redundancy.pair,
+                ' (values change by up to {})'.format(redundancy.deviation)
+                if redundancy.deviation else ''))
+    for font, count in zip(fonts, removed):
+        print('{}: {} pairs {}'.format(
+            kernJournal.master_name(font), count,
+            'to remove' if args.dry_run else 'removed'))
+    print('{} redundant exceptions'.format(len(redundant)), file=sys.stderr)
+
+    if not args.dry_run:
+        for font, count in zip(fonts, removed):
+            if count:
+                ufoLoader.write_kerning(font.path, font.kerning)
@@ -0,0 +1,166 @@
+FIRST_PREFIX = 'public.kern1.'
+SECOND_PREFIX = 'public.kern2.'
+
+
+def group_maps(groups):
+    '''
+    Returns two dictionaries to identify which kern1 and kern2 group
+    a specific glyph belongs to.
+    '''
+    first_groups = {}
+    second_groups = {}
+    for group_name, glyph_list in groups.items():
+        if group_name.startswith(FIRST_PREFIX):
+            for glyph_name in glyph_list:
+                first_groups[glyph_name] = group_name
+        elif group_name.startswith(SECOND_PREFIX):
+            for glyph_name in glyph_list:
+                second_groups[glyph_name] = group_name
+    return first_groups, second_groups
+
+
+class ResolutionIndex(object):
+    '''
+    Lookup tables for the effective kerning of a single font.
+    Kerning is split by pair type (glyph-glyph, group-glyph, glyph-group,
+    group-group), group membership is resolved through precomputed maps.
+    Results are identical to font.kerning.find().
+    '''
+
+    def __init__(self, kerning, groups):
+        self.first_groups, self.second_groups = group_maps(groups)
+        self._exceptions = None
+        self.direct = dict(kerning)
+        first_group_names = {
+            first for first, _ in self.direct if
+            first.startswith(FIRST_PREFIX)}
+        second_group_names = {
+            second for _, second in self.direct if
+            second.startswith(SECOND_PREFIX)}
+        self.glyph_glyph = {}
+        self.group_glyph = {}
+        self.glyph_group = {}
+        self.group_group = {}
+        tables = {
+            (False, False): self.glyph_glyph,
+            (True, False): self.group_glyph,
+            (False, True): self.glyph_group,
+            (True, True): self.group_group,
+        }
+        for pair, value in self.direct.items():
+            first, second = pair
+            tables[
+                first in first_group_names, second in second_group_names
+            ][pair] = value
+
+    @classmethod
+    def from_font(cls, font):
+        return cls(dict(font.kerning.items()), dict(font.groups.items()))
+
+    def resolve(self, pair, default=None):
+        return self.resolve_many([pair], default)[0]
+
+    def resolve_many(self, pairs, default=None):
+        '''
+        Returns the effective kerning values for a list of pairs,
+        *default* for pairs which are not kerned.
+        '''
+        direct = self.direct
+        group_glyph = self.group_glyph
+        glyph_group = self.glyph_group
+        group_group = self.group_group
+        first_groups = self.first_groups
+        second_groups = self.second_groups
+        missing = object()
+
+        values = []
+        for pair in pairs:
+            value = direct.get(pair, missing)
+            if value is missing:
+                first, second = pair
+                if first.startswith(FIRST_PREFIX):
+                    first_group, first = first, None
+                else:
+                    first_group = first_groups.get(first)
+                if second.startswith(SECOND_PREFIX):
+                    second_group, second = second, None
+                else:
+                    second_group = second_groups.get(second)
+
+                # same order of precedence as fontTools’ lookupKerningValue
+                if first is not None and second_group is not None:
+                    value = glyph_group.get((first, second_group), missing)
+                if (
+                    value is missing and
+                    first_group is not None and second is not None
+                ):
+                    value = group_glyph.get((first_group, second), missing)
+                if (
+                    value is missing and
+                    first_group is not None and second_group is not None
+                ):
+                    value = group_group.get(
+                        (first_group, second_group), missing)
+                if value is missing:
+                    value = default
+            values.append(value)
+        return values
+
+    def exceptions(self):
+        '''
+        Returns {exception: base pairs} for all pairs overriding a more
+        general pair of this font. Base pairs are listed in order of
+        precedence, the first one applies if the exception is removed.
+        '''
+        if self._exceptions is not None:
+            return self._exceptions
+        first_groups = self.first_groups
+        second_groups = self.second_groups
+        group_glyph = self.group_glyph
+        glyph_group = self.glyph_group
+        group_group = self.group_group
+
+        output = {}
+        for pair in group_glyph:
+            first, second = pair
+            base = (first, second_groups.get(second))
+            if base in group_group:
+                output[pair] = (base,)
+
+        for pair in glyph_group:
+            first, second = pair
+            base = (first_groups.get(first), second)
+            if base in group_group:
+                output[pair] = (base,)
+
+        for pair in self.glyph_glyph:
+            first, second = pair
+            first_group = first_groups.get(first)
+            second_group = second_groups.get(second)
+            bases = []
+            if (first, second_group) in glyph_group:
+                bases.append((first, second_group))
+            if (first_group, second) in group_glyph:
+                bases.append((first_group, second))
+            if (first_group, second_group) in group_group:
+                bases.append((first_group, second_group))
+            if bases:
+                output[pair] = tuple(bases)
+        self._exceptions = output
+        return output
+
+
+def font_indexes(fonts):
+    return [ResolutionIndex.from_font(font) for font in fonts]
+
+
+def resolve_columns(fonts, pairs, default=None, indexes=None):
+    '''
+    Returns one list of effective kerning values per font,
+    for the same list of pairs.
+    Prebuilt *indexes* (one per font) can be passed to save rebuilding them.
+    '''
+    pairs = list(pairs)
+    if indexes is None:
+        indexes = font_indexes(fonts)
+    return [index.resolve_many(pairs, default) for index in indexes]
@@ -0,0 +1,357 @@
+import csv
+import json
+import os
+import sys
+
+import numpy as np
+
+import fontSorter
+import gposLoader
+import kerningHelper
+import kernClusters
+import kernFilters
+import kernInterpolation
+import kernMatrix
+import kernPrune
+import kernResolver
+
+
+filter_names = [
+    'single',
+    'same_value',
+    'zero_value',
+    'largest_value',
+    'high_gamut',
+    'outlier',
+    'exception',
+    'redundant',
+    'small_average',
+    'similar',
+    'interpolation',
+]
+
+stat_names = [
+    'min',
+    'max',
+    'sum',
+    'abs_mean',
+    'gamut',
+    'kerned_count',
+    'outlier_score',
+    'cluster',
+    'interpolation_deviation',
+]
+
+
+class Report(object):
+    '''
+    Combined kerning of a number of masters, with the filter
+    membership and statistics of every pair. Pairs kerned alike in all
+    masters (within *cluster_tolerance*) are similar, the cluster stat
+    is the rank of a pair’s cluster (-1 for none, see kernClusters).
+    Redundant exceptions are kerned like their base pair in all masters
+    (see kernPrune).
+    Interpolation outliers are only reported with an
+    *interpolation_model* (kernInterpolation.InterpolationModel), master
+    locations only with an *axis_grid* (fontSorter.AxisGrid).
+    '''
+
+    def __init__(
+        self, fonts, indexes=None, outlier_factor=5, small_average_value=5,
+        gamut_amount=100, largest_amount=200, cluster_tolerance=2,
+        interpolation_model=None, axis_grid=None
+    ):
+        self.axis_grid = axis_grid
+        self.master_names = [
+            fontSorter.get_ps_font_name(font.path) for font in fonts]
+        if indexes is None:
+            indexes = kernResolver.font_indexes(fonts)
+        self.matrix = kernMatrix.KernMatrix.from_fonts(fonts, indexes)
+        self.stats = self.matrix.stats()
+        self.exception_bases = kerningHelper.exception_base_dict(
+            fonts, indexes)
+
+        filter_index = kernFilters.FilterIndex(
+            self.matrix,
+            outlier_factor=outlier_factor,
+            small_average_value=small_average_value,
+            gamut_amount=gamut_amount,
+            largest_amount=largest_amount)
+        pair_index = self.matrix.pair_index
+        filter_index.register('exception', lambda: [
+            pair_index[pair] for pair in self.exception_bases.keys()])
+        redundant_rows = [
+            pair_index[redundancy.pair] for redundancy in
+            kernPrune.redundant_exceptions(fonts, indexes)]
+        filter_index.register('redundant', lambda: redundant_rows)
+
+        clusters = kernClusters.ValueClusters(self.matrix, cluster_tolerance)
+        self.cluster = clusters.labels(len(self.matrix))
+        cluster_rows = clusters.rows().tolist()
+        filter_index.register('similar', lambda: cluster_rows)
+
+        self.interpolation_deviation = np.zeros(len(self.matrix))
+        interpolation_rows = []
+        if interpolation_model is not None:
+            self.interpolation_deviation, _ = interpolation_model.scores(
+                self.matrix)
+            interpolation_rows = interpolation_model.outlier_rows(
+                self.matrix, largest_amount).tolist()
+        filter_index.register('interpolation', lambda: interpolation_rows)
+        self.filter_rows = {
+            name: filter_index.rows(name) for name in filter_names}
+
+    def counts(self):
+        return {name: len(rows) for name, rows in self.filter_rows.items()}
+
+    def flags(self):
+        '''
+        Returns a {filter name: set of row indices} dict
+        '''
+        return {name: set(rows) for name, rows in self.filter_rows.items()}
+
+    def iter_rows(self, flagged_only=False):
+        '''
+        Yields (pair, values, filter names, stats dict) for each pair.
+        '''
+        flags = self.flags()
+        stats = {}
+        for name in stat_names:
+            if name == 'interpolation_deviation':
+                array = np.round(self.interpolation_deviation, 2)
+            elif name == 'cluster':
+                array = self.cluster
+            else:
+                array = getattr(self.stats, name)
+            stats[name] = array.tolist()
+        for index, (pair, values) in enumerate(self.matrix.rows()):
+            pair_filters = [
+                name for name in filter_names if index in flags[name]]
+            if flagged_only and not pair_filters:
+                continue
+            pair_stats = {name: stats[name][index] for name in stat_names}
+            yield pair, values, pair_filters, pair_stats
+
+    def write_json(self, output, flagged_only=False):
+        '''
+        Writes the report as JSON, one pair per line. Pairs are encoded
+        one at a time, so the report is never built in memory as a whole.
+        '''
+        output.write('{{\n "masters": {},\n'.format(
+            json.dumps(self.master_names)))
+        grid = self.axis_grid
+        if grid is not None:
+            output.write(' "axes": {},\n "cells": {},\n'.format(
+                json.dumps([
+                    {'tag': tag, 'name': name,
+                     'coordinates': grid.coordinates[name]}
+                    for tag, name in grid.axes]),
+                json.dumps(grid.cells)))
+        output.write(' "counts": {},\n "pairs": ['.format(
+            json.dumps(self.counts())))
+        separator = '\n  '
+        for pair, values, pair_filters, pair_stats in self.iter_rows(
+            flagged_only
+        ):
+            pair_data = {
+                'pair': list(pair),
+                'values': values,
+                'filters': pair_filters,
+                'stats': pair_stats,
+            }
+            if pair in self.exception_bases:
+                pair_data['exception_of'] = [
+                    list(base) if base else None for
+                    base in self.exception_bases[pair]]
+            output.write(separator + json.dumps(pair_data))
+            separator = ',\n  '
+        output.write('\n ]\n}\n')
+
+    def write_csv(self, output, flagged_only=False):
+        writer = csv.writer(output)
+        writer.writerow(
+            ['left', 'right'] + self.master_names + filter_names + stat_names)
+        for pair, values, pair_filters, pair_stats in self.iter_rows(
+            flagged_only
+        ):
+            writer.writerow(
+                list(pair) +
+                ['' if value is None else value for value in values] +
+                [int(name in pair_filters) for name in filter_names] +
+                [pair_stats[name] for name in stat_names])
+
+
+def check_thresholds(counts, thresholds):
+    '''
+    Returns messages for all filters with more pairs than allowed
+    '''
+    messages = []
+    for name, max_count in thresholds.items():
+        if counts[name] > max_count:
+            messages.append('{}: {} pairs (maximum {})'.format(
+                name, counts[name], max_count))
+    return messages
+
+
+def parse_threshold(threshold):
+    name, _, max_count = threshold.partition('=')
+    if name not in filter_names or not max_count.isdigit():
+        raise ValueError(threshold)
+    return name, int(max_count)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Kern-A-Lytics kerning report for a folder of masters')
+
+    parser.add_argument(
+        'input_dir',
+        action='store',
+        metavar='FOLDER',
+        help=(
+            'Directory containing UFO masters, or compiled fonts '
+            '(OTF/TTF) if there are no UFOs.'))
+
+    parser.add_argument(
+        '-o', '--output',
+        action='store',
+        metavar='FILE',
+        help='Report file (default: standard output).')
+
+    parser.add_argument(
+        '-f', '--format',
+        action='store',
+        choices=['json', 'csv'],
+        help='Report format (default: from output file suffix, or json).')
+
+    parser.add_argument(
+        '--flagged_only',
+        action='store_true',
+        default=False,
+        help='Only report pairs which appear in at least one filter.')
+
+    parser.add_argument(
+        '-m', '--max',
+        action='append',
+        default=[],
+        metavar='FILTER=N',
+        help=(
+            'Exit with status 1 if FILTER has more than N pairs, e.g. '
+            'outlier=10. Can be used more than once. Filters: {}'.format(
+                ', '.join(filter_names))))
+
+    parser.add_argument(
+        '-i', '--italics_interspersed',
+        action='store_true',
+        default=False,
+        help='Italics adjacent to their related Romans')
+
+    parser.add_argument(
+        '-w', '--workers',
+        action='store',
+        type=int,
+        default=1,
+        metavar='N',
+        help='Number of processes reading masters, 0 for one per CPU.')
+
+    parser.add_argument(
+        '-d', '--designspace',
+        action='store',
+        metavar='FILE',
+        help=(
+            'Designspace file with the master locations for the '
+            'interpolation filter (default: a designspace next to the '
+            'UFOs, or locations estimated from the style names).'))
+
+    parser.add_argument(
+        '--outlier_factor', type=float, default=5,
+        help='Outlier factor (default: 5)')
+    parser.add_argument(
+        '--small_average', type=int, default=5,
+        help='Small average kern distance (default: 5)')
+    parser.add_argument(
+        '--gamut_amount', type=int, default=100,
+        help='Number of high gamut pairs (default: 100)')
+    parser.add_argument(
+        '--largest_amount', type=int, default=200,
+        help='Number of long-distance pairs (default: 200)')
+    parser.add_argument(
+        '--cluster_tolerance', type=int, default=2,
+        help=(
+            'Largest difference in any master between similar pairs '
+            '(default: 2)'))
+
+    args = parser.parse_args()
+
+    try:
+        thresholds = dict(parse_threshold(t) for t in args.max)
+    except ValueError as error:
+        parser.error('invalid threshold {}'.format(error))
+
+    if args.designspace and not os.path.isfile(args.designspace):
+        parser.error('designspace file {} not found'.format(args.designspace))
+
+    ufo_paths = fontSorter.get_font_paths(args.input_dir)
+    if not ufo_paths:
+        sys.exit('no UFOs or compiled fonts found.')
+    designspace_path = args.designspace
+    if designspace_path is None:
+        designspace_path = fontSorter.find_designspace(ufo_paths)
+    ufo_paths = fontSorter.sort_fonts(
+        ufo_paths, args.italics_interspersed,
+        designspace_path=designspace_path)
+
+    # masters which can not be placed in a design space are still
+    # analyzed, only without the interpolation filter
+    axis_grid = None
+    interpolation_model = None
+    if designspace_path is not None:
+        try:
+            axis_grid = fontSorter.AxisGrid.from_designspace(
+                ufo_paths, designspace_path)
+        except ValueError as error:
+            print(error, file=sys.stderr)
+    if len(ufo_paths) >= 3:
+        try:
+            locations, source = kernInterpolation.master_locations(
+                ufo_paths, designspace_path)
+            interpolation_model = kernInterpolation.InterpolationModel(
+                locations, source)
+        except ValueError as error:
+            print(error, file=sys.stderr)
+
+    fonts, indexes = gposLoader.load_masters(
+        ufo_paths, workers=args.workers or None)
+    report = Report(
+        fonts, indexes,
+        outlier_factor=args.outlier_factor,
+        small_average_value=args.small_average,
+        gamut_amount=args.gamut_amount,
+        largest_amount=args.largest_amount,
+        cluster_tolerance=args.cluster_tolerance,
+        interpolation_model=interpolation_model,
+        axis_grid=axis_grid)
+
+    report_format = args.format
+    if report_format is None:
+        report_format = 'json'
+        if args.output and os.path.splitext(args.output)[-1] == '.csv':
+            report_format = 'csv'
+    write = getattr(report, 'write_{}'.format(report_format))
+    if args.output:
+        with open(args.output, 'w', newline='') as output:
+            write(output, args.flagged_only)
+    else:
+        write(sys.stdout, args.flagged_only)
+
+    counts = report.counts()
+    for name in filter_names:
+        print('{:>14}: {}'.format(name, counts[name]), file=sys.stderr)
+
+    exceeded = check_thresholds(counts, thresholds)
+    for message in exceeded:
+        print('threshold exceeded', message, file=sys.stderr)
+    if exceeded:
+        sys.exit(1)
@@ -1,8 +1,11 @@
 import itertools
 import collections
-import heapq
 import random
 
+import kernFilters
+import kernMatrix
+import kernResolver
+
 
 def _sort_kern_dict(input_dict):
     '''
@@ -13,57 +16,6 @@ def _sort_kern_dict(input_dict):
     return sorted_dict
 
 
-def _gamut(value_list):
-    '''
-    Returns the maximum value distance in a list of values
-    '''
-    difference = 0
-    n_list = [i for i in value_list if i]
-    if any(n_list):
-        difference = (max(n_list) - min(n_list))
-
-    return difference
-
-
-def _average(value_list, conscious=True):
-    '''
-    Average distance, not average value
-    '''
-    if conscious:
-        n_list = [i for i in value_list if i]
-    else:
-        n_list = numeric_value_list(value_list)
-
-    # not sure this is necessary
-    abs_list = [abs(v) for v in n_list]
-    average_value = 0
-    if len(abs_list) > 0:
-        average_value = sum(abs_list) / len(abs_list)
-
-    return average_value
-
-
-def _outlier(value_list, factor=4, test=False):
-    '''
-    Finds value lists in which one or more values are much larger
-    (defined by *factor*) than the average
-    '''
-    n_list = numeric_value_list(value_list, absolute=True)
-    if len(set(n_list)) == 1:
-        # if all values are zero, no thanks
-        return
-
-    average_value = sum(n_list) / len(n_list)
-    exceeding_values = [abs(v) >= average_value * factor for v in n_list]
-    if test:
-        print('average:', average_value)
-    if any(exceeding_values):
-        if test:
-            print(exceeding_values)
-        return True
-    return
-
-
 def numeric_value_list(value_list, absolute=False):
     '''
     Convert a list (which may contain Nones) to integers.
@@ -109,34 +61,94 @@ def get_repr_pair(font, def_pair):
     return
 
 
+class ReprPairCache(object):
+    '''
+    Memoized get_repr_pair for a number of fonts. Group members are
+    ranked through a glyph order rank map, which is built once per
+    font. Call invalidate() when the groups or the glyph order change.
+    '''
+
+    def __init__(self):
+        self._font_data = {}
+
+    def invalidate(self, font=None):
+        if font is None:
+            self._font_data.clear()
+        else:
+            self._font_data.pop(id(font), None)
+
+    def _get_font_data(self, font):
+        font_data = self._font_data.get(id(font))
+        if font_data is None or font_data[0] is not font:
+            glyph_order = font.lib['public.glyphOrder']
+            rank = {g_name: i for i, g_name in enumerate(glyph_order)}
+            groups = {
+                group_name: list(glyph_list) for
+                group_name, glyph_list in font.groups.items()}
+            font_data = (font, rank, groups, {})
+            self._font_data[id(font)] = font_data
+        return font_data
+
+    def get_repr_pair(self, font, def_pair):
+        '''
+        Returns the same glyphs as get_repr_pair()
+        '''
+        _, rank, groups, repr_glyphs = self._get_font_data(font)
+        if not all(item in rank or item in groups for item in def_pair):
+            return
+        repr_pair = []
+        for item in def_pair:
+            if item not in repr_glyphs:
+                # glyphs missing from the glyph order rank last
+                members = groups.get(item, [item])
+                repr_glyphs[item] = min(
+                    members, key=lambda g_name: rank.get(g_name, len(rank)),
+                    default=None)
+            repr_pair.append(repr_glyphs[item])
+        if None in repr_pair:
+            return
+        return tuple(repr_pair)
+
+
+def _as_matrix(cmb_kerning):
+    '''
+    Returns the KernMatrix behind a combined kerning dictionary,
+    or creates one for a plain dictionary.
+    '''
+    matrix = getattr(cmb_kerning, 'matrix', None)
+    if matrix is None:
+        matrix = kernMatrix.KernMatrix.from_dict(cmb_kerning)
+    return matrix
+
+
+def _matrix_dict(matrix, rows):
+    '''
+    Returns an OrderedDict of pairs and value lists for
+    the given row indices of a KernMatrix.
+    '''
+    return collections.OrderedDict(matrix.rows(rows))
+
+
+def _masked_dict(matrix, mask):
+    return _matrix_dict(matrix, mask.nonzero()[0])
+
+
 def get_combined_kern_dict(fonts):
     '''
     Returns a sorted, combined kerning dictionary for a
     number of fonts. If a specific pair is not kerned,
     kerning value is None.
+    The dictionary is a view of a KernMatrix (its matrix attribute).
     '''
-    combined_pairs = set(itertools.chain.from_iterable(
-        font.kerning.keys() for font in fonts))
-
-    c_kerning = {}
-    for font in fonts:
-        for pair in combined_pairs:
-            value = font.kerning.find(pair, None)
-            c_kerning.setdefault(pair, []).append(value)
-
-    # make the dict an ordered dict, so we do not have
-    # to sort it downstream
-    return _sort_kern_dict(c_kerning)
+    return kernMatrix.KernMatrix.from_fonts(fonts).as_dict()
 
 
 def same_value_dict(cmb_kerning):
     '''
     Pairs in which all items are kerned by the same value
     '''
-    output = {}
-    for pair, values in cmb_kerning.items():
-        if len(set(values)) == 1:
-            output[pair] = values
+    matrix = _as_matrix(cmb_kerning)
+    output = _masked_dict(matrix, kernMatrix.same_value_mask(matrix))
     return _sort_kern_dict(output)
 
 
@@ -144,10 +156,8 @@ def zero_value_dict(cmb_kerning):
     '''
     Pairs in which all items are unkerned, or kerned by 0
     '''
-    output = {}
-    for pair, values in cmb_kerning.items():
-        if not any([v for v in values]):
-            output[pair] = values
+    matrix = _as_matrix(cmb_kerning)
+    output = _masked_dict(matrix, kernMatrix.zero_value_mask(matrix))
     return _sort_kern_dict(output)
 
 
@@ -155,85 +165,27 @@ def outlier_dict(cmb_kerning, factor=4):
     '''
     Pairs in which one of the values is drastically different from others
     '''
-    output = {}
-    for pair, values in cmb_kerning.items():
-        if _outlier(values, factor):
-            output[pair] = values
+    matrix = _as_matrix(cmb_kerning)
+    output = _masked_dict(matrix, kernMatrix.outlier_mask(matrix, factor))
     return _sort_kern_dict(output)
 
 
 def high_gamut_dict(cmb_kerning, approx_amount=100):
     '''
-    Pairs with the highest kerning gamut
+    Pairs with the highest kerning gamut, *approx_amount* of them
     '''
-    output = collections.OrderedDict({})
-    gamut_dict = {}
-    for pair, values in cmb_kerning.items():
-        gamut = _gamut(values)
-        gamut_dict.setdefault(gamut, []).append(pair)
-    max_gamut_list = sorted(gamut_dict.keys(), reverse=True)
-    pair_count = 0
-    for gamut_value in max_gamut_list:
-        pairs = gamut_dict.get(gamut_value)
-        if pair_count < approx_amount:
-            for pair in pairs:
-                output[pair] = cmb_kerning.get(pair)
-        pair_count += len(pairs)
-    return output
+    matrix = _as_matrix(cmb_kerning)
+    return _matrix_dict(
+        matrix, kernMatrix.high_gamut_rows(matrix, approx_amount))
 
 
 def largest_value_dict(cmb_kerning, amount=200):
     '''
     Pairs kerned by the largest distance
     '''
-
-    # dictionaries that contain the largest and smallest value per pair
-    max_value_dict = {
-        pair: max(numeric_value_list(v_list)) for
-        (pair, v_list) in cmb_kerning.items()
-    }
-    min_value_dict = {
-        pair: min(numeric_value_list(v_list)) for
-        (pair, v_list) in cmb_kerning.items()
-    }
-
-    # sorting by value
-    max_value_list = sorted(
-        # Lambda function to sort the resulting pairs
-        # based on the sum of all kerning values
-        heapq.nlargest(amount // 2, max_value_dict, key=max_value_dict.get),
-        key=lambda pair: sum(numeric_value_list(cmb_kerning.get(pair)))
-    )
-    min_value_list = sorted(
-        # Lambda function to sort the resulting pairs
-        # based on the sum of all kerning values
-        heapq.nsmallest(amount // 2, min_value_dict, key=min_value_dict.get),
-        key=lambda pair: sum(numeric_value_list(cmb_kerning.get(pair)))
-    )
-
-    # re-establishing the combined-value dict based on lists created above
-    max_value_cmb_dict = {
-        pair: cmb_kerning.get(pair) for pair in max_value_list}
-    min_value_cmb_dict = {
-        pair: cmb_kerning.get(pair) for pair in min_value_list}
-
-    # sorting those dictionaries by the greatest value in the valuelist
-    max_sorted_dict = collections.OrderedDict(
-        sorted(
-            max_value_cmb_dict.items(),
-            key=lambda t: max_value_dict.get(t[0]),
-            reverse=True))
-
-    min_sorted_dict = collections.OrderedDict(
-        sorted(
-            min_value_cmb_dict.items(),
-            key=lambda t: min_value_dict.get(t[0]),
-            reverse=True))
-
-    output = {}
-    output.update(max_sorted_dict)
-    output.update(min_sorted_dict)
-    return output
+    matrix = _as_matrix(cmb_kerning)
+    return _matrix_dict(
+        matrix, kernMatrix.largest_value_rows(matrix, amount))
 
 
 def _make_grouped_dicts(groups):
@@ -241,97 +193,51 @@ def _make_grouped_dicts(groups):
     Creates two dictionaries to identify which group(s)
     a specific glyph belongs to.
     '''
-    grouped_dict_left = {}
-    grouped_dict_right = {}
-
-    for groupName, glyphList in groups.items():
-        if groupName.startswith('public.kern1.'):
-            for gName in glyphList:
-                grouped_dict_left.setdefault(gName, None)
-                grouped_dict_left[gName] = '{}'.format(groupName)
+    return kernResolver.group_maps(groups)
 
-        if groupName.startswith('public.kern2.'):
-            for gName in glyphList:
-                grouped_dict_right.setdefault(gName, None)
-                grouped_dict_right[gName] = '{}'.format(groupName)
 
-    return grouped_dict_left, grouped_dict_right
+def exception_map(font, index=None):
+    '''
+    Returns a sorted dictionary of the exceptions in a single font,
+    mapping each exception to the pair(s) it overrides
+    '''
+    if index is None:
+        index = kernResolver.ResolutionIndex.from_font(font)
+    exceptions = index.exceptions()
+    return _sort_kern_dict(exceptions)
 
 
 def single_exception_list(font):
     '''
     Creates a list of exceptions for a single font
     '''
-    g_flag = 'public.kern'
-    grouped_dict_l, grouped_dict_r = _make_grouped_dicts(font.groups)
-
-    group_group_pairs = [
-        pair for pair in font.kerning.keys() if
-        all([g_flag in item for item in pair])]
-    glyph_group_pairs = [
-        pair for pair in font.kerning.keys() if
-        g_flag not in pair[0] and g_flag in pair[1]]
-    group_glyph_pairs = [
-        pair for pair in font.kerning.keys() if
-        g_flag in pair[0] and g_flag not in pair[1]]
-    glyph_glyph_pairs = [
-        pair for pair in font.kerning.keys() if not
-        any([g_flag in item for item in pair])]
-
-    pair_list = []
-    covered_pairs = []
-    for (left, right) in group_glyph_pairs:
-        group_pair = (
-            left, grouped_dict_r.get(right, right))
-        if group_pair in group_group_pairs:
-            pair_list.append((left, right))
-            pair_list.append(group_pair)
-            covered_pairs.append((left, right))
-
-    for (left, right) in glyph_group_pairs:
-        group_pair = (
-            grouped_dict_l.get(left, left), right)
-        if group_pair in group_group_pairs:
-            pair_list.append((left, right))
-            pair_list.append(group_pair)
-            covered_pairs.append((left, right))
-
-    for (left, right) in glyph_glyph_pairs:
-        group_l_pair = (
-            grouped_dict_l.get(left, left), right)
-        group_r_pair = (
-            left, grouped_dict_r.get(right, right))
-        group_both_pair = (
-            grouped_dict_l.get(left, left), grouped_dict_r.get(right, right))
-
-        if (
-            group_l_pair in group_glyph_pairs and
-            group_l_pair not in covered_pairs
-        ):
-            pair_list.append((left, right))
-            pair_list.append(group_l_pair)
-            covered_pairs.append(group_l_pair)
-        if (
-            group_r_pair in glyph_group_pairs and
-            group_r_pair not in covered_pairs
-        ):
-            pair_list.append((left, right))
-            pair_list.append(group_r_pair)
-            covered_pairs.append(group_r_pair)
-        if (
-            group_both_pair in group_group_pairs and
-            group_both_pair not in covered_pairs
-        ):
-            pair_list.append((left, right))
-            pair_list.append(group_both_pair)
-            covered_pairs.append(group_both_pair)
-
-    zip_list = sorted(zip(pair_list[::2], pair_list[1::2]))
-    sorted_pair_list = []
-    for exception, base_pair in zip_list:
-        sorted_pair_list.append(exception)
-        # sorted_pair_list.append(base_pair)
-    return sorted_pair_list
+    return list(exception_map(font).keys())
+
+
+def exception_base_dict(fonts, indexes=None):
+    '''
+    Maps each exception found in any of the fonts to the base pair
+    it overrides in each font (None if it is no exception in that font)
+    '''
+    if indexes is None:
+        indexes = kernResolver.font_indexes(fonts)
+    return combine_exception_maps([
+        exception_map(font, index) for font, index in zip(fonts, indexes)])
+
+
+def combine_exception_maps(font_exceptions):
+    '''
+    Combines the exception maps of a number of fonts into a sorted
+    {exception: [base pair or None per font]} dictionary
+    '''
+    all_exceptions = sorted(set(itertools.chain.from_iterable(
+        font_exceptions)))
+    output = collections.OrderedDict({})
+    for pair in all_exceptions:
+        output[pair] = [
+            exceptions[pair][0] if pair in exceptions else None
+            for exceptions in font_exceptions]
+    return output
 
 
 def exception_dict(fonts, cmb_kerning):
@@ -341,64 +247,45 @@ def exception_dict(fonts, cmb_kerning):
         font_exceptions = single_exception_list(font)
         all_exceptions.extend(font_exceptions)
     for pair in all_exceptions:
-        if pair not in output.keys():
+        if pair not in output:
             output[pair] = cmb_kerning.get(pair)
     return output
 
 
 def small_average_dict(cmb_kerning, small_av_value=5):
-    output = collections.OrderedDict({})
-    for pair, values in cmb_kerning.items():
-        if _average(values) in range(-small_av_value, small_av_value):
-            output[pair] = cmb_kerning.get(pair)
-    return output
+    matrix = _as_matrix(cmb_kerning)
+    return _masked_dict(
+        matrix, kernMatrix.small_average_mask(matrix, small_av_value))
 
 
 def single_pair_dict(cmb_kerning):
     output = collections.OrderedDict({})
-    for pair, values in cmb_kerning.items():
+    for pair in cmb_kerning.keys():
         if not any([side.startswith('public') for side in pair]):
             output[pair] = cmb_kerning.get(pair)
     return output
 
 
-def filter_pair_list_by_items(font, pair_list, filter_item_left=None, filter_item_right=None):
+def filter_pair_list_by_items(
+    font, pair_list, filter_item_left=None, filter_item_right=None,
+    item_index=None
+):
     """
     filter a combined kerning dictionary by item featured in the pairs
-    filter_items can be either glyphs or groups
+    filter_items can be either glyphs or groups, prefixes (A*) or
+    glob patterns (public.kern1.O*)
     a font object is necessary for group analysis
+    callers filtering the same pair list repeatedly (e.g. on every
+    keystroke) can pass a kernFilters.PairItemIndex of it as item_index,
+    pair_list is then only indexed
     """
-    # sanitizing input (?)
-    if len(filter_item_left.strip()) == 0:
-        filter_item_left = None
-    if len(filter_item_right.strip()) == 0:
-        filter_item_right = None
+    if item_index is None:
+        pair_list = list(pair_list)
+        item_index = kernFilters.PairItemIndex(pair_list, font.groups)
+    rows = item_index.rows(filter_item_left, filter_item_right)
 
     # no filtering needed here
-    if not filter_item_left and not filter_item_right:
-        return pair_list
-
-    # XXXX maybe it is expensive to have that calculate each time the pair list
-    # is updated? Should this be cached somewhere?
-    grouped_dict_1, grouped_dict_2 = _make_grouped_dicts(font.groups)
-
-    # add groups to the filter items if relevant
-    pertinent_items_1 = [filter_item_left]
-    group_item_1 = grouped_dict_1.get(filter_item_left, None)
-    if group_item_1:
-        pertinent_items_1.append(group_item_1)
-    pertinent_items_2 = [filter_item_right]
-    group_item_2 = grouped_dict_2.get(filter_item_right, None)
-    if group_item_2:
-        pertinent_items_2.append(group_item_2)
-
-    filtered_kerning = []
-    for pair in pair_list:
-        pair_item_1, pair_item_2 = pair
-        if(
-            (filter_item_left is None or pair_item_1 in pertinent_items_1) and
-            (filter_item_right is None or pair_item_2 in pertinent_items_2)
-        ):
-            filtered_kerning.append(pair)
-
-    return filtered_kerning
+    if rows is None:
+        return list(pair_list)
+
+    return [pair_list[row] for row in sorted(rows)]
@@ -0,0 +1,307 @@
+import base64
+import concurrent.futures
+import os
+import plistlib
+import xml.parsers.expat
+
+from fontTools.ufoLib.kerning import lookupKerningValue
+
+import kernResolver
+import kerningHelper
+
+CHUNK_SIZE = 1 << 16
+
+_scalar_types = {
+    'string': lambda text: text,
+    'integer': int,
+    'real': float,
+    'true': lambda text: True,
+    'false': lambda text: False,
+    'date': lambda text: text,
+    'data': lambda text: base64.b64decode(text),
+}
+
+
+class _PlistStream(object):
+    '''
+    Expat handler collecting the items of the top-level dict of a plist.
+    Values of keys not in *wanted_keys* are skipped without being built.
+    '''
+
+    def __init__(self, wanted_keys=None):
+        self.wanted_keys = wanted_keys
+        self.items = []
+        # each level is a [container, pending key] list,
+        # the top-level dict itself is never stored
+        self.stack = []
+        self.text = None
+        self.skip_depth = 0
+        self.skip_next = False
+
+    def start(self, name, attributes):
+        if self.skip_depth:
+            self.skip_depth += 1
+            return
+        if self.skip_next:
+            self.skip_next = False
+            self.skip_depth = 1
+            return
+        if name == 'plist':
+            return
+        if name == 'dict':
+            self.stack.append([{}, None])
+        elif name == 'array':
+            self.stack.append([[], None])
+        else:
+            self.text = []
+
+    def end(self, name):
+        if self.skip_depth:
+            self.skip_depth -= 1
+            if not self.skip_depth:
+                self.stack[-1][1] = None
+            return
+        if name == 'plist':
+            return
+        if name == 'key':
+            key = ''.join(self.text)
+            self.text = None
+            self.stack[-1][1] = key
+            if (
+                len(self.stack) == 1 and
+                self.wanted_keys is not None and
+                key not in self.wanted_keys
+            ):
+                self.skip_next = True
+        elif name in ('dict', 'array'):
+            container, _ = self.stack.pop()
+            if self.stack:
+                self._add(container)
+        else:
+            value = _scalar_types[name](''.join(self.text))
+            self.text = None
+            self._add(value)
+
+    def characters(self, data):
+        if self.text is not None:
+            self.text.append(data)
+
+    def _add(self, value):
+        level = self.stack[-1]
+        container, key = level
+        if len(self.stack) == 1:
+            self.items.append((key, value))
+        elif isinstance(container, list):
+            container.append(value)
+        else:
+            container[key] = value
+        level[1] = None
+
+
+def iter_plist_items(path, wanted_keys=None):
+    '''
+    Yields (key, value) for the top-level dict of a plist file,
+    parsing the file in chunks. No tree for the whole file is built.
+    '''
+    if not os.path.exists(path):
+        return
+    handler = _PlistStream(wanted_keys)
+    parser = xml.parsers.expat.ParserCreate()
+    parser.buffer_text = True
+    parser.StartElementHandler = handler.start
+    parser.EndElementHandler = handler.end
+    parser.CharacterDataHandler = handler.characters
+    with open(path, 'rb') as blob:
+        while True:
+            chunk = blob.read(CHUNK_SIZE)
+            parser.Parse(chunk, not chunk)
+            yield from handler.items
+            handler.items = []
+            if not chunk:
+                break
+
+
+def read_kerning(ufo_path):
+    '''
+    Returns the kerning of a UFO as a flat {(first, second): value} dict.
+    kerning.plist only contains two levels of dicts, so the parser
+    only needs to handle closing tags.
+    '''
+    kerning = {}
+    plist_path = os.path.join(ufo_path, 'kerning.plist')
+    if not os.path.exists(plist_path):
+        return kerning
+
+    text = []
+    first = None
+    second = None
+
+    def end(name):
+        nonlocal first, second
+        if name == 'key':
+            # whitespace between tags ends up in the text, too
+            if first is None:
+                first = ''.join(text).strip()
+            else:
+                second = ''.join(text).strip()
+        elif name == 'integer':
+            kerning[first, second] = int(''.join(text))
+        elif name == 'real':
+            kerning[first, second] = float(''.join(text))
+        elif name == 'dict':
+            first = None
+        text.clear()
+
+    parser = xml.parsers.expat.ParserCreate()
+    parser.buffer_text = True
+    parser.EndElementHandler = end
+    parser.CharacterDataHandler = text.append
+    with open(plist_path, 'rb') as blob:
+        while True:
+            chunk = blob.read(CHUNK_SIZE)
+            parser.Parse(chunk, not chunk)
+            if not chunk:
+                break
+    return kerning
+
+
+def write_kerning(ufo_path, kerning):
+    '''
+    Writes a flat {(first, second): value} dict to the kerning.plist
+    of a UFO, removing the file if there is no kerning.
+    '''
+    plist_path = os.path.join(ufo_path, 'kerning.plist')
+    if not kerning:
+        if os.path.exists(plist_path):
+            os.remove(plist_path)
+        return
+    nested = {}
+    for (first, second), value in sorted(kerning.items()):
+        nested.setdefault(first, {})[second] = value
+    with open(plist_path, 'wb') as blob:
+        plistlib.dump(nested, blob)
+
+
+def read_groups(ufo_path):
+    plist_path = os.path.join(ufo_path, 'groups.plist')
+    return {
+        group_name: glyph_list for group_name, glyph_list in
+        iter_plist_items(plist_path)}
+
+
+def read_fontinfo(ufo_path, keys=(
+    'familyName', 'styleName', 'postscriptFontName', 'unitsPerEm')
+):
+    plist_path = os.path.join(ufo_path, 'fontinfo.plist')
+    return dict(iter_plist_items(plist_path, wanted_keys=set(keys)))
+
+
+def read_glyph_order(ufo_path):
+    '''
+    Returns public.glyphOrder from lib.plist, or the glyph names listed
+    in the default layer’s contents.plist if there is no glyph order.
+    '''
+    lib_path = os.path.join(ufo_path, 'lib.plist')
+    for _, glyph_order in iter_plist_items(
+        lib_path, wanted_keys={'public.glyphOrder'}
+    ):
+        return glyph_order
+    contents_path = os.path.join(ufo_path, 'glyphs', 'contents.plist')
+    return [
+        glyph_name for glyph_name, _ in iter_plist_items(contents_path)]
+
+
+class HeadlessInfo(object):
+
+    def __init__(self, info_dict):
+        self.__dict__.update(info_dict)
+
+    def __getattr__(self, attribute):
+        if attribute.startswith('__'):
+            raise AttributeError(attribute)
+        # unset font info attributes are None, as in fontParts
+        return None
+
+
+class HeadlessKerning(dict):
+    '''
+    Kerning dictionary with the find() method of fontParts kerning.
+    '''
+
+    def __init__(self, kerning, groups):
+        super(HeadlessKerning, self).__init__(kerning)
+        self.groups = groups
+        self._group_maps = None
+
+    def find(self, pair, default=0):
+        if self._group_maps is None:
+            self._group_maps = kerningHelper._make_grouped_dicts(self.groups)
+        glyph_to_first, glyph_to_second = self._group_maps
+        return lookupKerningValue(
+            pair, self, self.groups, fallback=default,
+            glyphToFirstGroup=glyph_to_first,
+            glyphToSecondGroup=glyph_to_second)
+
+
+class HeadlessFont(object):
+    '''
+    The kerning-relevant parts of a UFO, read without fontParts
+    and without parsing any glyphs. Attributes mirror those of
+    fontParts fonts, so kerningHelper functions accept it.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.groups = read_groups(path)
+        self.kerning = HeadlessKerning(read_kerning(path), self.groups)
+        self.info = HeadlessInfo(read_fontinfo(path))
+        self.glyphOrder = read_glyph_order(path)
+        self.lib = {'public.glyphOrder': self.glyphOrder}
+
+    def __repr__(self):
+        return '<HeadlessFont {}>'.format(os.path.basename(self.path))
+
+
+def _load_master(ufo_path):
+    '''
+    Everything that can be done for a single master on its own:
+    reading it, building its lookup tables and finding its exceptions.
+    '''
+    font = HeadlessFont(ufo_path)
+    index = kernResolver.ResolutionIndex.from_font(font)
+    index.exceptions()
+    font.kerning._group_maps = index.first_groups, index.second_groups
+    return font, index
+
+
+def load_masters(ufo_paths, workers=1):
+    '''
+    Loads a list of UFO paths, returns a list of fonts and a list of
+    their ResolutionIndex objects, in the order of *ufo_paths*.
+    With more than one worker, masters are processed in a process pool
+    (workers=None uses one process per CPU). Not meant to be used inside
+    RoboFont, where sys.executable is the app itself.
+    '''
+    ufo_paths = list(ufo_paths)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(ufo_paths))
+    if workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            # map() returns results in order of submission
+            results = list(executor.map(_load_master, ufo_paths))
+    else:
+        results = [_load_master(path) for path in ufo_paths]
+    fonts = [font for font, _ in results]
+    indexes = [index for _, index in results]
+    return fonts, indexes
+
+
+def load_fonts(ufo_paths, workers=1):
+    '''
+    Loads a list of UFO paths (e.g. from fontSorter.get_font_paths),
+    the result can be passed to kerningHelper.get_combined_kern_dict.
+    '''
+    if workers == 1:
+        return [HeadlessFont(path) for path in ufo_paths]
+    return load_masters(ufo_paths, workers)[0]
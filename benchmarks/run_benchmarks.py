@@ -0,0 +1,371 @@
+'''
+Timed and memory-profiled benchmarks of the Kern-A-Lytics functions,
+on synthetic families of different sizes. Results are compared with a
+stored baseline, any regression beyond the tolerance exits with status 1.
+'''
+
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+benchmark_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(
+    benchmark_dir, '..', 'Kern-A-Lytics.roboFontExt', 'lib'))
+
+import fontSorter  # noqa: E402
+import gposLoader  # noqa: E402
+import kernBatch  # noqa: E402
+import kernCache  # noqa: E402
+import kernClusters  # noqa: E402
+import kernDiff  # noqa: E402
+import kernFilters  # noqa: E402
+import kernFlatten  # noqa: E402
+import kernGroups  # noqa: E402
+import kernInterpolation  # noqa: E402
+import kernJournal  # noqa: E402
+import kerningHelper  # noqa: E402
+import kernPrune  # noqa: E402
+import ufoLoader  # noqa: E402
+import synthetic_family  # noqa: E402
+
+BASELINE_PATH = os.path.join(benchmark_dir, 'baseline.json')
+
+sizes = {
+    'small': dict(
+        masters=2, glyphs=200, groups=15, group_size=5, pairs=2000),
+    'medium': dict(
+        masters=8, glyphs=800, groups=60, group_size=6, pairs=20000),
+    'huge': dict(
+        masters=30, glyphs=2000, groups=150, group_size=8, pairs=80000),
+}
+
+# timed runs per benchmark, the fastest one counts
+repeats = {'small': 5, 'medium': 3, 'huge': 1}
+
+# compiling kerning to GPOS is slow, only this many masters are compiled
+binary_masters = 2
+
+
+class Family(object):
+    '''
+    A synthetic family, loaded once. Benchmarks which depend on memoized
+    state (e.g. matrix statistics) get fresh objects in their setup.
+    '''
+
+    def __init__(self, output_dir, **parameters):
+        self.output_dir = output_dir
+        self.ufo_paths = synthetic_family.make_family(
+            output_dir, **parameters)
+        self.cache_dir = os.path.join(output_dir, 'cache')
+        self.fonts = ufoLoader.load_fonts(self.ufo_paths)
+        self.cmb_kerning = kerningHelper.get_combined_kern_dict(self.fonts)
+        self.pair_list = list(self.cmb_kerning.keys())
+        font = self.fonts[0]
+        first_groups, _ = kerningHelper._make_grouped_dicts(font.groups)
+        self.grouped_glyph = sorted(first_groups)[0]
+
+        self.master_names = [
+            kernJournal.master_name(font) for font in self.fonts]
+        self._binary_paths = None
+        self._journal_path = None
+
+    def fresh_kerning(self):
+        return kerningHelper.get_combined_kern_dict(self.fonts)
+
+    def fresh_fonts(self):
+        '''
+        Fonts and their combined kerning matrix, to be edited.
+        '''
+        fonts = ufoLoader.load_fonts(self.ufo_paths)
+        return fonts, kerningHelper.get_combined_kern_dict(fonts).matrix
+
+    def binary_paths(self):
+        '''
+        Compiled fonts of the first masters, written on first use.
+        '''
+        if self._binary_paths is None:
+            self._binary_paths = synthetic_family.make_binaries(
+                os.path.join(self.output_dir, 'binaries'),
+                self.ufo_paths[:binary_masters])
+        return self._binary_paths
+
+    def journal_path(self):
+        '''
+        An exported journal of a batch edit (see _edited_fonts), written
+        on first use.
+        '''
+        if self._journal_path is None:
+            _, _, journal = _edited_fonts(self)
+            self._journal_path = os.path.join(self.output_dir, 'edits.json')
+            journal.export(self._journal_path, self.master_names)
+        return self._journal_path
+
+
+def _cmb_kerning(family):
+    return (family.fresh_kerning(),)
+
+
+def _edited_fonts(family):
+    '''
+    Fonts after a journaled batch edit of every tenth pair.
+    '''
+    fonts, matrix = family.fresh_fonts()
+    journal = kernJournal.EditJournal()
+    kernBatch.batch_edit(
+        fonts, matrix, matrix.pairs[::10], 'offset', journal=journal,
+        amount=10)
+    return fonts, matrix, journal
+
+
+def _changed_matrices(family):
+    '''
+    The combined kerning matrix, and a copy with every tenth pair
+    kerned 10 units tighter.
+    '''
+    new = family.fresh_kerning().matrix
+    rows = list(range(0, len(new), 10))
+    new.set_rows(rows, *kernBatch.compute(new, rows, 'offset', amount=-10))
+    return (
+        family.cmb_kerning.matrix, new, family.master_names,
+        family.master_names)
+
+
+def _interpolation_model(family):
+    if len(family.ufo_paths) < 3:
+        return None
+    return (
+        kernInterpolation.InterpolationModel.from_paths(family.ufo_paths),
+        family.cmb_kerning.matrix)
+
+
+benchmarks = [
+    # name, setup (returns arguments, None if not applicable), function
+    ('ufoLoader.load_fonts',
+        lambda family: (family.ufo_paths,),
+        ufoLoader.load_fonts),
+    ('fontSorter.sort_fonts',
+        lambda family: (family.ufo_paths,),
+        fontSorter.sort_fonts),
+    ('kerningHelper.get_combined_kern_dict',
+        lambda family: (family.fonts,),
+        kerningHelper.get_combined_kern_dict),
+    ('kerningHelper.same_value_dict',
+        _cmb_kerning, kerningHelper.same_value_dict),
+    ('kerningHelper.zero_value_dict',
+        _cmb_kerning, kerningHelper.zero_value_dict),
+    ('kerningHelper.outlier_dict',
+        _cmb_kerning, kerningHelper.outlier_dict),
+    ('kerningHelper.high_gamut_dict',
+        _cmb_kerning, kerningHelper.high_gamut_dict),
+    ('kerningHelper.largest_value_dict',
+        _cmb_kerning, kerningHelper.largest_value_dict),
+    ('kerningHelper.small_average_dict',
+        _cmb_kerning, kerningHelper.small_average_dict),
+    ('kerningHelper.single_pair_dict',
+        _cmb_kerning, kerningHelper.single_pair_dict),
+    ('kerningHelper.single_exception_list',
+        lambda family: (family.fonts[0],),
+        kerningHelper.single_exception_list),
+    ('kerningHelper.exception_base_dict',
+        lambda family: (family.fonts,),
+        kerningHelper.exception_base_dict),
+    ('kerningHelper.exception_dict',
+        lambda family: (family.fonts, family.cmb_kerning),
+        kerningHelper.exception_dict),
+    ('kerningHelper.filter_pair_list_by_items',
+        lambda family: (
+            family.fonts[0], family.pair_list, family.grouped_glyph, ''),
+        kerningHelper.filter_pair_list_by_items),
+    ('kerningHelper.ReprPairCache.get_repr_pair',
+        lambda family: (
+            kerningHelper.ReprPairCache(), family.fonts[0],
+            family.pair_list[::max(len(family.pair_list) // 500, 1)]),
+        lambda cache, font, pairs: [
+            cache.get_repr_pair(font, pair) for pair in pairs]),
+    ('kernFilters.FilterIndex.rows',
+        lambda family: (kernFilters.FilterIndex(family.fresh_kerning().matrix),),
+        lambda index: [
+            index.rows(name) for name in
+            index.row_filters + ('single', 'largest_value', 'high_gamut')]),
+    ('kernInterpolation.InterpolationModel.outlier_rows',
+        _interpolation_model,
+        lambda model, matrix: model.outlier_rows(matrix)),
+    ('kernClusters.ValueClusters',
+        lambda family: (family.cmb_kerning.matrix, 2),
+        kernClusters.ValueClusters),
+    ('kernGroups.suggest_groups',
+        lambda family: (
+            family.cmb_kerning.matrix, family.fonts[0].groups, 2,
+            family.fonts[0].glyphOrder),
+        kernGroups.suggest_groups),
+    ('kernPrune.redundant_exceptions',
+        lambda family: (family.fonts,),
+        kernPrune.redundant_exceptions),
+    ('kernBatch.batch_edit',
+        lambda family: family.fresh_fonts(),
+        lambda fonts, matrix: kernBatch.batch_edit(
+            fonts, matrix, matrix.pairs, 'average')),
+    ('kernJournal.EditJournal.undo',
+        _edited_fonts,
+        lambda fonts, matrix, journal: journal.undo(fonts, matrix)),
+    ('kernJournal.replay',
+        lambda family: (
+            family.journal_path(), family.fresh_fonts()[0],
+            family.master_names),
+        kernJournal.replay),
+    ('kernFlatten.Flattener.count',
+        lambda family: (family.fonts,),
+        lambda fonts: kernFlatten.Flattener(fonts).count()),
+    ('kernDiff.KernDiff',
+        _changed_matrices,
+        kernDiff.KernDiff),
+    # only the first binary_masters masters
+    ('gposLoader.load_masters',
+        lambda family: (family.binary_paths(),),
+        gposLoader.load_masters),
+    ('kernCache.KernCache.matrix (cold)',
+        lambda family: (
+            kernCache.KernCache(tempfile.mkdtemp(dir=family.cache_dir)),
+            family.fonts),
+        lambda cache, fonts: cache.matrix(fonts)),
+    ('kernCache.KernCache.matrix (warm)',
+        lambda family: (kernCache.KernCache(family.cache_dir), family.fonts),
+        lambda cache, fonts: cache.matrix(fonts)),
+]
+
+
+def measure(function, setup, family, repeat):
+    '''
+    Returns the fastest time of *repeat* runs, and the peak of memory
+    allocated during one more run, in KiB.
+    '''
+    times = []
+    for _ in range(repeat):
+        arguments = setup(family)
+        gc.collect()
+        start = time.perf_counter()
+        function(*arguments)
+        times.append(time.perf_counter() - start)
+
+    arguments = setup(family)
+    gc.collect()
+    tracemalloc.start()
+    function(*arguments)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(times), peak / 1024
+
+
+def run(size_names, verbose=True):
+    results = {}
+    for size_name in size_names:
+        results[size_name] = {}
+        with tempfile.TemporaryDirectory() as output_dir:
+            family = Family(output_dir, **sizes[size_name])
+            os.makedirs(family.cache_dir)
+            # the warm cache benchmark needs a cache to start from
+            kernCache.KernCache(family.cache_dir).matrix(family.fonts)
+            for name, setup, function in benchmarks:
+                if setup(family) is None:
+                    continue
+                seconds, peak_kib = measure(
+                    function, setup, family, repeats[size_name])
+                results[size_name][name] = {
+                    'seconds': round(seconds, 5),
+                    'peak_kib': round(peak_kib, 1),
+                }
+                if verbose:
+                    print('{:>6} {:<50} {:>9.4f} s {:>10.1f} KiB'.format(
+                        size_name, name, seconds, peak_kib))
+    return results
+
+
+def compare(results, baseline, time_factor, memory_factor):
+    '''
+    Returns messages for all results worse than the baseline by more
+    than the given factors. Tiny differences are ignored as noise.
+    '''
+    messages = []
+    for size_name, size_results in results.items():
+        for name, result in size_results.items():
+            base = baseline.get(size_name, {}).get(name)
+            if base is None:
+                continue
+            if (
+                result['seconds'] > base['seconds'] * time_factor and
+                result['seconds'] - base['seconds'] > .005
+            ):
+                messages.append('{} {}: {:.4f} s (baseline {:.4f} s)'.format(
+                    size_name, name, result['seconds'], base['seconds']))
+            if (
+                result['peak_kib'] > base['peak_kib'] * memory_factor and
+                result['peak_kib'] - base['peak_kib'] > 64
+            ):
+                messages.append(
+                    '{} {}: {:.1f} KiB (baseline {:.1f} KiB)'.format(
+                        size_name, name, result['peak_kib'],
+                        base['peak_kib']))
+    return messages
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Kern-A-Lytics benchmarks on synthetic UFO families')
+
+    parser.add_argument(
+        '-s', '--sizes',
+        nargs='+',
+        choices=list(sizes),
+        default=list(sizes),
+        help='Family sizes to benchmark (default: all).')
+
+    parser.add_argument(
+        '-b', '--baseline',
+        default=BASELINE_PATH,
+        metavar='FILE',
+        help='Baseline results (default: benchmarks/baseline.json).')
+
+    parser.add_argument(
+        '-u', '--update_baseline',
+        action='store_true',
+        default=False,
+        help='Store the results as the new baseline.')
+
+    parser.add_argument(
+        '--time_factor', type=float, default=1.5,
+        help='Allowed slowdown against the baseline (default: 1.5)')
+    parser.add_argument(
+        '--memory_factor', type=float, default=1.25,
+        help='Allowed memory growth against the baseline (default: 1.25)')
+
+    args = parser.parse_args()
+
+    results = run(args.sizes)
+
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, 'r') as blob:
+                baseline = json.load(blob)
+        baseline.update(results)
+        with open(args.baseline, 'w') as blob:
+            json.dump(baseline, blob, indent=2, sort_keys=True)
+            blob.write('\n')
+        sys.exit()
+
+    if not os.path.exists(args.baseline):
+        sys.exit('no baseline found, run with --update_baseline first.')
+    with open(args.baseline, 'r') as blob:
+        baseline = json.load(blob)
+    regressions = compare(
+        results, baseline, args.time_factor, args.memory_factor)
+    for message in regressions:
+        print('REGRESSION', message, file=sys.stderr)
+    if regressions:
+        sys.exit(1)
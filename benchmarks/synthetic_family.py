@@ -0,0 +1,299 @@
+'''
+Generator for synthetic multi-master UFO families, for benchmarking.
+Only the files Kern-A-Lytics reads are written (kerning, groups,
+font info, glyph order) – there are no glyph outlines.
+'''
+
+import os
+import plistlib
+import random
+import shutil
+
+weight_names = ['Thin', 'Light', 'Regular', 'Medium', 'Bold', 'Black']
+width_names = ['Condensed', 'SemiCondensed', '', 'Extended', 'Wide']
+
+
+def style_names(count):
+    '''
+    Returns *count* style names, weights varying fastest.
+    '''
+    names = []
+    for index in range(count):
+        width, weight = divmod(index, len(weight_names))
+        name = width_names[width % len(width_names)] + weight_names[weight]
+        if width >= len(width_names):
+            name += str(width // len(width_names))
+        names.append(name)
+    return names
+
+
+def make_groups(glyph_order, group_count, group_size, rng):
+    '''
+    Returns *group_count* kern1 and *group_count* kern2 groups of
+    *group_size* glyphs. A glyph is in one group per side at most.
+    '''
+    groups = {}
+    for prefix in ('public.kern1.', 'public.kern2.'):
+        pool = list(glyph_order)
+        rng.shuffle(pool)
+        size = min(group_size, len(pool) // max(group_count, 1))
+        for index in range(group_count):
+            members = pool[index * size:(index + 1) * size]
+            if not members:
+                break
+            groups['{}G{:04d}'.format(prefix, index)] = sorted(members)
+    return groups
+
+
+def make_pairs(glyph_order, groups, pair_count, exception_ratio, rng):
+    '''
+    Returns a list of pairs, about *exception_ratio* of them are
+    exceptions (a group member kerned against something its group
+    is kerned against, too).
+    '''
+    first_groups = [name for name in groups if name.startswith('public.kern1.')]
+    second_groups = [
+        name for name in groups if name.startswith('public.kern2.')]
+    left_items = glyph_order + first_groups * 4
+    right_items = glyph_order + second_groups * 4
+
+    exception_count = int(pair_count * exception_ratio)
+    base_count = pair_count - exception_count
+    pairs = set()
+    while len(pairs) < base_count:
+        pairs.add((rng.choice(left_items), rng.choice(right_items)))
+    base_pairs = sorted(pairs)
+    group_pairs = [
+        pair for pair in base_pairs if
+        pair[0] in groups or pair[1] in groups]
+
+    attempts = 0
+    while (
+        group_pairs and len(pairs) < pair_count and
+        attempts < exception_count * 20
+    ):
+        attempts += 1
+        first, second = rng.choice(group_pairs)
+        if first in groups and (second not in groups or rng.random() < .5):
+            first = rng.choice(groups[first])
+        else:
+            second = rng.choice(groups[second])
+        pairs.add((first, second))
+    return sorted(pairs)
+
+
+def master_kerning(pairs, base_values, master, master_count, sparsity, rng):
+    kerning = {}
+    factor = 1 + master / max(master_count - 1, 1)
+    for pair, base_value in zip(pairs, base_values):
+        if rng.random() < sparsity:
+            continue
+        value = round(base_value * factor) + rng.randint(-3, 3)
+        if rng.random() < .01:
+            # an outlier
+            value *= 8
+        kerning[pair] = value
+    return kerning
+
+
+def write_ufo(ufo_path, family_name, style_name, glyph_order, groups, kerning):
+    if os.path.exists(ufo_path):
+        shutil.rmtree(ufo_path)
+    os.makedirs(os.path.join(ufo_path, 'glyphs'))
+
+    nested_kerning = {}
+    for (first, second), value in kerning.items():
+        nested_kerning.setdefault(first, {})[second] = value
+
+    plists = {
+        'metainfo.plist': {
+            'creator': 'kernalytics.benchmarks', 'formatVersion': 3},
+        'fontinfo.plist': {
+            'familyName': family_name,
+            'styleName': style_name,
+            'postscriptFontName': '{}-{}'.format(
+                family_name.replace(' ', ''), style_name),
+            'unitsPerEm': 1000,
+        },
+        'groups.plist': groups,
+        'kerning.plist': nested_kerning,
+        'lib.plist': {'public.glyphOrder': glyph_order},
+        'layercontents.plist': [['public.default', 'glyphs']],
+        os.path.join('glyphs', 'contents.plist'): {
+            glyph_name: glyph_name + '.glif' for glyph_name in glyph_order},
+    }
+    for file_name, data in plists.items():
+        with open(os.path.join(ufo_path, file_name), 'wb') as blob:
+            plistlib.dump(data, blob)
+
+
+def make_family(
+    output_dir, masters=4, glyphs=500, groups=40, group_size=6,
+    pairs=5000, exception_ratio=.1, sparsity=.1, seed=1,
+    family_name='Synthetic Sans'
+):
+    '''
+    Writes a family of UFO masters sharing glyphs, groups and pairs
+    to *output_dir*, returns the UFO paths (unsorted).
+    *sparsity* is the probability of a pair to be missing in a master.
+    '''
+    rng = random.Random(seed)
+    glyph_order = ['g{:05d}'.format(index) for index in range(glyphs)]
+    font_groups = make_groups(glyph_order, groups, group_size, rng)
+    pair_list = make_pairs(
+        glyph_order, font_groups, pairs, exception_ratio, rng)
+    base_values = [rng.randint(-120, 40) for _ in pair_list]
+
+    ufo_paths = []
+    for master, style_name in enumerate(style_names(masters)):
+        kerning = master_kerning(
+            pair_list, base_values, master, masters, sparsity, rng)
+        ufo_path = os.path.join(output_dir, '{}-{}.ufo'.format(
+            family_name.replace(' ', ''), style_name))
+        write_ufo(
+            ufo_path, family_name, style_name, glyph_order, font_groups,
+            kerning)
+        ufo_paths.append(ufo_path)
+    return ufo_paths
+
+
+def _read_plist(ufo_path, file_name):
+    with open(os.path.join(ufo_path, file_name), 'rb') as blob:
+        return plistlib.load(blob)
+
+
+def write_binary(binary_path, ufo_path):
+    '''
+    Compiles the kerning of a synthetic UFO into the kern feature of a
+    TTF without outlines: one lookup with a subtable of glyph pairs
+    (group–glyph and glyph–group pairs expanded to the group members,
+    in order of precedence), followed by a subtable of class pairs.
+    '''
+    from fontTools.fontBuilder import FontBuilder
+    from fontTools.otlLib import builder
+    from fontTools.pens.ttGlyphPen import TTGlyphPen
+    from fontTools.ttLib import newTable
+    from fontTools.ttLib.tables import otTables
+
+    info = _read_plist(ufo_path, 'fontinfo.plist')
+    groups = _read_plist(ufo_path, 'groups.plist')
+    glyph_order = ['.notdef'] + _read_plist(
+        ufo_path, 'lib.plist')['public.glyphOrder']
+    kerning = {}
+    for first, seconds in _read_plist(ufo_path, 'kerning.plist').items():
+        for second, value in seconds.items():
+            kerning[first, second] = value
+
+    glyph_pairs = {}
+    class_pairs = {}
+    precedence = (
+        lambda f, s: f not in groups and s not in groups,
+        lambda f, s: f not in groups,
+        lambda f, s: s not in groups,
+    )
+    for applies in precedence:
+        for (first, second), value in sorted(kerning.items()):
+            if not applies(first, second):
+                continue
+            record = (builder.buildValue({'XAdvance': value}), None)
+            for left in groups.get(first, [first]):
+                for right in groups.get(second, [second]):
+                    glyph_pairs.setdefault((left, right), record)
+    for (first, second), value in kerning.items():
+        if first in groups and second in groups:
+            class_pairs[tuple(groups[first]), tuple(groups[second])] = (
+                builder.buildValue({'XAdvance': value}), None)
+
+    font_builder = FontBuilder(1000, isTTF=True)
+    font_builder.setupGlyphOrder(glyph_order)
+    font_builder.setupCharacterMap({})
+    empty_glyph = TTGlyphPen(None).glyph()
+    font_builder.setupGlyf({name: empty_glyph for name in glyph_order})
+    font_builder.setupHorizontalMetrics(
+        {name: (500, 0) for name in glyph_order})
+    font_builder.setupHorizontalHeader(ascent=800, descent=-200)
+    font_builder.setupNameTable({
+        'familyName': info['familyName'],
+        'styleName': info['styleName'],
+        'psName': info['postscriptFontName'],
+    })
+    font_builder.setupOS2()
+    font_builder.setupPost()
+
+    glyph_map = font_builder.font.getReverseGlyphMap()
+    subtables = builder.buildPairPosGlyphs(glyph_pairs, glyph_map)
+    if class_pairs:
+        subtables.append(
+            builder.buildPairPosClassesSubtable(class_pairs, glyph_map))
+    gpos = otTables.GPOS()
+    gpos.Version = 0x00010000
+    gpos.LookupList = otTables.LookupList()
+    gpos.LookupList.Lookup = [builder.buildLookup(subtables)]
+    gpos.LookupList.LookupCount = 1
+    feature_record = otTables.FeatureRecord()
+    feature_record.FeatureTag = 'kern'
+    feature_record.Feature = otTables.Feature()
+    feature_record.Feature.LookupListIndex = [0]
+    feature_record.Feature.LookupCount = 1
+    gpos.FeatureList = otTables.FeatureList()
+    gpos.FeatureList.FeatureRecord = [feature_record]
+    gpos.FeatureList.FeatureCount = 1
+    language_system = otTables.DefaultLangSys()
+    language_system.ReqFeatureIndex = 0xFFFF
+    language_system.FeatureIndex = [0]
+    language_system.FeatureCount = 1
+    language_system.LookupOrder = None
+    script_record = otTables.ScriptRecord()
+    script_record.ScriptTag = 'DFLT'
+    script_record.Script = otTables.Script()
+    script_record.Script.DefaultLangSys = language_system
+    script_record.Script.LangSysRecord = []
+    script_record.Script.LangSysCount = 0
+    gpos.ScriptList = otTables.ScriptList()
+    gpos.ScriptList.ScriptRecord = [script_record]
+    gpos.ScriptList.ScriptCount = 1
+    font_builder.font['GPOS'] = newTable('GPOS')
+    font_builder.font['GPOS'].table = gpos
+    font_builder.save(binary_path)
+
+
+def make_binaries(output_dir, ufo_paths):
+    '''
+    Compiles synthetic UFOs (see write_binary) to *output_dir*,
+    returns the TTF paths.
+    '''
+    os.makedirs(output_dir, exist_ok=True)
+    binary_paths = []
+    for ufo_path in ufo_paths:
+        name = os.path.splitext(os.path.basename(ufo_path))[0]
+        binary_path = os.path.join(output_dir, name + '.ttf')
+        write_binary(binary_path, ufo_path)
+        binary_paths.append(binary_path)
+    return binary_paths
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Write a synthetic UFO family for benchmarking')
+    parser.add_argument(
+        'output_dir', metavar='FOLDER', help='Output directory.')
+    parser.add_argument('--masters', type=int, default=4)
+    parser.add_argument('--glyphs', type=int, default=500)
+    parser.add_argument(
+        '--groups', type=int, default=40, help='Groups per side.')
+    parser.add_argument('--group_size', type=int, default=6)
+    parser.add_argument('--pairs', type=int, default=5000)
+    parser.add_argument('--exception_ratio', type=float, default=.1)
+    parser.add_argument('--sparsity', type=float, default=.1)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    for ufo_path in make_family(
+        args.output_dir, masters=args.masters, glyphs=args.glyphs,
+        groups=args.groups, group_size=args.group_size, pairs=args.pairs,
+        exception_ratio=args.exception_ratio, sparsity=args.sparsity,
+        seed=args.seed
+    ):
+        print(ufo_path)